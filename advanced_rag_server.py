@@ -4,45 +4,46 @@ Advanced RAG Server for MedDoc AI Flow
 A production-ready Flask server that can actually read PDF content and provide intelligent answers.
 """
 
-# Importeer de benodigde bibliotheken en modules
-try:
-    from llama_index import GPTVectorStoreIndex, SimpleDirectoryReader, Document, ServiceContext
-    from langchain.chat_models import ChatOpenAI
-    ADVANCED_RAG_AVAILABLE = True
-except ImportError as e:
-    print(f"Advanced RAG libraries not available: {e}")
-    ADVANCED_RAG_AVAILABLE = False
-
-try:
-    from supabase import create_client, Client
-    SUPABASE_AVAILABLE = True
-except ImportError:
-    print("Supabase library not available")
-    SUPABASE_AVAILABLE = False
-
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import hmac
 import os
-import requests
-import tempfile
 from datetime import datetime
 import logging
 import re
-from typing import List, Dict, Optional
+import time
+from typing import Iterator, List, Dict, Mapping, Optional, Tuple
 import json
+from concurrent.futures import Future, ThreadPoolExecutor
 
-# PDF and document processing
-try:
-    import PyPDF2
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
+import rag_capabilities
+from rag_analysis import DEFAULT_ANALYZER, get_analyzer
+from rag_ann import NUMPY_AVAILABLE
+from rag_chunking import IncrementalChunker, chunk_text
+from rag_conversations import DEFAULT_MAX_CONVERSATIONS, DEFAULT_TTL_SECONDS, RETRIEVALS, ConversationCache
+from rag_document_table import DocumentTable
+from rag_download import (DEFAULT_MAX_BYTES, TEXT_ERRORS, DownloadRejected, KnownVersion, StreamedDownload,
+                          spool_bytes, stream_download)
+from rag_extraction_cache import Extraction, ExtractionCache, chunk_spans, storage_path
+from rag_index import CorpusIndex, IndexReader
+from rag_ocr import OCRStage, page_images
+from rag_metrics import (CONTENT_TYPE, REGISTRY, REQUEST_SECONDS, REQUESTS, current_timings, span, start_timings,
+                         timings_block)
+from rag_profiler import SlowRequestProfiler
+from rag_rerank import FeatureReranker
+from rag_shared_index import SharedIndex
 
-try:
-    from docx import Document as DocxDocument
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
+# Optional dependencies are probed here and imported on first use (rag_capabilities),
+# so a cold start and /health never pay for PyPDF2, python-docx, numpy or requests
+PDF_AVAILABLE = rag_capabilities.available("pdf")
+DOCX_AVAILABLE = rag_capabilities.available("docx")
+SUPABASE_AVAILABLE = rag_capabilities.available("supabase")
+PyPDF2 = rag_capabilities.lazy_module("pdf")
+docx = rag_capabilities.lazy_module("docx")
+requests = rag_capabilities.lazy_module("http")
+
+if os.environ.get('RAG_PRELOAD_IMPORTS'):
+    rag_capabilities.preload()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -51,10 +52,113 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
-# In-memory storage for documents and their content
-documents_store = {}
-document_contents = {}
-document_chunks = {}
+# In-memory corpus index (documents, content, chunks and postings); RAG_ANALYZER picks
+# the text analysis chain ("dutch" by default, "whitespace" for the old split())
+analyzer = get_analyzer(os.environ.get('RAG_ANALYZER', DEFAULT_ANALYZER))
+
+# Chunk embeddings go into an HNSW graph when numpy is installed; RAG_ANN_M and
+# RAG_ANN_EF_CONSTRUCTION shape the graph, RAG_ANN_EF_SEARCH trades latency for recall
+ANN_PARAMS = {
+    "m": int(os.environ.get('RAG_ANN_M', 16)),
+    "ef_construction": int(os.environ.get('RAG_ANN_EF_CONSTRUCTION', 100)),
+    "ef_search": int(os.environ.get('RAG_ANN_EF_SEARCH', 64)),
+}
+corpus = CorpusIndex(analyzer, ANN_PARAMS)
+
+# Multi-worker mode: set RAG_SHARED_INDEX=1 (optionally RAG_SHARED_INDEX_DIR) so all
+# workers attach the same read-only index generation instead of a private corpus
+shared_index = None
+if os.environ.get('RAG_SHARED_INDEX') or os.environ.get('RAG_SHARED_INDEX_DIR'):
+    # RAG_VECTOR_CODEC=int8|pq keeps only quantized vectors in each generation; the float32
+    # re-rank rows go to RAG_SHARED_ROWS_DIR, which should be on disk rather than /dev/shm
+    shared_index = SharedIndex(os.environ.get('RAG_SHARED_INDEX_DIR'), analyzer, ANN_PARAMS,
+                               os.environ.get('RAG_VECTOR_CODEC', 'float32'),
+                               os.environ.get('RAG_SHARED_ROWS_DIR'))
+    logger.info(f"Shared index enabled: {shared_index.directory}")
+
+# Cross-document retrieval keeps one global top-k; RAG_SEARCH_SHARDS > 1 scores
+# chunk id ranges in parallel on a thread pool and merges the partial heaps
+CROSS_DOCUMENT_CHUNKS = 5
+SEARCH_SHARDS = int(os.environ.get('RAG_SEARCH_SHARDS', 1))
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_SHARDS) if SEARCH_SHARDS > 1 else None
+
+# RAG_RERANK=1 re-orders the top RAG_RERANK_CANDIDATES lexical hits by term coverage,
+# title match and recency, stopping after RAG_RERANK_BUDGET_MS
+reranker = None
+if os.environ.get('RAG_RERANK', '0').lower() in ('1', 'true', 'yes', 'on'):
+    reranker = FeatureReranker(float(os.environ.get('RAG_RERANK_BUDGET_MS', 15)),
+                               int(os.environ.get('RAG_RERANK_CANDIDATES', 20)))
+
+# Follow-ups in a conversation (conversation_id) are searched in the documents its last
+# answers came from first; the full search runs when the best hit there matches less
+# than FOLLOW_UP_MIN_COVERAGE of the question terms
+conversations = ConversationCache(int(os.environ.get('RAG_CONVERSATION_CACHE_SIZE', DEFAULT_MAX_CONVERSATIONS)),
+                                  float(os.environ.get('RAG_CONVERSATION_TTL', DEFAULT_TTL_SECONDS)))
+FOLLOW_UP_MIN_COVERAGE = 0.5
+
+# Largest number of questions one /chat/batch request may carry
+BATCH_MAX_QUESTIONS = int(os.environ.get('RAG_BATCH_MAX_QUESTIONS', 100))
+
+# Downloads above this size are aborted as soon as the size is known (RAG_MAX_DOWNLOAD_MB)
+MAX_DOWNLOAD_BYTES = DEFAULT_MAX_BYTES
+
+# Extraction results shared with the other servers and scripts, keyed by file content
+# and storage object version (RAG_EXTRACTION_CACHE_DIR, a private per-user directory,
+# bounded by RAG_EXTRACTION_CACHE_MB / _DAYS; RAG_EXTRACTION_CACHE=0 disables)
+extraction_cache = ExtractionCache.from_environment()
+
+# Scanned PDF pages (no text layer) are OCR'd on a separate process pool (RAG_OCR_WORKERS)
+# and merged back into the document on a background thread; None without an OCR engine
+ocr_stage = OCRStage.from_environment(extraction_cache)
+ocr_merge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr-merge") if ocr_stage else None
+
+# PDFs are indexed RAG_PAGE_WINDOW pages at a time so a large document is searchable
+# while it is still being extracted; in shared-index mode every partial publish writes
+# a whole generation, so those come at most every RAG_PARTIAL_PUBLISH_SECONDS
+PAGE_WINDOW = int(os.environ.get('RAG_PAGE_WINDOW', 8))
+PARTIAL_PUBLISH_SECONDS = float(os.environ.get('RAG_PARTIAL_PUBLISH_SECONDS', 2))
+
+# /documents is served from a columnar copy of the document metadata with client,
+# type and date indexes, re-synced when the served index changes generation
+document_table = DocumentTable()
+# Largest page /documents returns when a limit is given
+DOCUMENT_PAGE_LIMIT = int(os.environ.get('RAG_DOCUMENT_PAGE_LIMIT', 1000))
+
+# Optional document metadata accepted on ingest and used by the /documents filters
+INGEST_METADATA_FIELDS = ("client_id", "document_type", "category", "date")
+
+# Opt-in profiling of slow requests (RAG_PROFILE_SLOW_MS); None when disabled
+profiler = SlowRequestProfiler.from_environment()
+
+# Required as X-Admin-Token on /admin endpoints, which stay closed while it is unset
+ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN')
+
+def get_index() -> IndexReader:
+    """Return the index to query: the current shared generation or the local corpus"""
+    if shared_index is not None:
+        return shared_index.current() or corpus
+    return corpus
+
+def store_document_window(document_id: str, metadata: Dict, text: str, chunks: List[str],
+                          features: List[Dict], first: bool):
+    """Index one window of an incrementally ingested document; the first replaces any older version"""
+    def mutate(index: CorpusIndex):
+        if first:
+            index.add_document(document_id, metadata, text, chunks, features=features)
+        else:
+            index.append_chunks(document_id, metadata, text, chunks, features=features)
+
+    if shared_index is not None:
+        shared_index.update(mutate)
+    else:
+        mutate(corpus)
+
+def unstore_document(document_id: str):
+    """Drop a document from the local corpus or the shared generation"""
+    if shared_index is not None:
+        shared_index.update(lambda index: index.remove_document(document_id))
+    else:
+        corpus.remove_document(document_id)
 
 class DocumentProcessor:
     """Handles document text extraction and processing"""
@@ -66,16 +170,29 @@ class DocumentProcessor:
             return "PDF processing not available. Install PyPDF2: pip install PyPDF2"
         
         try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text.strip()
+            return "".join(DocumentProcessor.iter_pdf_pages(file_path)).strip()
         except Exception as e:
             logger.error(f"Error extracting PDF text: {e}")
             return f"Error reading PDF: {str(e)}"
     
+    @staticmethod
+    def iter_pdf_pages(file_path: str, ocr_pending: Optional[Dict[int, Future]] = None) -> Iterator[str]:
+        """Yield the text of a PDF one page at a time; raises on unreadable files
+
+        With ocr_pending, pages without a text layer are submitted to the OCR stage
+        and their futures stored by page number; they still yield their empty text.
+        """
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for number, page in enumerate(pdf_reader.pages):
+                text = page.extract_text()
+                if ocr_pending is not None and ocr_stage is not None and ocr_stage.needs_ocr(text) \
+                        and len(ocr_pending) < ocr_stage.max_pages:
+                    images = page_images(page)
+                    if images:
+                        ocr_pending[number] = ocr_stage.submit(images)
+                yield text + "\n"
+    
     @staticmethod
     def extract_text_from_docx(file_path: str) -> str:
         """Extract text from DOCX file"""
@@ -83,7 +200,7 @@ class DocumentProcessor:
             return "DOCX processing not available. Install python-docx: pip install python-docx"
         
         try:
-            doc = DocxDocument(file_path)
+            doc = docx.Document(file_path)
             text = ""
             for paragraph in doc.paragraphs:
                 text += paragraph.text + "\n"
@@ -96,71 +213,102 @@ class DocumentProcessor:
     def extract_text_from_txt(file_path: str) -> str:
         """Extract text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+            with open(file_path, 'r', encoding='utf-8', errors=TEXT_ERRORS) as file:
                 return file.read().strip()
         except Exception as e:
             logger.error(f"Error extracting TXT text: {e}")
             return f"Error reading TXT: {str(e)}"
     
     @staticmethod
-    def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks for better context retrieval"""
-        if len(text) <= chunk_size:
-            return [text]
-        
-        chunks = []
+    def extract_text(file_path: str, file_extension: str) -> str:
+        """Extract text with the parser that matches the file extension"""
+        if file_extension == 'pdf':
+            return DocumentProcessor.extract_text_from_pdf(file_path)
+        elif file_extension in ['docx', 'doc']:
+            return DocumentProcessor.extract_text_from_docx(file_path)
+        elif file_extension == 'txt':
+            return DocumentProcessor.extract_text_from_txt(file_path)
+        return "Unsupported file format. Supported: PDF, DOCX, TXT"
+
+class IntelligentAnswerer:
+    """Generates intelligent answers based on document content
+
+    Sentence segmentation and marker detection run once per chunk at ingest
+    (analyze_chunk); answering only slices the precomputed spans.
+    """
+    
+    DEFINITION_WORDS = ('wat', 'what', 'welke', 'which')
+    PROCEDURE_WORDS = ('hoe', 'how', 'wanneer', 'when')
+    EXPLANATION_WORDS = ('waarom', 'why', 'reden', 'reason')
+    CAUSAL_MARKERS = ('omdat', 'doordat', 'vanwege', 'reden', 'because', 'due to')
+    PROCEDURE_PATTERN = re.compile(r'^\d+\.|\b(stap|step|eerst|then|vervolgens)\b')
+    MAX_DEFINITION_SENTENCES = 5  # Focus on first few sentences
+    MAX_PROCEDURE_STEPS = 5
+    MAX_EXPLANATIONS = 3
+    
+    @staticmethod
+    def _stripped_span(text: str, start: int, end: int) -> Tuple[int, int]:
+        """Shrink a span so it excludes surrounding whitespace"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return start, end
+    
+    @staticmethod
+    def _segments(text: str, separator: str) -> List[Tuple[int, int]]:
+        """Offsets of the pieces text.split(separator) would return"""
+        segments = []
         start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # Try to break at sentence boundaries
-            if end < len(text):
-                # Look for sentence endings within the last 100 characters
-                sentence_end = text.rfind('.', start, end)
-                if sentence_end > start + chunk_size - 100:
-                    end = sentence_end + 1
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap
-            if start >= len(text):
-                break
-        
-        return chunks
+        while True:
+            end = text.find(separator, start)
+            if end == -1:
+                segments.append((start, len(text)))
+                return segments
+            segments.append((start, end))
+            start = end + len(separator)
     
     @staticmethod
-    def search_relevant_chunks(query: str, chunks: List[str], max_chunks: int = 3) -> List[str]:
-        """Simple keyword-based search for relevant chunks"""
-        query_words = set(query.lower().split())
+    def analyze_chunk(chunk: str) -> Dict[str, List[Tuple[int, int]]]:
+        """Precompute the answer spans of a chunk (stripped start/end offsets)"""
+        chunk_lower = chunk.lower()
+        strip = IntelligentAnswerer._stripped_span
+        features = {"definitions": [], "procedures": [], "explanations": [], "summary": []}
         
-        chunk_scores = []
-        for i, chunk in enumerate(chunks):
-            chunk_words = set(chunk.lower().split())
-            # Simple scoring based on word overlap
-            score = len(query_words.intersection(chunk_words))
-            if score > 0:
-                chunk_scores.append((score, i, chunk))
+        for number, (start, end) in enumerate(IntelligentAnswerer._segments(chunk, '.')):
+            span = strip(chunk, start, end)
+            if number < IntelligentAnswerer.MAX_DEFINITION_SENTENCES and span[1] - span[0] > 20:
+                features["definitions"].append(span)
+            sentence_lower = chunk_lower[start:end]
+            if any(marker in sentence_lower for marker in IntelligentAnswerer.CAUSAL_MARKERS):
+                features["explanations"].append(span)
         
-        # Sort by score and return top chunks
-        chunk_scores.sort(reverse=True)
-        return [chunk for _, _, chunk in chunk_scores[:max_chunks]]
-
-class IntelligentAnswerer:
-    """Generates intelligent answers based on document content"""
+        # Look for numbered lists or step indicators
+        for start, end in IntelligentAnswerer._segments(chunk, '\n'):
+            if IntelligentAnswerer.PROCEDURE_PATTERN.search(chunk_lower[start:end]):
+                features["procedures"].append(strip(chunk, start, end))
+        
+        # First meaningful paragraph
+        for start, end in IntelligentAnswerer._segments(chunk, '\n\n'):
+            span = strip(chunk, start, end)
+            if span[1] - span[0] > 50:
+                features["summary"].append(span)
+                break
+        
+        return features
     
     @staticmethod
-    def generate_answer(question: str, relevant_chunks: List[str], document_title: str = "") -> str:
+    def generate_answer(question: str, relevant_chunks: List[str], document_title: str = "",
+                        chunk_features: Optional[List[Dict]] = None,
+                        passages: Optional[List[Dict]] = None) -> str:
         """Generate an intelligent answer based on relevant document chunks"""
         if not relevant_chunks:
             return f"""Ik kon geen relevante informatie vinden in het document "{document_title}" om je vraag te beantwoorden: "{question}"
 
 Probeer je vraag anders te formuleren of controleer of het document de informatie bevat die je zoekt."""
 
-        # Combine relevant chunks
-        context = "\n\n".join(relevant_chunks)
+        if chunk_features is None:
+            chunk_features = [IntelligentAnswerer.analyze_chunk(chunk) for chunk in relevant_chunks]
         
         # Generate a structured answer
         answer = f"""Op basis van het document "{document_title}" kan ik je vraag beantwoorden:
@@ -168,111 +316,660 @@ Probeer je vraag anders te formuleren of controleer of het document de informati
 **Vraag:** {question}
 
 **Antwoord:**
-{IntelligentAnswerer._analyze_content(question, context)}
+{IntelligentAnswerer._analyze_content(question, relevant_chunks, chunk_features)}
 
 **Relevante passages uit het document:**
-{IntelligentAnswerer._format_passages(relevant_chunks)}"""
+{IntelligentAnswerer._format_passages(relevant_chunks, passages)}"""
 
         return answer
     
     @staticmethod
-    def _analyze_content(question: str, context: str) -> str:
-        """Analyze content and provide insights"""
+    def _analyze_content(question: str, chunks: List[str], chunk_features: List[Dict]) -> str:
+        """Assemble the answer body from the precomputed spans of the selected chunks"""
         question_lower = question.lower()
-        context_lower = context.lower()
         
         # Different analysis based on question type
-        if any(word in question_lower for word in ['wat', 'what', 'welke', 'which']):
-            return IntelligentAnswerer._extract_definitions(context)
-        elif any(word in question_lower for word in ['hoe', 'how', 'wanneer', 'when']):
-            return IntelligentAnswerer._extract_procedures(context)
-        elif any(word in question_lower for word in ['waarom', 'why', 'reden', 'reason']):
-            return IntelligentAnswerer._extract_explanations(context)
+        if any(word in question_lower for word in IntelligentAnswerer.DEFINITION_WORDS):
+            sentences = IntelligentAnswerer._select_spans(
+                chunks, chunk_features, "definitions", IntelligentAnswerer.MAX_DEFINITION_SENTENCES)
+            if sentences:
+                return '. '.join(sentences) + '.'
+            return "Gebaseerd op de beschikbare informatie in het document."
+        elif any(word in question_lower for word in IntelligentAnswerer.PROCEDURE_WORDS):
+            procedures = IntelligentAnswerer._select_spans(
+                chunks, chunk_features, "procedures", IntelligentAnswerer.MAX_PROCEDURE_STEPS)
+            if procedures:
+                return '\n'.join(procedures)
+            # Fallback to general content
+            return IntelligentAnswerer._context_prefix(chunks, 500)
+        elif any(word in question_lower for word in IntelligentAnswerer.EXPLANATION_WORDS):
+            explanations = IntelligentAnswerer._select_spans(
+                chunks, chunk_features, "explanations", IntelligentAnswerer.MAX_EXPLANATIONS)
+            if explanations:
+                return '. '.join(explanations) + '.'
+            return IntelligentAnswerer._context_prefix(chunks, 400)
         else:
-            return IntelligentAnswerer._general_summary(context)
+            summary = IntelligentAnswerer._select_spans(chunks, chunk_features, "summary", 1)
+            if summary:
+                return summary[0][:500] + ("..." if len(summary[0]) > 500 else "")
+            return IntelligentAnswerer._context_prefix(chunks, 300)
     
     @staticmethod
-    def _extract_definitions(context: str) -> str:
-        """Extract definitions and key information"""
-        sentences = context.split('.')
-        key_sentences = []
-        
-        for sentence in sentences[:5]:  # Focus on first few sentences
-            if len(sentence.strip()) > 20:
-                key_sentences.append(sentence.strip())
-        
-        if key_sentences:
-            return '. '.join(key_sentences) + '.'
-        return "Gebaseerd op de beschikbare informatie in het document."
+    def _select_spans(chunks: List[str], chunk_features: List[Dict], kind: str, limit: int) -> List[str]:
+        """Take up to limit spans of one kind, in chunk order"""
+        selected = []
+        for chunk, features in zip(chunks, chunk_features):
+            for start, end in features.get(kind, []):
+                selected.append(chunk[start:end])
+                if len(selected) == limit:
+                    return selected
+        return selected
     
     @staticmethod
-    def _extract_procedures(context: str) -> str:
-        """Extract procedural information"""
-        # Look for numbered lists or step indicators
-        lines = context.split('\n')
-        procedures = []
-        
-        for line in lines:
-            if re.search(r'^\d+\.|\b(stap|step|eerst|then|vervolgens)\b', line.lower()):
-                procedures.append(line.strip())
-        
-        if procedures:
-            return '\n'.join(procedures[:5])  # Max 5 steps
-        
-        # Fallback to general content
-        return context[:500] + "..." if len(context) > 500 else context
-    
-    @staticmethod
-    def _extract_explanations(context: str) -> str:
-        """Extract explanatory content"""
-        # Look for causal language
-        sentences = context.split('.')
-        explanatory = []
-        
-        for sentence in sentences:
-            if any(word in sentence.lower() for word in ['omdat', 'doordat', 'vanwege', 'reden', 'because', 'due to']):
-                explanatory.append(sentence.strip())
-        
-        if explanatory:
-            return '. '.join(explanatory[:3]) + '.'
-        
-        return context[:400] + "..." if len(context) > 400 else context
+    def _context_prefix(chunks: List[str], limit: int) -> str:
+        """First limit characters of the joined chunks, without joining more than needed"""
+        parts = []
+        length = 0
+        for chunk in chunks:
+            parts.append(chunk)
+            length += len(chunk) + (2 if len(parts) > 1 else 0)
+            if length > limit:
+                return "\n\n".join(parts)[:limit] + "..."
+        return "\n\n".join(parts)
     
     @staticmethod
-    def _general_summary(context: str) -> str:
-        """Provide general summary"""
-        # Return first meaningful paragraph
-        paragraphs = context.split('\n\n')
-        for paragraph in paragraphs:
-            if len(paragraph.strip()) > 50:
-                return paragraph.strip()[:500] + ("..." if len(paragraph) > 500 else "")
-        
-        return context[:300] + "..." if len(context) > 300 else context
-    
-    @staticmethod
-    def _format_passages(chunks: List[str]) -> str:
-        """Format relevant passages for display"""
+    def _format_passages(chunks: List[str], passages: Optional[List[Dict]] = None) -> str:
+        """Format relevant passages for display, preferring the matched window of each chunk"""
         formatted = []
         for i, chunk in enumerate(chunks, 1):
-            preview = chunk[:200] + "..." if len(chunk) > 200 else chunk
+            passage = passages[i - 1] if passages else None
+            if passage:
+                preview = (("..." if passage["start"] > 0 else "") + passage["text"]
+                           + ("..." if passage["end"] < len(chunk) else ""))
+            else:
+                preview = chunk[:200] + "..." if len(chunk) > 200 else chunk
             formatted.append(f"{i}. {preview}")
         
         return '\n\n'.join(formatted)
 
+def process_document(document_id: str, title: str, file_url: str, content: bytes,
+                     content_type: str = 'unknown', extra: Optional[Dict] = None) -> Tuple[Optional[Dict], str]:
+    """Extract, chunk and index document bytes already in memory"""
+    try:
+        download = spool_bytes(content, content_type, len(content))
+    except DownloadRejected as e:
+        return None, str(e)
+    return process_download(document_id, title, file_url, download, extra)
+
+def index_pages(document_id: str, title: str, file_url: str, download: StreamedDownload,
+                extra: Optional[Dict] = None,
+                ocr_pending: Optional[Dict[int, Future]] = None) -> Tuple[Optional[Dict], str, List[int]]:
+    """Extract, chunk and index a downloaded document page by page
+
+    The parser follows the sniffed content, not the title's extension. PDFs are
+    indexed PAGE_WINDOW pages at a time: the document is listed with status
+    "partial" and answers queries from its first window on, and besides the index
+    only the current window and the unfinished chunk are held. Pages sent to OCR
+    (collected in ocr_pending) leave the document "partial" until they are merged.
+    Returns the stored document info, the extracted text and the offset of each
+    page in it, or (None, error text, []) when extraction failed.
+    """
+    doc_info = {
+        "id": document_id,
+        "title": title,
+        "file_url": file_url,
+        "file_size": download.size,
+        "content_type": download.content_type,
+        "file_format": download.file_format,
+    }
+    doc_info.update(extra or {})
+    chunker = IncrementalChunker()
+    window_text: List[str] = []
+    window_chunks: List[str] = []
+    published = False
+    last_published = time.monotonic()
+    pages_indexed = 0
+    page_offsets: List[int] = []
+
+    def publish(status: str):
+        nonlocal published, last_published
+        info = dict(doc_info, status=status, pages_indexed=pages_indexed, text_length=chunker.length,
+                    chunks_count=chunker.chunks_count, processed_at=datetime.now().isoformat())
+        with span("index"):
+            features = [IntelligentAnswerer.analyze_chunk(chunk) for chunk in window_chunks]
+            store_document_window(document_id, info, "".join(window_text), list(window_chunks), features,
+                                  first=not published)
+        published = True
+        last_published = time.monotonic()
+        window_text.clear()
+        window_chunks.clear()
+        return info
+
+    try:
+        if download.text is not None:
+            # Plain text was already decoded while it streamed in
+            pages = iter([download.text])
+        elif download.file_format == 'pdf' and PDF_AVAILABLE:
+            pages = DocumentProcessor.iter_pdf_pages(download.path, ocr_pending)
+        else:
+            with span("extract"):
+                extracted_text = DocumentProcessor.extract_text(download.path, download.file_format)
+            if not extracted_text or extracted_text.startswith("Error"):
+                return None, extracted_text, []
+            pages = iter([extracted_text])
+
+        while True:
+            with span("extract"):
+                page = next(pages, None)
+            if page is None:
+                break
+            pages_indexed += 1
+            page_offsets.append(chunker.length)
+            with span("chunk"):
+                accepted, chunks = chunker.feed(page)
+            window_text.append(accepted)
+            window_chunks.extend(chunks)
+            if pages_indexed % PAGE_WINDOW == 0 and window_chunks and (
+                    shared_index is None or time.monotonic() - last_published >= PARTIAL_PUBLISH_SECONDS):
+                publish("partial")
+    except Exception as e:
+        logger.error(f"Error extracting {download.file_format} text: {e}")
+        if published:
+            unstore_document(document_id)
+        for future in (ocr_pending or {}).values():
+            future.cancel()
+        return None, f"Error reading {download.file_format.upper()}: {str(e)}", []
+
+    if not chunker.length and not ocr_pending:
+        if published:
+            unstore_document(document_id)
+        return None, "", []
+
+    with span("chunk"):
+        window_chunks.extend(chunker.finish())
+    if ocr_pending:
+        doc_info["ocr_pages_pending"] = len(ocr_pending)
+    doc_info = publish("partial" if ocr_pending else "complete")
+
+    logger.info(f"Successfully processed document: {title} ({doc_info['text_length']} chars, "
+                f"{doc_info['chunks_count']} chunks, {pages_indexed} pages, "
+                f"{len(ocr_pending or {})} pages waiting for OCR)")
+    return doc_info, get_index().get_content(document_id), page_offsets
+
+def index_extraction(document_id: str, title: str, file_url: str, extraction: Extraction,
+                     content_hash: str, extra: Optional[Dict] = None) -> Tuple[Dict, str]:
+    """Index a cached extraction without downloading or parsing the file again"""
+    with span("chunk"):
+        chunks = extraction.chunks()
+        if chunks is None:
+            # Parsed by a tool that does not chunk (pdf_parse_to_supabase.py); add the spans once
+            chunks = chunk_text(extraction.text)
+            extraction.chunk_spans = chunk_spans(extraction.text, chunks)
+            extraction_cache.put(content_hash, extraction)
+    doc_info = {
+        "id": document_id,
+        "title": title,
+        "file_url": file_url,
+        "file_size": extraction.file_size,
+        "content_type": extraction.content_type,
+        "file_format": extraction.file_format,
+    }
+    doc_info.update(extra or {})
+    doc_info.update({
+        "status": "complete",
+        "pages_indexed": len(extraction.page_offsets),
+        "text_length": len(extraction.text),
+        "chunks_count": len(chunks),
+        "processed_at": datetime.now().isoformat(),
+        "extraction_cached": True,
+    })
+    with span("index"):
+        features = [IntelligentAnswerer.analyze_chunk(chunk) for chunk in chunks]
+        store_document_window(document_id, doc_info, extraction.text, chunks, features, first=True)
+    logger.info(f"Indexed cached extraction of {title} ({len(extraction.text)} chars, {len(chunks)} chunks)")
+    return doc_info, extraction.text
+
+# Parser behind each sniffed format, recorded with cached extractions
+EXTRACTION_PARSERS = {"pdf": "PyPDF2", "docx": "python-docx", "doc": "python-docx", "txt": "text"}
+
+def process_download(document_id: str, title: str, file_url: str, download: StreamedDownload,
+                     extra: Optional[Dict] = None) -> Tuple[Optional[Dict], str]:
+    """Index a downloaded document, parsing it only when no process has before; removes its temporary file
+
+    Returns the stored document info and the extracted text, or (None, error text)
+    when extraction failed. Scanned pages are OCR'd after this returns.
+    """
+    ocr_pending: Dict[int, Future] = {}
+    try:
+        if extraction_cache is None or download.sha256 is None:
+            doc_info, text, page_offsets = index_pages(document_id, title, file_url, download, extra, ocr_pending)
+            if doc_info is not None and ocr_pending:
+                ocr_merge_executor.submit(merge_ocr_pages, document_id, doc_info, text, page_offsets, ocr_pending)
+            return doc_info, text
+        content_hash = download.sha256
+        with span("extract"):
+            extraction = extraction_cache.get(content_hash)
+        if extraction is None:
+            with extraction_cache.parsing(content_hash):
+                # Another process may have parsed the same bytes while this one waited
+                extraction = extraction_cache.get(content_hash)
+                if extraction is None:
+                    doc_info, text, page_offsets = index_pages(document_id, title, file_url, download, extra,
+                                                               ocr_pending)
+                    if doc_info is None:
+                        return doc_info, text
+                    if ocr_pending:
+                        # Cached with the OCR text once it is merged
+                        ocr_merge_executor.submit(merge_ocr_pages, document_id, doc_info, text, page_offsets,
+                                                  ocr_pending, content_hash)
+                    else:
+                        chunks = get_index().get_chunks(document_id)
+                        extraction_cache.put(content_hash, Extraction(
+                            text, page_offsets, chunk_spans(text, chunks), EXTRACTION_PARSERS[download.file_format],
+                            download.file_format, download.size, download.content_type))
+        if extraction is not None:
+            doc_info, text = index_extraction(document_id, title, file_url, extraction, content_hash, extra)
+        extraction_cache.link(storage_path(file_url), download.etag, download.size, content_hash)
+        return doc_info, text
+    finally:
+        download.cleanup()
+
+def merge_ocr_pages(document_id: str, doc_info: Dict, text: str, page_offsets: List[int],
+                    ocr_pending: Dict[int, Future], content_hash: Optional[str] = None):
+    """Wait for a document's OCR pages, merge them into the page-ordered text and re-index it"""
+    pages = Extraction(text, page_offsets).pages()
+    recognised = 0
+    for number, future in sorted(ocr_pending.items()):
+        try:
+            page_text = future.result()
+        except Exception as e:
+            logger.warning(f"OCR of page {number + 1} of {document_id} failed: {e}")
+            continue
+        if page_text.strip():
+            pages[number] = f"{pages[number]}\n{page_text.strip()}\n"
+            recognised += 1
+
+    current = get_index().documents.get(document_id)
+    if current is None or current.get("processed_at") != doc_info["processed_at"]:
+        logger.info(f"Discarded OCR results of {document_id}: the document was removed or re-ingested")
+        return
+    extraction = Extraction.from_pages(pages, parser=f"{EXTRACTION_PARSERS['pdf']}+{ocr_stage.engine}",
+                                       file_format=doc_info["file_format"], file_size=doc_info["file_size"],
+                                       content_type=doc_info["content_type"])
+    if not extraction.text:
+        logger.warning(f"No text found in {document_id}, also not by OCR")
+        unstore_document(document_id)
+        return
+    chunks = chunk_text(extraction.text)
+    info = {key: value for key, value in doc_info.items() if key != "ocr_pages_pending"}
+    info.update({
+        "status": "complete",
+        "text_length": len(extraction.text),
+        "chunks_count": len(chunks),
+        "ocr_pages": recognised,
+        "processed_at": datetime.now().isoformat(),
+    })
+    try:
+        features = [IntelligentAnswerer.analyze_chunk(chunk) for chunk in chunks]
+        store_document_window(document_id, info, extraction.text, chunks, features, first=True)
+        if content_hash is not None:
+            extraction.chunk_spans = chunk_spans(extraction.text, chunks)
+            extraction_cache.put(content_hash, extraction)
+    except Exception as e:
+        # Runs on the merge thread, where nobody would see the exception
+        logger.error(f"Could not merge OCR pages into {document_id}: {e}")
+        return
+    logger.info(f"Merged {recognised} OCR pages into {doc_info['title']} ({len(extraction.text)} chars, "
+                f"{len(chunks)} chunks)")
+
+def ingest_url(document_id: str, title: str, file_url: str,
+               extra: Optional[Dict] = None) -> Tuple[Optional[Dict], str]:
+    """Index the document at file_url, reading its body only when the extraction cache has no result"""
+    lookup = extraction_cache.version_lookup(file_url) if extraction_cache is not None else None
+    download = download_document(file_url, lookup)
+    if download is None:
+        content_hash, extraction = lookup.found
+        return index_extraction(document_id, title, file_url, extraction, content_hash, extra)
+    return process_download(document_id, title, file_url, download, extra)
+
+def download_document(file_url: str, known: Optional[KnownVersion] = None) -> Optional[StreamedDownload]:
+    """Stream a document to a temporary file; raises DownloadRejected for oversized or unknown content
+
+    None when known recognised the object version from the response headers.
+    """
+    with span("download"):
+        return stream_download(file_url, MAX_DOWNLOAD_BYTES, known=known)
+
+def retrieve_context(question: str, document_id: Optional[str] = None,
+                     conversation_id: Optional[str] = None) -> Tuple[List[Dict], List[str], str]:
+    """Find the chunks that answer a question
+
+    Returns (hits, source titles, context title); each hit carries the chunk text
+    and its precomputed features. Searches one document when document_id is
+    indexed, otherwise the documents of the conversation's previous answers and,
+    when those do not answer it, all documents.
+    """
+    index = get_index()
+    documents = index.documents
+    
+    if document_id and document_id in documents:
+        doc_info = documents[document_id]
+        if conversation_id:
+            conversations.remember(conversation_id, [document_id])
+        return index.search_hits(question, doc_ids=[document_id], reranker=reranker), \
+            [doc_info['title']], doc_info['title']
+    
+    hits = None
+    state = conversations.get(conversation_id) if conversation_id else None
+    pinned = [doc_id for doc_id in state.pinned if doc_id in documents] if state is not None else []
+    if pinned:
+        hits = index.search_hits(question, max_chunks=CROSS_DOCUMENT_CHUNKS, doc_ids=pinned, reranker=reranker)
+        if hits and max(hit["coverage"] for hit in hits) >= FOLLOW_UP_MIN_COVERAGE:
+            RETRIEVALS.inc(outcome="cached")
+        else:
+            RETRIEVALS.inc(outcome="fallback")
+            hits = None
+    elif conversation_id:
+        RETRIEVALS.inc(outcome="new")
+    
+    if hits is None:
+        # Search across all documents: one scoring pass with a global top-k
+        hits = index.search_hits(question, max_chunks=CROSS_DOCUMENT_CHUNKS,
+                                 shards=SEARCH_SHARDS, executor=search_executor, reranker=reranker)
+    if conversation_id and hits:
+        conversations.remember(conversation_id, list(dict.fromkeys(hit["doc_id"] for hit in hits)))
+    
+    return hits, hit_sources(hits, documents), "meerdere documenten"
+
+def hit_sources(hits: List[Dict], documents: Dict) -> List[str]:
+    """Titles of the first three documents the hits come from"""
+    all_sources = []
+    for hit in hits:
+        title = documents[hit["doc_id"]]['title']
+        if title not in all_sources:
+            all_sources.append(title)
+    return all_sources[:3]
+
+def batch_items(data: Dict) -> Tuple[Optional[List[Dict]], Optional[str]]:
+    """Validated /chat/batch questions as {id, question, document_id, client_id} dicts, or an error
+
+    Each question is a string or an object with question and optional id,
+    document_id and client_id.
+    """
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        return None, "questions must be a non-empty list"
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return None, f"At most {BATCH_MAX_QUESTIONS} questions per batch"
+    items = []
+    for position, entry in enumerate(questions):
+        entry = {"question": entry} if isinstance(entry, str) else entry
+        if not isinstance(entry, dict) or not str(entry.get('question') or '').strip():
+            return None, f"Question {position} is empty"
+        items.append({
+            "id": entry.get('id', position),
+            "question": str(entry['question']).strip(),
+            "document_id": entry.get('document_id'),
+            "document_title": entry.get('document_title'),
+            "client_id": entry.get('client_id'),
+        })
+    return items, None
+
+def client_documents(index: IndexReader, client_id) -> List[str]:
+    """Ids of a client's documents, from the document table's client index"""
+    document_table.sync(index.documents, (id(index), index.generation))
+    rows, _, _ = document_table.query(client_id=str(client_id), fields=("id",))
+    return [row["id"] for row in rows]
+
+def retrieve_batch(items: List[Dict]) -> List[Tuple[List[Dict], List[str], str]]:
+    """retrieve_context for every batch item in one pass over the index
+
+    Items asking the same question in the same scope (document, client or all
+    documents) are retrieved once; the other queries share the postings of their
+    common terms.
+    """
+    index = get_index()
+    documents = index.documents
+    client_scopes: Dict[str, List[str]] = {}
+    keys = []
+    queries: Dict[Tuple, int] = {}
+    for item in items:
+        document_id = item["document_id"]
+        if document_id and document_id in documents:
+            scope, max_chunks = (document_id,), 3
+        elif item["client_id"] is not None:
+            client = str(item["client_id"])
+            if client not in client_scopes:
+                client_scopes[client] = client_documents(index, client)
+            scope, max_chunks = tuple(client_scopes[client]), CROSS_DOCUMENT_CHUNKS
+        else:
+            scope, max_chunks = None, CROSS_DOCUMENT_CHUNKS
+        key = (" ".join(item["question"].lower().split()), scope, max_chunks)
+        queries.setdefault(key, len(queries))
+        keys.append(key)
+
+    with span("retrieve"):
+        found = index.search_hits_batch([(question, scope, max_chunks) for question, scope, max_chunks in queries],
+                                        reranker=reranker)
+    results = []
+    for item, key in zip(items, keys):
+        hits = found[queries[key]]
+        if item["document_id"] and item["document_id"] in documents:
+            title = documents[item["document_id"]]['title']
+            results.append((hits, [title], title))
+        else:
+            results.append((hits, hit_sources(hits, documents), "meerdere documenten"))
+    return results
+
+def no_context_answer(question: str, documents: Dict) -> str:
+    """Answer used when retrieval found nothing to base a response on"""
+    if documents:
+        return f"""Ik kon geen relevante informatie vinden in de beschikbare documenten om je vraag te beantwoorden: "{question}"
+
+Beschikbare documenten:
+{chr(10).join(f'- {doc["title"]}' for doc in documents.values())}
+
+Probeer je vraag anders te formuleren of selecteer een specifiek document."""
+    
+    # No documents available
+    return f"""Ik zou graag je vraag beantwoorden: "{question}"
+
+Echter, er zijn momenteel geen documenten beschikbaar in mijn kennisbank. Upload eerst documenten via de upload functie, dan kan ik gedetailleerde antwoorden geven gebaseerd op hun inhoud."""
+
+def build_chat_response(question: str, document_id: Optional[str] = None,
+                        document_title: Optional[str] = None, conversation_id: Optional[str] = None) -> Dict:
+    """Retrieve context and compose the /chat response body"""
+    documents = get_index().documents
+    with span("retrieve"):
+        hits, sources, context_title = retrieve_context(question, document_id, conversation_id)
+    return compose_chat_response(question, hits, sources, context_title, documents, document_id, document_title)
+
+def compose_chat_response(question: str, hits: List[Dict], sources: List[str], context_title: str,
+                          documents: Dict, document_id: Optional[str] = None,
+                          document_title: Optional[str] = None) -> Dict:
+    """The /chat response body for retrieved hits, answered by IntelligentAnswerer"""
+    # A selected document always gets a document-specific answer, even without matches
+    if hits or (document_id and document_id in documents):
+        with span("answer"):
+            answer = IntelligentAnswerer.generate_answer(
+                question, [hit["text"] for hit in hits], context_title,
+                [hit["features"] or IntelligentAnswerer.analyze_chunk(hit["text"]) for hit in hits],
+                [hit["passage"] for hit in hits]
+            )
+    else:
+        answer = no_context_answer(question, documents)
+        sources = []
+    
+    return chat_envelope(answer, sources, documents, document_id, document_title, hit_passages(hits, documents))
+
+def hit_passages(hits: List[Dict], documents: Dict) -> List[Dict]:
+    """Matched passages with highlight offsets, for the frontend to render"""
+    return [
+        {
+            "document_id": hit["doc_id"],
+            "title": documents[hit["doc_id"]]['title'],
+            "chunk_id": hit["chunk_id"],
+            "score": hit["score"],
+            "text": hit["passage"]["text"],
+            "highlights": hit["passage"]["highlights"]
+        }
+        for hit in hits
+    ]
+
+def chat_envelope(answer: str, sources: List[str], documents: Dict,
+                  document_id: Optional[str] = None, document_title: Optional[str] = None,
+                  passages: Optional[List[Dict]] = None) -> Dict:
+    """Wrap an answer in the /chat response format"""
+    return {
+        "answer": answer,
+        "sources": sources,
+        "passages": passages or [],
+        "document_context": {
+            "selected_document": document_title if document_id else None,
+            "total_documents": len(documents),
+            "search_performed": document_id in documents if document_id else len(documents) > 0
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+def corpus_total(field: str) -> int:
+    return sum(doc.get(field, 0) for doc in get_index().documents.values())
+
+def analyzer_hit_ratio() -> float:
+    stats = analyzer.cache_stats()
+    lookups = stats["hits"] + stats["misses"]
+    return stats["hits"] / lookups if lookups else 0.0
+
+REGISTRY.gauge("rag_documents", "Indexed documents", function=lambda: len(get_index().documents))
+REGISTRY.gauge("rag_chunks", "Indexed chunks", function=lambda: corpus_total("chunks_count"))
+REGISTRY.gauge("rag_corpus_file_bytes", "Downloaded bytes of the indexed documents",
+               function=lambda: corpus_total("file_size"))
+REGISTRY.gauge("rag_corpus_text_chars", "Extracted text characters in the index",
+               function=lambda: corpus_total("text_length"))
+REGISTRY.gauge("rag_index_generation", "Generation of the index being served",
+               function=lambda: get_index().generation)
+REGISTRY.gauge("rag_analyzer_cache_hit_ratio", "Hit ratio of the analyzer's token cache",
+               function=analyzer_hit_ratio)
+
+def ingest_metadata(data: Dict) -> Dict:
+    """Client, document type, category and date sent along with an ingest request"""
+    metadata = {field: data[field] for field in INGEST_METADATA_FIELDS if data.get(field) is not None}
+    if "client_id" in metadata:
+        metadata["client_id"] = str(metadata["client_id"])
+    return metadata
+
+def document_listing(params: Mapping[str, str]) -> Tuple[Dict, int]:
+    """The /documents payload for the query parameters of DocumentTable.page"""
+    index = get_index()
+    document_table.sync(index.documents, (id(index), index.generation))
+    payload, status = document_table.page(params, DOCUMENT_PAGE_LIMIT)
+    if status == 200:
+        payload["processing_capabilities"] = {
+            "pdf": PDF_AVAILABLE,
+            "docx": DOCX_AVAILABLE,
+            "txt": True
+        }
+    return payload, status
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    start_timings()
+    # Admin downloads are not profiled, so they cannot evict the profiles being fetched
+    profiled = profiler is not None and not request.path.startswith('/admin/')
+    g.profile = profiler.start() if profiled else None
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    method, started, profile, timings = request.method, g.request_started, g.get('profile'), current_timings()
+
+    def record():
+        REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        if profile is not None:
+            profiler.finish(profile, method, endpoint, timings)
+
+    if response.is_streamed:
+        # A streamed body (/chat/batch) is produced after this hook; record once it has been sent
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+def admin_denied():
+    """Error response when profiling is off, no admin token is configured or it does not match, else None"""
+    if profiler is None:
+        return jsonify({"error": "Profiling is disabled; set RAG_PROFILE_SLOW_MS to enable it"}), 404
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled; set RAG_ADMIN_TOKEN to enable them"}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({"error": "Admin token required"}), 403
+    return None
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Profiles of recent slow requests, newest first"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    return jsonify({
+        "threshold_ms": 1000 * profiler.threshold,
+        "mode": profiler.mode,
+        "capacity": profiler.profiles.maxlen,
+        "profiles": profiler.list()
+    })
+
+@app.route('/admin/profiles/<int:profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a profile as pstats (?format=pstats, default) or collapsed stacks (?format=collapsed)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({"error": "Profile not found or already evicted"}), 404
+    profile_format = request.args.get('format', 'pstats')
+    if profile_format not in profile.formats():
+        return jsonify({"error": f"Profile {profile_id} is available as: {', '.join(profile.formats())}"}), 400
+    if profile_format == 'collapsed':
+        body, mimetype, extension = profile.collapsed(), 'text/plain', 'txt'
+    else:
+        body, mimetype, extension = profile.pstats(), 'application/octet-stream', 'prof'
+    return Response(body, mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename=profile-{profile_id}.{extension}"
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics of this worker"""
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    index = get_index()
     return jsonify({
         "status": "healthy",
         "message": "Advanced RAG Server is running",
         "timestamp": datetime.now().isoformat(),
-        "documents_count": len(documents_store),
+        "documents_count": len(index.documents),
+        "index_generation": index.generation,
         "features": {
             "pdf_processing": PDF_AVAILABLE,
             "docx_processing": DOCX_AVAILABLE,
             "text_chunking": True,
-            "intelligent_search": True
-        }
+            "intelligent_search": True,
+            "shared_index": shared_index is not None,
+            "extraction_cache": extraction_cache.stats() if extraction_cache is not None else None,
+            "ocr": ocr_stage.engine if ocr_stage is not None else None,
+            "rerank_budget_ms": reranker.budget * 1000 if reranker is not None else None,
+            "analyzer": index.analyzer.name,
+            "ann_index": NUMPY_AVAILABLE,
+            "ann_nodes": len(index.ann) if index.ann is not None else 0,
+            "vector_codec": shared_index.vector_codec if shared_index is not None else "float32"
+        },
+        "capabilities": rag_capabilities.report()
     })
 
 @app.route('/ingest', methods=['POST'])
@@ -292,69 +989,25 @@ def ingest_document():
         
         logger.info(f"Processing document: {title} (ID: {document_id})")
         
-        # Download the document
+        # Download the document unless its extraction is cached
         try:
-            response = requests.get(file_url, timeout=30)
-            response.raise_for_status()
-            
-            # Save to temporary file for processing
-            file_extension = title.split('.')[-1].lower() if '.' in title else 'unknown'
-            
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as temp_file:
-                temp_file.write(response.content)
-                temp_file_path = temp_file.name
+            doc_info, extracted_text = ingest_url(document_id, title, file_url, ingest_metadata(data))
+            if doc_info is None:
+                return jsonify({"error": f"Failed to extract text: {extracted_text}"}), 400
             
-            # Extract text based on file type
-            try:
-                if file_extension == 'pdf':
-                    extracted_text = DocumentProcessor.extract_text_from_pdf(temp_file_path)
-                elif file_extension in ['docx', 'doc']:
-                    extracted_text = DocumentProcessor.extract_text_from_docx(temp_file_path)
-                elif file_extension == 'txt':
-                    extracted_text = DocumentProcessor.extract_text_from_txt(temp_file_path)
-                else:
-                    extracted_text = "Unsupported file format. Supported: PDF, DOCX, TXT"
-                
-                # Clean up temp file
-                os.unlink(temp_file_path)
-                
-                # Process the extracted text
-                if extracted_text and not extracted_text.startswith("Error"):
-                    # Create chunks for better retrieval
-                    chunks = DocumentProcessor.chunk_text(extracted_text)
-                    
-                    # Store document metadata and content
-                    documents_store[document_id] = {
-                        "id": document_id,
-                        "title": title,
-                        "file_url": file_url,
-                        "processed_at": datetime.now().isoformat(),
-                        "file_size": len(response.content),
-                        "content_type": response.headers.get('content-type', 'unknown'),
-                        "text_length": len(extracted_text),
-                        "chunks_count": len(chunks)
-                    }
-                    
-                    document_contents[document_id] = extracted_text
-                    document_chunks[document_id] = chunks
-                    
-                    logger.info(f"Successfully processed document: {title} ({len(extracted_text)} chars, {len(chunks)} chunks)")
-                    
-                    return jsonify({
-                        "success": True,
-                        "message": f"Document '{title}' successfully processed and indexed",
-                        "document_id": document_id,
-                        "text_length": len(extracted_text),
-                        "chunks_count": len(chunks),
-                        "processed_at": documents_store[document_id]["processed_at"]
-                    })
-                else:
-                    return jsonify({"error": f"Failed to extract text: {extracted_text}"}), 400
-                    
-            except Exception as e:
-                os.unlink(temp_file_path)  # Clean up on error
-                raise e
+            return jsonify({
+                "success": True,
+                "message": f"Document '{title}' successfully processed and indexed",
+                "document_id": document_id,
+                "text_length": doc_info["text_length"],
+                "chunks_count": doc_info["chunks_count"],
+                "processed_at": doc_info["processed_at"],
+                "timings": timings_block()
+            })
                 
+        except DownloadRejected as e:
+            logger.warning(f"Rejected document {document_id}: {e}")
+            return jsonify({"error": str(e)}), e.status
         except requests.RequestException as e:
             logger.error(f"Failed to download document: {e}")
             return jsonify({"error": f"Failed to download document: {str(e)}"}), 400
@@ -374,6 +1027,7 @@ def chat():
         question = data.get('question', '').strip()
         document_id = data.get('document_id')
         document_title = data.get('document_title')
+        conversation_id = data.get('conversation_id')
         
         if not question:
             return jsonify({"error": "Question is required"}), 400
@@ -382,58 +1036,8 @@ def chat():
         if document_id:
             logger.info(f"Context document: {document_title} (ID: {document_id})")
         
-        # Generate intelligent response
-        if document_id and document_id in document_chunks:
-            # Document-specific intelligent response
-            chunks = document_chunks[document_id]
-            doc_info = documents_store[document_id]
-            
-            # Find relevant chunks
-            relevant_chunks = DocumentProcessor.search_relevant_chunks(question, chunks)
-            
-            # Generate intelligent answer
-            answer = IntelligentAnswerer.generate_answer(question, relevant_chunks, doc_info['title'])
-            sources = [doc_info['title']]
-            
-        elif len(documents_store) > 0:
-            # Search across all documents
-            all_relevant_chunks = []
-            all_sources = []
-            
-            for doc_id, chunks in document_chunks.items():
-                relevant = DocumentProcessor.search_relevant_chunks(question, chunks, max_chunks=2)
-                if relevant:
-                    all_relevant_chunks.extend(relevant)
-                    all_sources.append(documents_store[doc_id]['title'])
-            
-            if all_relevant_chunks:
-                answer = IntelligentAnswerer.generate_answer(question, all_relevant_chunks[:5], "meerdere documenten")
-                sources = list(set(all_sources))[:3]
-            else:
-                answer = f"""Ik kon geen relevante informatie vinden in de beschikbare documenten om je vraag te beantwoorden: "{question}"
-
-Beschikbare documenten:
-{chr(10).join(f'- {doc["title"]}' for doc in documents_store.values())}
-
-Probeer je vraag anders te formuleren of selecteer een specifiek document."""
-                sources = []
-        else:
-            # No documents available
-            answer = f"""Ik zou graag je vraag beantwoorden: "{question}"
-
-Echter, er zijn momenteel geen documenten beschikbaar in mijn kennisbank. Upload eerst documenten via de upload functie, dan kan ik gedetailleerde antwoorden geven gebaseerd op hun inhoud."""
-            sources = []
-        
-        response = {
-            "answer": answer,
-            "sources": sources,
-            "document_context": {
-                "selected_document": document_title if document_id else None,
-                "total_documents": len(documents_store),
-                "search_performed": document_id in document_chunks if document_id else len(documents_store) > 0
-            },
-            "timestamp": datetime.now().isoformat()
-        }
+        response = build_chat_response(question, document_id, document_title, conversation_id)
+        response["timings"] = timings_block()
         
         return jsonify(response)
         
@@ -441,38 +1045,71 @@ Echter, er zijn momenteel geen documenten beschikbaar in mijn kennisbank. Upload
         logger.error(f"Error processing chat request: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many questions with one shared retrieval pass, streaming a JSON line per answer
+
+    Expected payload: {"questions": ["...", {"question": "...", "id": "q2",
+    "document_id": "123", "client_id": "456"}]}. Lines carry the question's index
+    and id and come in question order; a question that fails gets an {"index", "id",
+    "error"} line instead and the rest are still answered. A final {"done": true}
+    line closes the stream.
+    """
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"error": "No JSON data provided"}), 400
+        items, error = batch_items(data)
+        if error:
+            return jsonify({"error": error}), 400
+        logger.info(f"Processing batch of {len(items)} questions")
+
+        documents = get_index().documents
+        retrieved = retrieve_batch(items)
+    except Exception as e:
+        logger.error(f"Error processing chat batch request: {e}")
+        return jsonify({"error": f"Internal server error: {str(e)}"}), 500
+
+    def results() -> Iterator[str]:
+        answered: Dict[Tuple, Dict] = {}
+        failed = 0
+        for position, (item, (hits, sources, context_title)) in enumerate(zip(items, retrieved)):
+            try:
+                key = (item["question"], item["document_id"], tuple(hit["chunk_id"] for hit in hits))
+                if key not in answered:
+                    answered[key] = compose_chat_response(item["question"], hits, sources, context_title,
+                                                          documents, item["document_id"], item["document_title"])
+                line = dict(answered[key], index=position, id=item["id"], question=item["question"])
+            except Exception as e:
+                logger.error(f"Error answering batch question {position}: {e}")
+                failed += 1
+                line = {"index": position, "id": item["id"], "error": f"Internal server error: {str(e)}"}
+            yield json.dumps(line) + "\n"
+        yield json.dumps({"done": True, "count": len(items), "errors": failed, "timings": timings_block()}) + "\n"
+
+    # The generator runs after the view returns; keep the request context (and its timings) alive
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
 @app.route('/documents', methods=['GET'])
 def list_documents():
-    """List all processed documents with their content statistics"""
-    docs_with_stats = []
-    for doc_id, doc_info in documents_store.items():
-        doc_with_stats = doc_info.copy()
-        doc_with_stats['has_content'] = doc_id in document_contents
-        doc_with_stats['chunks_available'] = doc_id in document_chunks
-        docs_with_stats.append(doc_with_stats)
-    
-    return jsonify({
-        "documents": docs_with_stats,
-        "total_count": len(documents_store),
-        "processing_capabilities": {
-            "pdf": PDF_AVAILABLE,
-            "docx": DOCX_AVAILABLE,
-            "txt": True
-        }
-    })
+    """List processed documents, optionally filtered, paginated and projected"""
+    payload, status = document_listing(request.args)
+    return jsonify(payload), status
 
 @app.route('/documents/<document_id>/content', methods=['GET'])
 def get_document_content(document_id):
     """Get the full content of a specific document"""
-    if document_id not in document_contents:
+    index = get_index()
+    if document_id not in index.documents:
         return jsonify({"error": "Document not found or not processed"}), 404
     
+    content = index.get_content(document_id)
     return jsonify({
         "document_id": document_id,
-        "title": documents_store[document_id]['title'],
-        "content": document_contents[document_id],
-        "chunks_count": len(document_chunks.get(document_id, [])),
-        "content_length": len(document_contents[document_id])
+        "title": index.documents[document_id]['title'],
+        "content": content,
+        "chunks_count": len(index.get_chunk_ids(document_id)),
+        "content_length": len(content)
     })
 
 @app.route('/documents/<document_id>/reprocess', methods=['POST'])
@@ -494,69 +1131,25 @@ def reprocess_document(document_id):
         logger.info(f"Reprocessing document: {title} (ID: {document_id})")
         
         # Download and process the document
-        response = requests.get(file_url, timeout=30)
-        response.raise_for_status()
+        try:
+            doc_info, extracted_text = ingest_url(document_id, title, file_url,
+                                                  dict(ingest_metadata(data), reprocessed=True))
+        except DownloadRejected as e:
+            return jsonify({"error": str(e)}), e.status
         
-        # Save to temporary file for processing
-        file_extension = title.split('.')[-1].lower() if '.' in title else 'unknown'
+        if doc_info is None:
+            return jsonify({"error": f"Failed to extract text: {extracted_text}"}), 400
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
+        return jsonify({
+            "success": True,
+            "message": f"Document '{title}' successfully reprocessed with advanced RAG",
+            "document_id": document_id,
+            "text_length": doc_info["text_length"],
+            "chunks_count": doc_info["chunks_count"],
+            "processed_at": doc_info["processed_at"],
+            "timings": timings_block()
+        })
         
-        # Extract text based on file type
-        try:
-            if file_extension == 'pdf':
-                extracted_text = DocumentProcessor.extract_text_from_pdf(temp_file_path)
-            elif file_extension in ['docx', 'doc']:
-                extracted_text = DocumentProcessor.extract_text_from_docx(temp_file_path)
-            elif file_extension == 'txt':
-                extracted_text = DocumentProcessor.extract_text_from_txt(temp_file_path)
-            else:
-                extracted_text = "Unsupported file format. Supported: PDF, DOCX, TXT"
-            
-            # Clean up temp file
-            os.unlink(temp_file_path)
-            
-            # Process the extracted text
-            if extracted_text and not extracted_text.startswith("Error"):
-                # Create chunks for better retrieval
-                chunks = DocumentProcessor.chunk_text(extracted_text)
-                
-                # Update document store
-                documents_store[document_id] = {
-                    "id": document_id,
-                    "title": title,
-                    "file_url": file_url,
-                    "processed_at": datetime.now().isoformat(),
-                    "file_size": len(response.content),
-                    "content_type": response.headers.get('content-type', 'unknown'),
-                    "text_length": len(extracted_text),
-                    "chunks_count": len(chunks),
-                    "reprocessed": True
-                }
-                
-                document_contents[document_id] = extracted_text
-                document_chunks[document_id] = chunks
-                
-                logger.info(f"Successfully reprocessed document: {title} ({len(extracted_text)} chars, {len(chunks)} chunks)")
-                
-                return jsonify({
-                    "success": True,
-                    "message": f"Document '{title}' successfully reprocessed with advanced RAG",
-                    "document_id": document_id,
-                    "text_length": len(extracted_text),
-                    "chunks_count": len(chunks),
-                    "processed_at": documents_store[document_id]["processed_at"]
-                })
-            else:
-                return jsonify({"error": f"Failed to extract text: {extracted_text}"}), 400
-                
-        except Exception as e:
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            raise e
-            
     except Exception as e:
         logger.error(f"Error reprocessing document: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
@@ -573,13 +1166,18 @@ if __name__ == '__main__':
     print("\n Available endpoints:")
     print("   POST /ingest - Process and index documents with text extraction")
     print("   POST /chat - Intelligent Q&A with document context")
+    print("   POST /chat/batch - Many questions in one request, one JSON line per answer")
     print("   GET /documents - List processed documents with statistics")
     print("   GET /documents/<id>/content - Get full document content")
     print("   GET /health - Health check with feature status")
+    print("   GET /metrics - Prometheus metrics (stage latencies, requests, corpus size)")
+    print("   GET /admin/profiles - Profiles of slow requests (RAG_PROFILE_SLOW_MS, RAG_ADMIN_TOKEN)")
     print(f"\n Processing capabilities:")
     print(f"   PDF: {' Available' if PDF_AVAILABLE else ' Install PyPDF2'}")
     print(f"   DOCX: {' Available' if DOCX_AVAILABLE else ' Install python-docx'}")
     print(f"   TXT:  Available")
+    if shared_index is not None:
+        print(f"   Shared index: {shared_index.directory}")
     print("\n Server is ready for intelligent document Q&A!")
     
     app.run(host='localhost', port=port, debug=True)
@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+Async RAG Server for MedDoc AI Flow
+ASGI variant of the advanced RAG server for high-concurrency chat. Downloads and
+LLM calls are awaited, extraction and retrieval run on a bounded executor, so a
+single process can hold thousands of open /chat connections.
+
+Run with: uvicorn async_rag_server:app --port 5001
+"""
+
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import advanced_rag_server as rag
+from rag_download import (DOWNLOAD_CHUNK_BYTES, DownloadRejected, DownloadSink, KnownVersion, StreamedDownload,
+                          response_version, stream_download)
+from rag_metrics import CONTENT_TYPE, REGISTRY, REQUEST_SECONDS, REQUESTS, span, start_timings, timings_block
+from vercel_rag_server import SimpleAnswerer
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# CPU-bound work (extraction, chunking, retrieval) runs here, off the event loop
+CPU_WORKERS = int(os.environ.get('RAG_ASYNC_CPU_WORKERS', os.cpu_count() or 4))
+# Fallback pool for blocking downloads when httpx is not installed
+DOWNLOAD_WORKERS = int(os.environ.get('RAG_ASYNC_DOWNLOAD_WORKERS', 16))
+# Upper bound on simultaneous OpenAI requests; other chats wait without holding a thread
+LLM_CONCURRENCY = int(os.environ.get('RAG_ASYNC_LLM_CONCURRENCY', 64))
+# /chat/batch questions with the same retrieved context share one completion, up to this many
+BATCH_LLM_GROUP = int(os.environ.get('RAG_BATCH_LLM_GROUP', 4))
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-headers", b"content-type"),
+    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+]
+
+
+class AsyncRAGApp:
+    """Minimal ASGI application exposing the advanced RAG endpoints"""
+
+    def __init__(self):
+        self.cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="rag-cpu")
+        self.download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="rag-io")
+        self.http_client = None
+        self.llm_client = None
+        self.llm_slots: Optional[asyncio.Semaphore] = None
+        self.routes: Dict[Tuple[str, str], Callable] = {
+            ("GET", "/health"): self.health_check,
+            ("POST", "/ingest"): self.ingest_document,
+            ("POST", "/chat"): self.chat,
+            ("POST", "/chat/batch"): self.chat_batch,
+            ("GET", "/documents"): self.list_documents,
+            ("GET", "/metrics"): self.metrics,
+        }
+
+    async def startup(self):
+        self.llm_slots = asyncio.Semaphore(LLM_CONCURRENCY)
+        if HTTPX_AVAILABLE:
+            self.http_client = httpx.AsyncClient(timeout=30, follow_redirects=True)
+        if OPENAI_AVAILABLE and os.getenv('OPENAI_API_KEY'):
+            self.llm_client = openai.AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        logger.info(f"Async RAG server started (httpx: {HTTPX_AVAILABLE}, LLM: {self.llm_client is not None})")
+
+    async def shutdown(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        self.cpu_executor.shutdown(wait=False)
+        self.download_executor.shutdown(wait=False)
+
+    async def run_blocking(self, func, *args):
+        """Run CPU-bound work on the executor so the event loop keeps serving"""
+        # run_in_executor does not carry context variables; copy them so spans reach the request's timings
+        call = functools.partial(contextvars.copy_context().run, func, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, call)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        if method == "OPTIONS":
+            await self.send_json(send, {}, 204)
+            return
+
+        started = time.perf_counter()
+        start_timings()
+        status = [500]
+
+        async def send_recording(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        endpoint = path if (method, path) in self.routes else "unmatched"
+        try:
+            handler = self.routes.get((method, path))
+            if handler is not None:
+                await handler(scope, receive, send_recording)
+            elif method == "GET" and path.startswith("/documents/") and path.endswith("/content"):
+                endpoint = "/documents/<document_id>/content"
+                await self.get_document_content(path[len("/documents/"):-len("/content")], send_recording)
+            else:
+                await self.send_json(send_recording, {"error": "Not found"}, 404)
+        except Exception as e:
+            logger.error(f"Error handling {method} {path}: {e}")
+            await self.send_json(send_recording, {"error": f"Internal server error: {str(e)}"}, 500)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+            REQUESTS.inc(endpoint=endpoint, status=status[0])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def read_json(receive) -> Optional[Dict]:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            return None
+
+    @staticmethod
+    async def send_json(send, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode('utf-8') if status != 204 else b""
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")] + CORS_HEADERS,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def send_event(send, event: str, payload: Dict):
+        data = f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode('utf-8')
+        await send({"type": "http.response.body", "body": data, "more_body": True})
+
+    async def download(self, file_url: str, known: Optional[KnownVersion] = None) -> Optional[StreamedDownload]:
+        """Stream a document to a temporary file without blocking the event loop
+
+        None when known recognised the object version from the response headers.
+        """
+        with span("download"):
+            return await self._fetch(file_url, known)
+
+    async def _fetch(self, file_url: str, known: Optional[KnownVersion]) -> Optional[StreamedDownload]:
+        if self.http_client is None:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.download_executor, functools.partial(
+                stream_download, file_url, rag.MAX_DOWNLOAD_BYTES, known=known))
+
+        async with self.http_client.stream("GET", file_url) as response:
+            response.raise_for_status()
+            etag, length = response_version(response.headers)
+            # The cache lookup reads and inflates an entry, so it stays off the event loop
+            if known is not None and await self.run_blocking(known, etag, length):
+                return None
+            sink = DownloadSink(rag.MAX_DOWNLOAD_BYTES, length, response.headers.get('content-type', 'unknown'),
+                                etag)
+            try:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    sink.feed(chunk)
+                return sink.finish()
+            except BaseException:
+                sink.discard()
+                raise
+
+    async def metrics(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", CONTENT_TYPE.encode())] + CORS_HEADERS,
+        })
+        await send({"type": "http.response.body", "body": REGISTRY.render().encode('utf-8')})
+
+    async def health_check(self, scope, receive, send):
+        index = rag.get_index()
+        await self.send_json(send, {
+            "status": "healthy",
+            "message": "Async RAG Server is running",
+            "timestamp": datetime.now().isoformat(),
+            "documents_count": len(index.documents),
+            "index_generation": index.generation,
+            "features": {
+                "pdf_processing": rag.PDF_AVAILABLE,
+                "docx_processing": rag.DOCX_AVAILABLE,
+                "async_downloads": self.http_client is not None,
+                "llm_answers": self.llm_client is not None,
+                "streaming": True,
+                "shared_index": rag.shared_index is not None
+            }
+        })
+
+    async def ingest_document(self, scope, receive, send):
+        data = await self.read_json(receive)
+        if not data:
+            await self.send_json(send, {"error": "No JSON data provided"}, 400)
+            return
+
+        file_url = data.get('file_url')
+        document_id = data.get('document_id')
+        title = data.get('title', 'Unknown Document')
+        if not file_url or not document_id:
+            await self.send_json(send, {"error": "file_url and document_id are required"}, 400)
+            return
+
+        logger.info(f"Processing document: {title} (ID: {document_id})")
+        # A storage object version parsed before is indexed from the extraction cache, body unread
+        extra = rag.ingest_metadata(data)
+        lookup = rag.extraction_cache.version_lookup(file_url) if rag.extraction_cache is not None else None
+        try:
+            download = await self.download(file_url, lookup)
+        except DownloadRejected as e:
+            logger.warning(f"Rejected document {document_id}: {e}")
+            await self.send_json(send, {"error": str(e)}, e.status)
+            return
+        except Exception as e:
+            logger.error(f"Failed to download document: {e}")
+            await self.send_json(send, {"error": f"Failed to download document: {str(e)}"}, 400)
+            return
+
+        if download is None:
+            content_hash, extraction = lookup.found
+            doc_info, extracted_text = await self.run_blocking(
+                rag.index_extraction, document_id, title, file_url, extraction, content_hash, extra
+            )
+        else:
+            doc_info, extracted_text = await self.run_blocking(
+                rag.process_download, document_id, title, file_url, download, extra
+            )
+        if doc_info is None:
+            await self.send_json(send, {"error": f"Failed to extract text: {extracted_text}"}, 400)
+            return
+
+        await self.send_json(send, {
+            "success": True,
+            "message": f"Document '{title}' successfully processed and indexed",
+            "document_id": document_id,
+            "text_length": doc_info["text_length"],
+            "chunks_count": doc_info["chunks_count"],
+            "processed_at": doc_info["processed_at"],
+            "timings": timings_block()
+        })
+
+    async def chat(self, scope, receive, send):
+        data = await self.read_json(receive)
+        if not data:
+            await self.send_json(send, {"error": "No JSON data provided"}, 400)
+            return
+
+        question = data.get('question', '').strip()
+        document_id = data.get('document_id')
+        document_title = data.get('document_title')
+        conversation_id = data.get('conversation_id')
+        if not question:
+            await self.send_json(send, {"error": "Question is required"}, 400)
+            return
+
+        accept = dict(scope.get("headers", [])).get(b"accept", b"")
+        stream = bool(data.get('stream')) or b"text/event-stream" in accept
+        use_llm = self.llm_client is not None and data.get('use_llm', True)
+
+        logger.info(f"Processing question: {question}")
+        if not use_llm:
+            response = await self.run_blocking(rag.build_chat_response, question, document_id, document_title,
+                                               conversation_id)
+            response["timings"] = timings_block()
+            if stream:
+                await self._stream_static(send, response)
+            else:
+                await self.send_json(send, response)
+            return
+
+        with span("retrieve"):
+            hits, sources, context_title = await self.run_blocking(rag.retrieve_context, question, document_id,
+                                                                    conversation_id)
+        documents = rag.get_index().documents
+        if not hits and not (document_id and document_id in documents):
+            response = rag.chat_envelope(rag.no_context_answer(question, documents), [],
+                                         documents, document_id, document_title)
+            response["timings"] = timings_block()
+            if stream:
+                await self._stream_static(send, response)
+            else:
+                await self.send_json(send, response)
+            return
+
+        with span("context"):
+            context = "\n\n".join(hit["text"] for hit in hits)
+            messages = SimpleAnswerer.build_messages(question, context, context_title)
+        if stream:
+            envelope = rag.chat_envelope("", sources, documents, document_id, document_title,
+                                         rag.hit_passages(hits, documents))
+            await self._stream_llm(send, messages, envelope)
+            return
+
+        async with self.llm_slots:
+            with span("llm"):
+                completion = await self.llm_client.chat.completions.create(
+                    model=SimpleAnswerer.MODEL,
+                    messages=messages,
+                    max_tokens=SimpleAnswerer.MAX_TOKENS,
+                    temperature=SimpleAnswerer.TEMPERATURE
+                )
+        answer = completion.choices[0].message.content.strip()
+        response = rag.chat_envelope(answer, sources, documents, document_id, document_title,
+                                     rag.hit_passages(hits, documents))
+        response["timings"] = timings_block()
+        await self.send_json(send, response)
+
+    async def chat_batch(self, scope, receive, send):
+        """Answer many questions with one shared retrieval pass, streaming a result event per question
+
+        Questions whose retrieval found the same chunks are answered together, up to
+        BATCH_LLM_GROUP per completion; results are sent as they complete, each with
+        the question's index and id, followed by a done event.
+        """
+        data = await self.read_json(receive)
+        if not data:
+            await self.send_json(send, {"error": "No JSON data provided"}, 400)
+            return
+        items, error = rag.batch_items(data)
+        if error:
+            await self.send_json(send, {"error": error}, 400)
+            return
+
+        logger.info(f"Processing batch of {len(items)} questions")
+        retrieved = await self.run_blocking(rag.retrieve_batch, items)
+        documents = rag.get_index().documents
+        use_llm = self.llm_client is not None and data.get('use_llm', True)
+
+        # Questions with the same context (and unanswerable ones) are answered together
+        groups: Dict[Tuple, List[int]] = {}
+        for position, (item, (hits, _, context_title)) in enumerate(zip(items, retrieved)):
+            if not use_llm:
+                key = ("static", item["question"], item["document_id"], tuple(hit["chunk_id"] for hit in hits))
+            elif not hits and not (item["document_id"] and item["document_id"] in documents):
+                key = ("no_context", position)
+            else:
+                key = ("llm", context_title, tuple(hit["chunk_id"] for hit in hits))
+            groups.setdefault(key, []).append(position)
+
+        tasks = []
+        for key, positions in groups.items():
+            step = BATCH_LLM_GROUP if key[0] == "llm" else len(positions)
+            for start in range(0, len(positions), step):
+                tasks.append(asyncio.ensure_future(
+                    self._answer_batch_group(key[0], positions[start:start + step], items, retrieved, documents)))
+
+        await self._start_stream(send)
+        for finished in asyncio.as_completed(tasks):
+            for position, response in await finished:
+                response.update(index=position, id=items[position]["id"], question=items[position]["question"])
+                await self.send_event(send, "result", response)
+        await self._finish_stream(send, {"count": len(items), "timings": timings_block()})
+
+    async def _answer_batch_group(self, kind: str, positions: List[int], items: List[Dict],
+                                  retrieved: List[Tuple], documents: Dict) -> List[Tuple[int, Dict]]:
+        """(position, /chat response) for batch questions sharing their retrieved context"""
+        first = items[positions[0]]
+        hits, sources, context_title = retrieved[positions[0]]
+        if kind == "static":
+            response = await self.run_blocking(rag.compose_chat_response, first["question"], hits, sources,
+                                               context_title, documents, first["document_id"],
+                                               first["document_title"])
+            return [(position, dict(response)) for position in positions]
+        if kind == "no_context":
+            return [(position, rag.chat_envelope(rag.no_context_answer(first["question"], documents), [], documents,
+                                                 first["document_id"], first["document_title"]))
+                    for position in positions]
+
+        questions = list(dict.fromkeys(items[position]["question"] for position in positions))
+        context = "\n\n".join(hit["text"] for hit in hits)
+        try:
+            answers = await self._complete_group(questions, context, context_title)
+        except Exception as e:
+            logger.error(f"Error answering batch questions: {e}")
+            return [(position, {"error": str(e)}) for position in positions]
+        by_question = dict(zip(questions, answers))
+        passages = rag.hit_passages(hits, documents)
+        return [(position, rag.chat_envelope(by_question[items[position]["question"]], sources, documents,
+                                             items[position]["document_id"], items[position]["document_title"],
+                                             passages))
+                for position in positions]
+
+    async def _complete_group(self, questions: List[str], context: str, context_title: str) -> List[str]:
+        """Answers to questions about one context: one completion for all, else one per question"""
+        if len(questions) == 1:
+            return [await self._complete_one(questions[0], context, context_title)]
+        async with self.llm_slots:
+            with span("llm"):
+                completion = await self.llm_client.chat.completions.create(
+                    model=SimpleAnswerer.MODEL,
+                    messages=SimpleAnswerer.build_group_messages(questions, context, context_title),
+                    max_tokens=SimpleAnswerer.MAX_TOKENS * len(questions),
+                    temperature=SimpleAnswerer.TEMPERATURE
+                )
+        answers = SimpleAnswerer.parse_group_answers(completion.choices[0].message.content, len(questions))
+        if answers is not None:
+            return answers
+        logger.warning(f"Grouped completion did not return {len(questions)} answers; answering one by one")
+        return list(await asyncio.gather(*(self._complete_one(question, context, context_title)
+                                           for question in questions)))
+
+    async def _complete_one(self, question: str, context: str, context_title: str) -> str:
+        async with self.llm_slots:
+            with span("llm"):
+                completion = await self.llm_client.chat.completions.create(
+                    model=SimpleAnswerer.MODEL,
+                    messages=SimpleAnswerer.build_messages(question, context, context_title),
+                    max_tokens=SimpleAnswerer.MAX_TOKENS,
+                    temperature=SimpleAnswerer.TEMPERATURE
+                )
+        return completion.choices[0].message.content.strip()
+
+    async def _start_stream(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")] + CORS_HEADERS,
+        })
+
+    async def _stream_static(self, send, response: Dict):
+        """Stream an already composed answer as one token event plus the closing metadata"""
+        await self._start_stream(send)
+        await self.send_event(send, "token", {"delta": response["answer"]})
+        await self._finish_stream(send, response)
+
+    async def _stream_llm(self, send, messages: List[Dict], envelope: Dict):
+        """Forward OpenAI tokens to the client as server-sent events"""
+        await self._start_stream(send)
+        parts = []
+        try:
+            async with self.llm_slots:
+                with span("llm"):
+                    stream = await self.llm_client.chat.completions.create(
+                        model=SimpleAnswerer.MODEL,
+                        messages=messages,
+                        max_tokens=SimpleAnswerer.MAX_TOKENS,
+                        temperature=SimpleAnswerer.TEMPERATURE,
+                        stream=True
+                    )
+                    async for event in stream:
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            parts.append(delta)
+                            await self.send_event(send, "token", {"delta": delta})
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            await self.send_event(send, "error", {"error": str(e)})
+        envelope["answer"] = "".join(parts).strip()
+        envelope["timings"] = timings_block()
+        await self._finish_stream(send, envelope)
+
+    async def _finish_stream(self, send, response: Dict):
+        await self.send_event(send, "done", response)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def list_documents(self, scope, receive, send):
+        params = {name: values[0] for name, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        payload, status = rag.document_listing(params)
+        await self.send_json(send, payload, status)
+
+    async def get_document_content(self, document_id: str, send):
+        index = rag.get_index()
+        if document_id not in index.documents:
+            await self.send_json(send, {"error": "Document not found or not processed"}, 404)
+            return
+        content = index.get_content(document_id)
+        await self.send_json(send, {
+            "document_id": document_id,
+            "title": index.documents[document_id]['title'],
+            "content": content,
+            "chunks_count": len(index.get_chunk_ids(document_id)),
+            "content_length": len(content)
+        })
+
+
+app = AsyncRAGApp()
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.environ.get('RAG_PORT', 5001))
+    print("Starting Async RAG Server for MedDoc AI Flow...")
+    print(f" Server will be available at: http://localhost:{port}")
+    print("   POST /chat accepts \"stream\": true (or Accept: text/event-stream) for token streaming")
+    uvicorn.run(app, host='localhost', port=port)
@@ -0,0 +1,209 @@
+"""
+Synthetic Dutch medical corpus for the RAG benchmarks
+Seeded generator for intake letters, indication decisions and care plans in PDF,
+DOCX and TXT, plus a loopback file server so /ingest can download them without
+network access.
+"""
+
+import os
+import random
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+try:
+    from docx import Document as DocxDocument
+    DOCX_AVAILABLE = True
+except ImportError:
+    DOCX_AVAILABLE = False
+
+FORMATS = ("pdf", "docx", "txt")
+
+TERMS = [
+    "indicatie", "zorgverlening", "persoonsgebonden budget", "wijkverpleging", "thuiszorg",
+    "zorgplan", "herindicatie", "eigen bijdrage", "zorgtoewijzing", "begeleiding",
+    "dagbesteding", "mantelzorg", "respijtzorg", "zorgverzekeraar", "beschikking",
+    "hulpmiddel", "medicatieoverzicht", "huisbezoek", "zorgkantoor", "budgethouder",
+]
+
+DEFINITIONS = [
+    "een besluit van de gemeente over de hulp die een cliënt nodig heeft",
+    "het geheel van afspraken over zorg die thuis wordt geleverd",
+    "een bedrag waarmee de cliënt zelf zorg kan inkopen bij een zorgverlener naar keuze",
+    "de periodieke beoordeling of de huidige zorg nog passend is",
+    "de ondersteuning die een naaste zonder vergoeding aan de cliënt geeft",
+    "een schriftelijke vastlegging van de doelen en de afgesproken uren per week",
+    "de vergoeding die de cliënt per maand zelf betaalt aan het CAK",
+]
+
+ACTIONS = [
+    "vul het aanvraagformulier volledig in", "stuur de medische verklaring mee",
+    "plan een huisbezoek met de consulent", "controleer de gegevens in het zorgplan",
+    "onderteken de zorgovereenkomst", "dien de declaratie in bij het zorgkantoor",
+    "bewaar de beschikking bij uw administratie", "meld wijzigingen binnen vier weken",
+]
+
+REASONS = [
+    "de zorgbehoefte is toegenomen na de ziekenhuisopname",
+    "de mantelzorger kan de taken niet langer alleen dragen",
+    "de gemeente moet de aanvraag binnen acht weken beoordelen",
+    "het budget alleen voor geïndiceerde zorg mag worden gebruikt",
+    "de verzekeraar een machtiging vraagt voor hulpmiddelen",
+]
+
+FILLER = [
+    "De cliënt woont zelfstandig en ontvangt twee keer per week ondersteuning.",
+    "Tijdens het gesprek zijn de wensen van de cliënt en de familie besproken.",
+    "De huisarts heeft een verwijzing gestuurd voor aanvullende begeleiding.",
+    "Er zijn aanvullende vragen gesteld over de inzet van wijkverpleging.",
+    "De zorgaanbieder levert maandelijks een verantwoording van de geleverde uren.",
+    "Bij afwezigheid van de vaste zorgverlener wordt een vervanger ingezet.",
+]
+
+QUESTION_TEMPLATES = [
+    "Wat is {term}?",
+    "Hoe vraag ik {term} aan?",
+    "Waarom is {term} nodig?",
+    "Welke stappen horen bij {term}?",
+    'Waar staat "aanvullende vragen" in het dossier?',
+    "Wat betekent referentie {reference}?",
+]
+
+
+def generate_text(rng: random.Random, paragraphs: int) -> str:
+    """Dutch-like dossier text with definitions, numbered steps and explanations"""
+    parts = [f"Dossier {rng.randint(100000, 999999)} - referentie {rng.randint(2020, 2025)}-{rng.randint(10000, 99999)}"]
+    for _ in range(paragraphs):
+        term = rng.choice(TERMS)
+        kind = rng.random()
+        if kind < 0.3:
+            parts.append(f"{term.capitalize()} is {rng.choice(DEFINITIONS)}. {rng.choice(FILLER)}")
+        elif kind < 0.55:
+            steps = rng.sample(ACTIONS, 3)
+            parts.append(f"Aanvraag {term}:\n" + "\n".join(
+                f"Stap {number}: {action}." for number, action in enumerate(steps, 1)))
+        elif kind < 0.75:
+            parts.append(f"Voor {term} is een nieuwe beoordeling nodig omdat {rng.choice(REASONS)}.")
+        else:
+            parts.append(" ".join(rng.choice(FILLER) for _ in range(rng.randint(2, 4))))
+    return "\n\n".join(parts)
+
+
+def generate_questions(rng: random.Random, count: int) -> List[str]:
+    return [
+        rng.choice(QUESTION_TEMPLATES).format(
+            term=rng.choice(TERMS), reference=f"{rng.randint(2020, 2025)}-{rng.randint(10000, 99999)}")
+        for _ in range(count)
+    ]
+
+
+def _pdf_escape(line: str) -> bytes:
+    encoded = line.encode('cp1252', errors='replace')
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            if line and len(line) + len(word) + 1 > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+    return lines
+
+
+def write_pdf(path: str, text: str, lines_per_page: int = 60, width: int = 90):
+    """Minimal text PDF (Helvetica, WinAnsi) that PyPDF2 can extract"""
+    lines = _wrap(text, width)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+
+    objects: List[bytes] = []
+    page_ids = [3 + 2 * i for i in range(len(pages))]
+    font_id = 3 + 2 * len(pages)
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = b" ".join(f"{pid} 0 R".encode() for pid in page_ids)
+    objects.append(b"<< /Type /Pages /Kids [" + kids + b"] /Count " + str(len(pages)).encode() + b" >>")
+    for page_id, page_lines in zip(page_ids, pages):
+        stream = b"BT /F1 10 Tf 12 TL 50 800 Td " + b" ".join(
+            b"(" + _pdf_escape(line) + b") '" for line in page_lines) + b" ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {page_id + 1} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode())
+        objects.append(b"<< /Length " + str(len(stream)).encode() + b" >>\nstream\n" + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, 'wb') as handle:
+        handle.write(output)
+
+
+def write_docx(path: str, text: str):
+    document = DocxDocument()
+    for paragraph in text.split("\n"):
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_txt(path: str, text: str):
+    with open(path, 'w', encoding='utf-8') as handle:
+        handle.write(text)
+
+
+def generate_corpus(directory: str, documents: int, paragraphs: int = 40, seed: int = 0,
+                    formats: Optional[List[str]] = None) -> List[Dict]:
+    """Write documents round-robin over the formats; returns their descriptors"""
+    rng = random.Random(seed)
+    formats = [f for f in (formats or FORMATS) if f != "docx" or DOCX_AVAILABLE]
+    writers = {"pdf": write_pdf, "docx": write_docx, "txt": write_txt}
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for number in range(documents):
+        file_format = formats[number % len(formats)]
+        text = generate_text(rng, paragraphs)
+        filename = f"dossier-{number:05d}.{file_format}"
+        writers[file_format](os.path.join(directory, filename), text)
+        corpus.append({
+            "document_id": f"bench-{number:05d}",
+            "title": filename,
+            "filename": filename,
+            "format": file_format,
+            "path": os.path.join(directory, filename),
+        })
+    return corpus
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalFileServer:
+    """Serves a directory on 127.0.0.1 from a background thread"""
+
+    def __init__(self, directory: str):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=directory))
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, filename: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/{filename}"
+
+    def __enter__(self) -> "LocalFileServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Load test and soak driver for the MedDoc RAG servers
+Replays a weighted mix of /ingest, /chat (single-document, cross-document and
+client-filtered) and /documents calls at one or more target rates against a server
+running in this process on a real threaded HTTP listener. Documents come from the
+synthetic corpus on a loopback file server and OpenAI calls go to a fake
+OpenAI-compatible endpoint, so the run is offline and free.
+
+Requests are scheduled open-loop: latency is measured from the scheduled send time,
+so a saturated server shows up as queueing delay instead of a silently lower rate.
+Re-ingests reuse a fixed set of document ids, so resident memory should plateau;
+steady growth over a soak run points at a leak.
+
+Usage:
+    python benchmarks/load_test.py [--server advanced|vercel] [--rate 20,40,80] [--duration 30]
+    python benchmarks/load_test.py --rate 10 --duration 600 --output soak.json   # soak
+    python benchmarks/load_test.py --url http://localhost:5001 --pid 1234       # external server
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from corpus import LocalFileServer, generate_corpus, generate_questions  # noqa: E402
+from rag_benchmark import percentile  # noqa: E402
+
+SERVERS = {"advanced": "advanced_rag_server", "vercel": "vercel_rag_server"}
+
+DEFAULT_MIX = "ingest=1,chat_document=4,chat_corpus=2,chat_client=2,documents=1"
+
+CLIENT_IDS = ("client-1", "client-2", "client-3", "client-4")
+
+# A step counts as saturated when it achieves less than this share of its target rate
+SATURATION_RATIO = 0.9
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Current resident set size of a process (Linux /proc), None elsewhere"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as handle:
+            for line in handle:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions that answers after a fixed delay"""
+
+    delay = 0.2
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.delay)
+        answer = "Dit is een testantwoord op basis van de aangeleverde documenten."
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for word in answer.split():
+                chunk = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": body.get("model", "fake"),
+                         "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        payload = json.dumps({
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BackgroundServer:
+    """Runs a server with serve_forever on a daemon thread"""
+
+    def __init__(self, server):
+        self.server = server
+        self.thread = threading.Thread(target=server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self) -> "BackgroundServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start_app(server: str) -> BackgroundServer:
+    """Import a RAG server module and serve its Flask app on a threaded loopback listener"""
+    from werkzeug.serving import make_server
+    # Optional-dependency notices are printed at import; keep stdout for the report
+    with redirect_stdout(sys.stderr):
+        module = importlib.import_module(SERVERS[server])
+    return BackgroundServer(make_server("127.0.0.1", 0, module.app, threaded=True))
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    unknown = set(weights) - {"ingest", "chat_document", "chat_corpus", "chat_client", "documents"}
+    if unknown:
+        raise ValueError(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+class Workload:
+    """Builds the HTTP call for each operation of the mix"""
+
+    def __init__(self, base_url: str, files: LocalFileServer, corpus: List[Dict], seed: int):
+        self.base_url = base_url
+        self.files = files
+        self.corpus = corpus
+        self.rng = random.Random(seed)
+        self.questions = generate_questions(self.rng, 200)
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+
+    def client_of(self, doc: Dict) -> str:
+        return CLIENT_IDS[int(doc["document_id"].rsplit("-", 1)[1]) % len(CLIENT_IDS)]
+
+    def request(self, operation: str) -> Tuple[str, str, Optional[Dict]]:
+        """(method, url, json body) of one call"""
+        with self.lock:
+            doc = self.rng.choice(self.corpus)
+            question = self.rng.choice(self.questions)
+        if operation == "ingest":
+            return "POST", "/ingest", {"file_url": self.files.url(doc["filename"]), "document_id": doc["document_id"],
+                                       "title": doc["title"], "client_id": self.client_of(doc)}
+        if operation == "chat_document":
+            return "POST", "/chat", {"question": question, "document_id": doc["document_id"],
+                                     "document_title": doc["title"]}
+        if operation == "chat_corpus":
+            return "POST", "/chat", {"question": question}
+        if operation == "chat_client":
+            return "POST", "/chat", {"question": question, "client_id": self.client_of(doc)}
+        return "GET", "/documents", None
+
+    def call(self, operation: str) -> bool:
+        method, path, body = self.request(operation)
+        try:
+            response = self.session.request(method, self.base_url + path, json=body, timeout=60)
+            return response.status_code < 400
+        except requests.RequestException:
+            return False
+
+
+class Recorder:
+    """Thread-safe latency and error collection for one load step"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation: str, latency: float, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(latency)
+            self.errors[operation] = self.errors.get(operation, 0) + (0 if ok else 1)
+
+    def summary(self, elapsed: float) -> Dict[str, Dict]:
+        operations = {}
+        for operation, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            operations[operation] = {
+                "count": len(samples),
+                "errors": self.errors[operation],
+                "error_rate": round(self.errors[operation] / len(samples), 4),
+                "throughput_per_s": round(len(samples) / elapsed, 2),
+                "p50_ms": round(1000 * percentile(ordered, 0.50), 2),
+                "p95_ms": round(1000 * percentile(ordered, 0.95), 2),
+                "p99_ms": round(1000 * percentile(ordered, 0.99), 2),
+                "max_ms": round(1000 * ordered[-1], 2),
+            }
+        return operations
+
+
+def run_step(workload: Workload, weights: Dict[str, float], rate: float, duration: float,
+             concurrency: int, memory: List[Dict], pid: Optional[int], started: float) -> Dict:
+    """Send requests at a fixed rate for the duration; returns the step report"""
+    recorder = Recorder()
+    operations, operation_weights = zip(*weights.items())
+    rng = random.Random(int(rate * 1000))
+    interval = 1.0 / rate
+    step_start = time.perf_counter()
+    next_sample = step_start
+
+    def timed(operation: str, scheduled: float):
+        ok = workload.call(operation)
+        recorder.record(operation, time.perf_counter() - scheduled, ok)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as pool:
+        for number in itertools.count():
+            scheduled = step_start + number * interval
+            if scheduled - step_start >= duration:
+                break
+            now = time.perf_counter()
+            if scheduled > now:
+                time.sleep(scheduled - now)
+            if now >= next_sample:
+                memory.append({"t_s": round(now - started, 2), "rss_mb": rss_mb(pid)})
+                next_sample = now + 1.0
+            operation = rng.choices(operations, weights=operation_weights)[0]
+            pool.submit(timed, operation, scheduled)
+    elapsed = time.perf_counter() - step_start
+
+    operations_report = recorder.summary(elapsed)
+    completed = sum(op["count"] for op in operations_report.values())
+    errors = sum(op["errors"] for op in operations_report.values())
+    all_latencies = sorted(itertools.chain.from_iterable(recorder.latencies.values()))
+    return {
+        "target_rate": rate,
+        "achieved_rate": round(completed / elapsed, 2),
+        "requests": completed,
+        "error_rate": round(errors / completed, 4) if completed else 0.0,
+        "p50_ms": round(1000 * percentile(all_latencies, 0.50), 2),
+        "p95_ms": round(1000 * percentile(all_latencies, 0.95), 2),
+        "p99_ms": round(1000 * percentile(all_latencies, 0.99), 2),
+        "operations": operations_report,
+    }
+
+
+def memory_growth(memory: List[Dict]) -> Dict:
+    """Growth from the first to the last sample after warm-up, and the per-minute slope"""
+    samples = [sample for sample in memory if sample["rss_mb"] is not None]
+    if len(samples) < 2:
+        return {"start_mb": None, "end_mb": None, "growth_mb": None, "slope_mb_per_min": None}
+    count = len(samples)
+    mean_t = sum(s["t_s"] for s in samples) / count
+    mean_m = sum(s["rss_mb"] for s in samples) / count
+    spread = sum((s["t_s"] - mean_t) ** 2 for s in samples)
+    slope = sum((s["t_s"] - mean_t) * (s["rss_mb"] - mean_m) for s in samples) / spread if spread else 0.0
+    return {
+        "start_mb": round(samples[0]["rss_mb"], 1),
+        "end_mb": round(samples[-1]["rss_mb"], 1),
+        "growth_mb": round(samples[-1]["rss_mb"] - samples[0]["rss_mb"], 1),
+        "slope_mb_per_min": round(60 * slope, 2),
+    }
+
+
+def run(args) -> Dict:
+    weights = parse_mix(args.mix)
+    rates = [float(rate) for rate in args.rate.split(",")]
+    # The servers log every request at INFO, which would swamp stderr
+    logging.disable(logging.INFO)
+
+    FakeLLMHandler.delay = args.llm_delay_ms / 1000
+    with tempfile.TemporaryDirectory() as directory, \
+            BackgroundServer(ThreadingHTTPServer(("127.0.0.1", 0), FakeLLMHandler)) as llm:
+        # Read by the OpenAI client the servers create
+        os.environ["OPENAI_API_KEY"] = "load-test"
+        os.environ["OPENAI_BASE_URL"] = f"{llm.url}/v1"
+        # Re-ingests should parse like first ingests, not hit an extraction cache left by earlier runs
+        os.environ["RAG_EXTRACTION_CACHE"] = "0"
+
+        corpus = generate_corpus(directory, args.documents, args.paragraphs, args.seed)
+        with LocalFileServer(directory) as files:
+            if args.url:
+                target, pid = None, args.pid
+                base_url = args.url.rstrip("/")
+            else:
+                target, pid = start_app(args.server), None
+                target.__enter__()
+                base_url = target.url
+            try:
+                workload = Workload(base_url, files, corpus, args.seed)
+                warmup_started = time.perf_counter()
+                warmup_errors = sum(not workload.call("ingest") for _ in range(len(corpus)))
+                warmup = {"documents": len(corpus), "errors": warmup_errors,
+                          "seconds": round(time.perf_counter() - warmup_started, 2), "rss_mb": rss_mb(pid)}
+
+                memory: List[Dict] = []
+                started = time.perf_counter()
+                steps = []
+                for rate in rates:
+                    step = run_step(workload, weights, rate, args.duration, args.concurrency, memory, pid, started)
+                    steps.append(step)
+                    print(f"rate {rate:g}/s: achieved {step['achieved_rate']:g}/s, p95 {step['p95_ms']:.0f}ms, "
+                          f"errors {step['error_rate']:.1%}, RSS {rss_mb(pid) or 0:.0f}MB", file=sys.stderr)
+                memory.append({"t_s": round(time.perf_counter() - started, 2), "rss_mb": rss_mb(pid)})
+            finally:
+                if target is not None:
+                    target.__exit__(None, None, None)
+    logging.disable(logging.NOTSET)
+
+    saturated = [step["target_rate"] for step in steps
+                 if step["achieved_rate"] < SATURATION_RATIO * step["target_rate"]
+                 or (args.max_p95_ms and step["p95_ms"] > args.max_p95_ms)]
+    return {
+        "config": {"server": args.url or args.server, "mix": weights, "rates": rates, "duration_s": args.duration,
+                   "concurrency": args.concurrency, "documents": args.documents, "llm_delay_ms": args.llm_delay_ms,
+                   "seed": args.seed},
+        "warmup": warmup,
+        "steps": steps,
+        "saturation_rate": saturated[0] if saturated else None,
+        "memory": {"growth": memory_growth(memory), "timeline": memory},
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test the MedDoc RAG servers offline")
+    parser.add_argument("--server", choices=sorted(SERVERS), default="advanced", help="server to run in-process")
+    parser.add_argument("--url", help="load an already running server instead")
+    parser.add_argument("--pid", type=int, help="process id of the --url server, for memory sampling")
+    parser.add_argument("--rate", default="20", help="requests per second; a comma list runs one step per rate")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per rate step")
+    parser.add_argument("--concurrency", type=int, default=32, help="maximum requests in flight")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights, e.g. 'ingest=1,chat_document=4'")
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per document")
+    parser.add_argument("--llm-delay-ms", type=float, default=200, help="latency of the fake LLM")
+    parser.add_argument("--max-p95-ms", type=float, help="also count a step as saturated above this p95")
+    parser.add_argument("--max-growth-mb", type=float, help="exit non-zero when RSS grows more than this")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this file as well as stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    growth = report["memory"]["growth"]["growth_mb"]
+    if args.max_growth_mb is not None and growth is not None and growth > args.max_growth_mb:
+        print(f"Memory grew {growth:.1f}MB, more than the allowed {args.max_growth_mb:.1f}MB", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the MedDoc RAG ingest, retrieval and answer paths
+Times text extraction, chunking, index search, answer generation and the /ingest
+and /chat endpoints (Flask test client) over a synthetic Dutch corpus, writes a
+JSON report and exits non-zero when a stage regresses against the baseline.
+Runs fully offline: /ingest downloads from a loopback file server.
+
+Every stage runs a few untimed warm-up calls first, and the gate compares medians:
+with ten samples per extraction format the p95 is just the slowest one, which made
+the gate fail on a single scheduler hiccup. p95/p99 are still reported.
+
+Usage:
+    python benchmarks/rag_benchmark.py [--documents 30] [--questions 60] [--warmup 3] [--output report.json]
+    python benchmarks/rag_benchmark.py --update-baseline
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, redirect_stdout
+from typing import Dict, List, Optional
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from corpus import LocalFileServer, generate_corpus, generate_questions  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Allowed relative slowdown before a stage counts as a regression
+DEFAULT_TOLERANCE = 0.30
+
+# Absolute median slack, so sub-millisecond stages do not fail on timer noise
+MIN_DELTA_MS = 1.0
+
+# Untimed calls per stage before its samples are taken
+DEFAULT_WARMUP = 3
+
+CONFIG_KEYS = ("documents", "paragraphs", "questions", "seed")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if not RESOURCE_AVAILABLE:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+class StageTimer:
+    """Collects per-stage latencies, error counts and the peak RSS seen after each stage"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.peak_rss: Dict[str, Optional[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples.setdefault(name, []).append(time.perf_counter() - started)
+            self.errors.setdefault(name, 0)
+            self.peak_rss[name] = peak_rss_mb()
+
+    def error(self, name: str):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> Dict[str, Dict]:
+        stages = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            total = sum(samples)
+            stages[name] = {
+                "count": len(samples),
+                "errors": self.errors.get(name, 0),
+                "total_s": round(total, 4),
+                "throughput_per_s": round(len(samples) / total, 2) if total else 0.0,
+                "p50_ms": round(1000 * percentile(ordered, 0.50), 3),
+                "p95_ms": round(1000 * percentile(ordered, 0.95), 3),
+                "p99_ms": round(1000 * percentile(ordered, 0.99), 3),
+                "peak_rss_mb": self.peak_rss.get(name),
+            }
+        return stages
+
+
+def run(documents: int, paragraphs: int, questions: int, seed: int, warmup: int = DEFAULT_WARMUP) -> Dict:
+    """Generate the corpus and time every stage; returns the JSON report"""
+    # The server logs every request at INFO, which would dominate the timings
+    logging.disable(logging.INFO)
+    # Every timed ingest must parse; a warm extraction cache would turn the gate into cache hits
+    os.environ["RAG_EXTRACTION_CACHE"] = "0"
+    # Optional-dependency notices are printed at import; keep stdout for the report
+    with redirect_stdout(sys.stderr):
+        import advanced_rag_server as server
+        import rag_capabilities
+        # Optional parsers load lazily; import them now so the first sample does not pay for it
+        rag_capabilities.preload(background=False)
+    from advanced_rag_server import DocumentProcessor, IntelligentAnswerer
+    from rag_chunking import chunk_text
+    from rag_index import CorpusIndex
+
+    rng = random.Random(seed)
+    timer = StageTimer()
+    extractors = {
+        "pdf": DocumentProcessor.extract_text_from_pdf,
+        "docx": DocumentProcessor.extract_text_from_docx,
+        "txt": DocumentProcessor.extract_text_from_txt,
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = generate_corpus(directory, documents, paragraphs, seed)
+        question_list = generate_questions(rng, questions)
+
+        for extension, extract in extractors.items():
+            sample = next((doc for doc in corpus if doc["format"] == extension), None)
+            for _ in range(warmup if sample else 0):
+                extract(sample["path"])
+
+        texts = {}
+        for doc in corpus:
+            with timer.stage(f"extract_{doc['format']}"):
+                texts[doc["document_id"]] = extractors[doc["format"]](doc["path"])
+
+        for text in list(texts.values())[:warmup]:
+            chunk_text(text)
+        chunks = {}
+        for doc_id, text in texts.items():
+            with timer.stage("chunk_text"):
+                chunks[doc_id] = chunk_text(text)
+
+        # The index the servers search, with each chunk's answer features precomputed as on ingest
+        index = CorpusIndex(server.analyzer, server.ANN_PARAMS)
+        for doc in corpus:
+            doc_chunks = chunks[doc["document_id"]]
+            index.add_document(doc["document_id"], {"title": doc["title"]}, texts[doc["document_id"]], doc_chunks,
+                               features=[IntelligentAnswerer.analyze_chunk(chunk) for chunk in doc_chunks])
+
+        def answer(question: str, hits: List[Dict], title: str) -> str:
+            return IntelligentAnswerer.generate_answer(question, [hit["text"] for hit in hits], title,
+                                                       [hit["features"] for hit in hits],
+                                                       [hit["passage"] for hit in hits])
+
+        for question, doc in zip(question_list[:warmup], corpus):
+            answer(question, index.search_hits(question, doc_ids=[doc["document_id"]], reranker=server.reranker),
+                   doc["title"])
+        for question in question_list:
+            doc = rng.choice(corpus)
+            with timer.stage("search_hits"):
+                hits = index.search_hits(question, doc_ids=[doc["document_id"]], reranker=server.reranker)
+            with timer.stage("generate_answer"):
+                answer(question, hits, doc["title"])
+
+        client = server.app.test_client()
+        with LocalFileServer(directory) as files:
+            # Re-ingesting a document replaces it, so the warm-up leaves the index as the timed run builds it
+            for doc in corpus[:warmup]:
+                client.post('/ingest', json={
+                    "file_url": files.url(doc["filename"]),
+                    "document_id": doc["document_id"],
+                    "title": doc["title"],
+                })
+            for doc in corpus:
+                with timer.stage("ingest"):
+                    response = client.post('/ingest', json={
+                        "file_url": files.url(doc["filename"]),
+                        "document_id": doc["document_id"],
+                        "title": doc["title"],
+                    })
+                if response.status_code != 200:
+                    timer.error("ingest")
+
+        for question, doc in zip(question_list[:warmup], corpus):
+            client.post('/chat', json={"question": question, "document_id": doc["document_id"]})
+            client.post('/chat', json={"question": question})
+        for question in question_list:
+            doc = rng.choice(corpus)
+            with timer.stage("chat_document"):
+                response = client.post('/chat', json={
+                    "question": question,
+                    "document_id": doc["document_id"],
+                    "document_title": doc["title"],
+                })
+            if response.status_code != 200:
+                timer.error("chat_document")
+            with timer.stage("chat_corpus"):
+                response = client.post('/chat', json={"question": question})
+            if response.status_code != 200:
+                timer.error("chat_corpus")
+
+    logging.disable(logging.NOTSET)
+    return {
+        "config": {"documents": documents, "paragraphs": paragraphs, "questions": questions, "seed": seed,
+                   "warmup": warmup},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "stages": timer.summary(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Describe every stage whose median latency or error count is worse than the baseline"""
+    regressions = []
+    for name, current in report["stages"].items():
+        reference = baseline["stages"].get(name)
+        if reference is None:
+            continue
+        # Throughput is count / total and swings with a single outlier like p95 does; neither is gated
+        if current["p50_ms"] - reference["p50_ms"] > max(tolerance * reference["p50_ms"], MIN_DELTA_MS):
+            regressions.append(f"{name}: p50 {current['p50_ms']:.2f}ms vs baseline {reference['p50_ms']:.2f}ms")
+        if current["errors"] > reference["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors vs baseline {reference['errors']}")
+    if report["peak_rss_mb"] and baseline.get("peak_rss_mb") \
+            and report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak RSS {report['peak_rss_mb']:.1f}MB vs baseline {baseline['peak_rss_mb']:.1f}MB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the MedDoc RAG server paths offline")
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--paragraphs", type=int, default=40, help="paragraphs per document")
+    parser.add_argument("--questions", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="untimed calls per stage")
+    parser.add_argument("--output", help="write the report to this file as well as stdout")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    report = run(args.documents, args.paragraphs, args.questions, args.seed, args.warmup)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one", file=sys.stderr)
+        return 0
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    if any(baseline["config"].get(key) != report["config"][key] for key in CONFIG_KEYS):
+        print("Baseline was recorded with a different configuration; comparison skipped", file=sys.stderr)
+        return 0
+
+    regressions = compare(report, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%} of the baseline", file=sys.stderr)
+        return 1
+    print("No regressions against the baseline", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget check for the MedDoc RAG servers
+Imports each server in a fresh interpreter, times the import and the first
+/health response, lists the heaviest imports (python -X importtime) and fails
+when a server exceeds its import budget or /health pulled in an optional
+dependency that should load lazily.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--runs 5] [--server advanced_rag_server]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Median import time allowed per server, in milliseconds
+IMPORT_BUDGET_MS = {
+    "advanced_rag_server": 400,
+    "vercel_rag_server": 300,
+}
+
+# Modules that must stay unloaded until a request needs them
+LAZY_MODULES = ("PyPDF2", "docx", "numpy", "supabase", "openai", "requests", "pytesseract", "psycopg2", "llama_index",
+                "langchain")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {server} as server
+imported = time.perf_counter()
+response = server.app.test_client().get('/health')
+answered = time.perf_counter()
+print(json.dumps({{
+    "import_ms": 1000 * (imported - started),
+    "first_health_ms": 1000 * (answered - started),
+    "status": response.status_code,
+    "loaded": [name for name in {lazy} if name in sys.modules],
+}}))
+"""
+
+
+def probe(server: str) -> Dict:
+    """Import the server and answer /health in a fresh interpreter"""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(server=server, lazy=LAZY_MODULES)],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def heaviest_imports(server: str, count: int = 10) -> List[Tuple[str, float]]:
+    """Top-level imports of the server by cumulative import time"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {server}"],
+        cwd=REPO_DIR, capture_output=True, text=True, check=True,
+    ).stderr
+    imports, children = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # Children are reported before their parent, one indentation level deeper
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000))
+        elif depth == 0:
+            if name.strip() == server:
+                imports = children
+            children = []
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check the cold-start import budget of the RAG servers")
+    parser.add_argument("--server", action="append", choices=sorted(IMPORT_BUDGET_MS),
+                        help="server module to check (default: all)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, help="override the per-server import budget")
+    args = parser.parse_args()
+
+    failures = []
+    report = {}
+    for server in args.server or sorted(IMPORT_BUDGET_MS):
+        runs = [probe(server) for _ in range(args.runs)]
+        import_ms = sorted(run["import_ms"] for run in runs)[len(runs) // 2]
+        health_ms = sorted(run["first_health_ms"] for run in runs)[len(runs) // 2]
+        budget = args.budget_ms or IMPORT_BUDGET_MS[server]
+        loaded = sorted(set().union(*(run["loaded"] for run in runs)))
+        report[server] = {
+            "import_ms_median": round(import_ms, 1),
+            "first_health_ms_median": round(health_ms, 1),
+            "budget_ms": budget,
+            "eagerly_loaded": loaded,
+            "heaviest_imports_ms": {name: round(ms, 1) for name, ms in heaviest_imports(server)},
+        }
+        if import_ms > budget:
+            failures.append(f"{server}: import took {import_ms:.0f}ms, budget {budget:.0f}ms")
+        if loaded:
+            failures.append(f"{server}: /health loaded {', '.join(loaded)}")
+        if any(run["status"] != 200 for run in runs):
+            failures.append(f"{server}: /health did not return 200")
+
+    print(json.dumps(report, indent=2))
+    for failure in failures:
+        print(f"OVER BUDGET {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
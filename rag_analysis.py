@@ -0,0 +1,206 @@
+"""
+Text analysis for the MedDoc RAG index
+A pluggable analyzer chain (tokenizer -> lowercase -> stopwords -> stemmer ->
+decompounder) tuned for Dutch medical and administrative text. Every analyzer
+memoizes token -> terms, so normalisation is paid once per vocabulary word
+rather than once per occurrence.
+"""
+
+import re
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Letters and digits only, so "PGB." and "(PGB)" both become "pgb"
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+DUTCH_STOPWORDS = frozenset("""
+aan al alle als alles altijd andere ben bij daar dan dat de der deze die dit doch doen door dus een eens
+en er ge geen geweest haar had heb hebben heeft hem het hier hij hoe hun iemand iets ik in is ja je kan
+kon kunnen maar me meer men met mij mijn moet na naar niet niets nog nu of om omdat onder ons ook op over
+reeds te tegen toch toen tot u uit uw van veel voor want waren was wat we wel werd wezen wie wij wil
+worden wordt zal ze zei zelf zich zij zijn zo zonder zou
+""".split())
+
+ENGLISH_STOPWORDS = frozenset("""
+a about an and are as at be been but by for from has have he her his i if in into is it its me my no
+not of on or our she so than that the their them then there these they this to was we were what when
+which who why will with you your
+""".split())
+
+# Seed lexicon of compound parts common in our intake letters and care dossiers
+COMPOUND_LEXICON = frozenset("""
+aanvraag aanvullend afspraak arts begeleiding behandel beschikking besluit bewijs brief budget
+centrum client dag dossier factuur formulier gebonden gegeven geld gemeente gezondheid hulp huis
+indicatie jeugd kantoor kosten medicatie middel nacht ouder pgb persoon plan premie recht regel
+tarief thuis uren verlening verpleging verzekeraar verzekering vergoeding vraag wet wijk wlz wmo
+zorg zvw
+""".split())
+
+
+class LightDutchStemmer:
+    """Light suffix stripper: plural/inflection endings, -heden, -end/-ing, undoubling"""
+
+    UNDOUBLE = ('kk', 'dd', 'ff', 'gg', 'll', 'mm', 'nn', 'pp', 'rr', 'ss', 'tt')
+    VOWELS = set('aeiouy')
+
+    def __call__(self, word: str) -> str:
+        if len(word) <= 3 or not word.isalpha():
+            return word
+        if word.endswith('heden'):
+            return word[:-5] + 'heid'
+
+        stem = word
+        for suffix in ('ene', 'en', 'e', 's'):
+            if stem.endswith(suffix) and len(stem) - len(suffix) >= 3:
+                candidate = stem[:-len(suffix)]
+                # Plural -s only after an unstressed ending or a stop ("tafels", "budgets"),
+                # so "huis" and "pas" stay whole
+                if suffix == 's' and not (candidate.endswith(('el', 'er', 'en', 'em', 'je'))
+                                          or candidate[-1] in 'tkp'):
+                    break
+                stem = candidate
+                break
+        for suffix in ('end', 'ing'):
+            if stem.endswith(suffix) and len(stem) - len(suffix) >= 3:
+                stem = stem[:-len(suffix)]
+                break
+
+        if stem.endswith(self.UNDOUBLE):
+            stem = stem[:-1]
+        # "vraag"/"vragen" -> "vrag": undouble the vowel of a closed final syllable
+        if (len(stem) >= 4 and stem[-1] not in self.VOWELS and stem[-2] == stem[-3]
+                and stem[-2] in 'aeou' and stem[-4] not in self.VOWELS):
+            stem = stem[:-2] + stem[-1]
+        if stem.endswith('z'):
+            stem = stem[:-1] + 's'
+        elif stem.endswith('v'):
+            stem = stem[:-1] + 'f'
+        return stem
+
+
+class Decompounder:
+    """Splits compounds into known lexicon parts ("zorgverlening" -> "zorg", "verlening")"""
+
+    LINKING = ('s', 'en', 'e')
+
+    def __init__(self, lexicon: Iterable[str], stemmer: Callable[[str], str], min_part: int = 3):
+        self.stemmer = stemmer
+        self.min_part = min_part
+        self.lexicon = set(lexicon)
+        self.stems = {stemmer(word) for word in self.lexicon}
+
+    def _known(self, part: str) -> bool:
+        return part in self.lexicon or self.stemmer(part) in self.stems
+
+    def split(self, word: str) -> List[str]:
+        """Return the parts of a compound, or [] when it does not decompose"""
+        if len(word) < 2 * self.min_part + 1 or not word.isalpha():
+            return []
+        for cut in range(len(word) - self.min_part, self.min_part - 1, -1):
+            head, tail = word[:cut], word[cut:]
+            if not self._known(tail):
+                continue
+            if self._known(head):
+                return [head, tail]
+            for linking in self.LINKING:
+                if head.endswith(linking) and self._known(head[:-len(linking)]):
+                    return [head[:-len(linking)], tail]
+            rest = self.split(head)
+            if rest:
+                return rest + [tail]
+        return []
+
+
+class Analyzer:
+    """Tokenizer plus term filters, memoized per distinct token"""
+
+    def __init__(self, name: str, stopwords: Iterable[str] = (),
+                 stemmer: Optional[Callable[[str], str]] = None,
+                 decompounder: Optional[Decompounder] = None,
+                 pattern=WORD_PATTERN, max_cache_size: int = 500000):
+        self.name = name
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = stemmer
+        self.decompounder = decompounder
+        self.pattern = pattern
+        self.max_cache_size = max_cache_size
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _normalize(self, word: str) -> Tuple[str, ...]:
+        if word in self.stopwords:
+            return ()
+        terms = [self.stemmer(word) if self.stemmer else word]
+        if self.decompounder is not None:
+            for part in self.decompounder.split(word):
+                term = self.stemmer(part) if self.stemmer else part
+                if term not in terms and term not in self.stopwords:
+                    terms.append(term)
+        return tuple(terms)
+
+    def terms(self, token: str) -> Tuple[str, ...]:
+        """Normalized terms of one raw token (empty for stopwords)"""
+        token = token.lower()
+        cached = self._cache.get(token)
+        if cached is not None:
+            self.cache_hits += 1
+            return cached
+        self.cache_misses += 1
+        if len(self._cache) >= self.max_cache_size:
+            self._cache.clear()
+        terms = self._cache[token] = self._normalize(token)
+        return terms
+
+    def analyze(self, text: str) -> Tuple[List[Tuple[str, ...]], array]:
+        """Terms per token position plus a flat array of (start, end) token offsets"""
+        token_terms = []
+        offsets = array('I')
+        for match in self.pattern.finditer(text):
+            token_terms.append(self.terms(match.group()))
+            offsets.extend(match.span())
+        return token_terms, offsets
+
+    def query_terms(self, text: str) -> List[str]:
+        """Distinct terms of a query, in first-seen order"""
+        seen: Dict[str, None] = {}
+        for match in self.pattern.finditer(text):
+            for term in self.terms(match.group()):
+                seen.setdefault(term)
+        return list(seen)
+
+    def cache_stats(self) -> Dict:
+        return {"size": len(self._cache), "hits": self.cache_hits, "misses": self.cache_misses}
+
+
+def build_dutch_analyzer() -> Analyzer:
+    stemmer = LightDutchStemmer()
+    return Analyzer(
+        "dutch",
+        stopwords=DUTCH_STOPWORDS | ENGLISH_STOPWORDS,
+        stemmer=stemmer,
+        decompounder=Decompounder(COMPOUND_LEXICON, stemmer),
+    )
+
+
+def build_whitespace_analyzer() -> Analyzer:
+    """The original behaviour: lowercase whitespace split, punctuation kept"""
+    return Analyzer("whitespace", pattern=re.compile(r'\S+'))
+
+
+ANALYZER_FACTORIES = {
+    "dutch": build_dutch_analyzer,
+    "whitespace": build_whitespace_analyzer,
+}
+_analyzers: Dict[str, Analyzer] = {}
+
+DEFAULT_ANALYZER = "dutch"
+
+
+def get_analyzer(name: str = DEFAULT_ANALYZER) -> Analyzer:
+    """Shared analyzer instance per name, so the term cache is reused across indexes"""
+    if name not in _analyzers:
+        if name not in ANALYZER_FACTORIES:
+            raise ValueError(f"Unknown analyzer: {name}")
+        _analyzers[name] = ANALYZER_FACTORIES[name]()
+    return _analyzers[name]
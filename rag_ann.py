@@ -0,0 +1,478 @@
+"""
+Approximate nearest-neighbour search over chunk embeddings
+A hierarchical navigable small world (HNSW) graph whose node ids are chunk ids.
+The mutable graph takes incremental inserts and tombstones removals; the frozen
+graph reads the same links straight out of a snapshot generation and scores with
+the snapshot's embedding matrix (or its quantized codes), so attaching rebuilds
+nothing.
+
+Graphs are built in Python over numpy: add_batch (bundle builds, chunk stores,
+embedding a document) inserts about 1 ms per 64-dimensional vector and 2-3 ms per
+1536-dimensional one up to EXACT_BUILD_LIMIT nodes, and add() continues beyond it
+at a few ms per vector. That suits corpora of tens of thousands of chunks; a
+million-chunk graph takes hours and belongs in pgvector (rag_chunk_store). Queries
+stay sub-millisecond to a few ms at those sizes. Searches run in the Vercel bundle
+(RAG_BUNDLE_SEMANTIC) and the chunk stores; the Flask server answers lexically.
+"""
+
+import heapq
+import logging
+import math
+import random
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from rag_capabilities import available, lazy_module
+
+# numpy loads on first vector operation, not at import
+NUMPY_AVAILABLE = available("numpy")
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+# Links per node on the upper layers; layer 0 keeps twice as many
+DEFAULT_M = 16
+
+# Candidate list size while inserting: build time against graph quality
+DEFAULT_EF_CONSTRUCTION = 100
+
+# Candidate list size while searching: latency against recall (never below k)
+DEFAULT_EF_SEARCH = 64
+
+# add_batch takes neighbour candidates from exact similarities up to this many graph
+# nodes; each new node then costs one O(nodes) selection, so larger graphs use add()
+EXACT_BUILD_LIMIT = 50000
+
+# New nodes per block product in add_batch (a BUILD_BLOCK x nodes float32 score matrix)
+BUILD_BLOCK = 128
+
+# Level byte of chunk ids without a node in an exported graph
+NO_LEVEL = 255
+
+MAX_LEVEL = NO_LEVEL - 1
+
+
+def _normalize(vector) -> "np.ndarray":
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class HNSWGraph:
+    """Layered greedy search shared by the mutable and frozen graphs
+
+    Subclasses provide neighbors(node, layer), is_live(node), live_nodes(),
+    vector(node) and _similarities(query, nodes); similarity is cosine. Graphs
+    scoring quantized vectors set quantized and rerank_factor and override rerank().
+    """
+
+    entry_point: Optional[int] = None
+    max_level = -1
+    ef_search = DEFAULT_EF_SEARCH
+    quantized = False
+    rerank_factor = 1
+
+    def _prepare(self, vector):
+        return _normalize(vector)
+
+    def rerank(self, vector, candidates: List[Tuple[float, int]], k: int) -> List[Tuple[float, int]]:
+        """Exact scores for approximate candidates; graph scores already are exact"""
+        return candidates[:k]
+
+    def _search_layer(self, query, entry_points: List[Tuple[float, int]], ef: int,
+                      layer: int) -> List[Tuple[float, int]]:
+        """Best-first expansion from the entry points, keeping the ef most similar nodes"""
+        visited = {node for _, node in entry_points}
+        candidates = [(-similarity, node) for similarity, node in entry_points]
+        heapq.heapify(candidates)
+        best = list(entry_points)
+        heapq.heapify(best)
+        while candidates:
+            negative, node = heapq.heappop(candidates)
+            if len(best) >= ef and -negative < best[0][0]:
+                break
+            fresh = [neighbor for neighbor in self.neighbors(node, layer) if neighbor not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for similarity, neighbor in zip(self._similarities(query, fresh).tolist(), fresh):
+                if len(best) < ef or similarity > best[0][0]:
+                    heapq.heappush(candidates, (-similarity, neighbor))
+                    heapq.heappush(best, (similarity, neighbor))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+        return best
+
+    def query(self, vector, k: int = 10, ef: Optional[int] = None,
+              allowed: Optional[Set[int]] = None) -> List[Tuple[float, int]]:
+        """Approximate top-k (similarity, chunk_id) pairs, optionally restricted to allowed ids"""
+        if self.entry_point is None:
+            return []
+        query = self._prepare(vector)
+        entry = self.entry_point
+        current = [(float(self._similarities(query, [entry])[0]), entry)]
+        for layer in range(self.max_level, 0, -1):
+            current = [max(self._search_layer(query, current, 1, layer))]
+        found = self._search_layer(query, current, max(ef or self.ef_search, k), 0)
+        return heapq.nlargest(k, (
+            (similarity, node) for similarity, node in found
+            if self.is_live(node) and (allowed is None or node in allowed)
+        ))
+
+    def exact(self, vector, k: int = 10, nodes: Optional[Sequence[int]] = None) -> List[Tuple[float, int]]:
+        """Brute-force top-k over the given nodes (all live nodes by default)"""
+        nodes = np.asarray(self.live_nodes() if nodes is None else nodes, dtype=np.int64)
+        if not len(nodes):
+            return []
+        similarities = self._similarities(self._prepare(vector), nodes)
+        top = np.argpartition(similarities, -k)[-k:] if len(nodes) > k else np.arange(len(nodes))
+        return sorted(((float(similarities[i]), int(nodes[i])) for i in top), reverse=True)
+
+    def recall_at_k(self, k: int = 10, samples: int = 100, ef: Optional[int] = None,
+                    queries: Optional[Iterable] = None, seed: int = 0) -> Dict:
+        """Self-check: share of the exact top-k the graph returns, with average latencies
+
+        Without explicit queries, stored vectors of sampled nodes are used.
+        """
+        live = np.asarray(self.live_nodes(), dtype=np.int64)
+        if queries is None:
+            picks = random.Random(seed).sample(range(len(live)), min(samples, len(live)))
+            queries = [self.vector(int(live[pick])) for pick in picks]
+
+        found = expected = count = 0
+        ann_seconds = exact_seconds = 0.0
+        for query in queries:
+            started = time.perf_counter()
+            approximate = {node for _, node in self.query(query, k, ef)}
+            ann_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            exact = {node for _, node in self.exact(query, k, live)}
+            exact_seconds += time.perf_counter() - started
+            found += len(approximate & exact)
+            expected += len(exact)
+            count += 1
+
+        return {
+            "k": k,
+            "queries": count,
+            "ef_search": max(ef or self.ef_search, k),
+            "recall": found / expected if expected else 1.0,
+            "ann_ms": 1000 * ann_seconds / count if count else 0.0,
+            "exact_ms": 1000 * exact_seconds / count if count else 0.0,
+        }
+
+
+class HNSWIndex(HNSWGraph):
+    """Mutable graph with incremental inserts and tombstoned removals
+
+    Removed nodes keep routing searches until the next export, which drops them
+    and reconnects their neighbours.
+    """
+
+    def __init__(self, dim: int, m: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+                 ef_search: int = DEFAULT_EF_SEARCH, seed: Optional[int] = None):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for the ANN index")
+        self.dim = dim
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_scale = 1 / math.log(max(m, 2))
+        self._random = random.Random(seed)
+        self._vectors = np.zeros((16, dim), dtype=np.float32)
+        self._levels: Dict[int, int] = {}
+        self._links: Dict[int, List[List[int]]] = {}
+        self._deleted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._levels) - len(self._deleted)
+
+    def __contains__(self, node: int) -> bool:
+        return node in self._levels
+
+    def params(self) -> Dict:
+        return {"m": self.m, "ef_construction": self.ef_construction, "ef_search": self.ef_search}
+
+    def neighbors(self, node: int, layer: int) -> List[int]:
+        links = self._links[node]
+        return links[layer] if layer < len(links) else []
+
+    def is_live(self, node: int) -> bool:
+        return node not in self._deleted
+
+    def live_nodes(self) -> List[int]:
+        return [node for node in self._levels if node not in self._deleted]
+
+    def tombstoned(self) -> int:
+        """Removed nodes still held for routing"""
+        return len(self._deleted)
+
+    def vector(self, node: int):
+        return self._vectors[node]
+
+    def _similarities(self, query, nodes):
+        return self._vectors[nodes] @ query
+
+    def _layer_limit(self, layer: int) -> int:
+        return 2 * self.m if layer == 0 else self.m
+
+    def _select(self, base, candidates: Iterable[Tuple[float, int]], limit: int) -> List[int]:
+        """Neighbour heuristic: keep a candidate only when it is closer to base than to any kept one"""
+        ranked = sorted(candidates, reverse=True)
+        if len(ranked) <= 1:
+            return [node for _, node in ranked]
+        vectors = self._vectors[[node for _, node in ranked]]
+        maximum = np.maximum
+        # Each candidate's highest similarity to a kept one, updated by one product per kept node
+        closest = None
+        closest_values: List[float] = []
+        chosen: List[int] = []
+        for position, (similarity, node) in enumerate(ranked):
+            if len(chosen) >= limit:
+                break
+            if chosen and closest_values[position] > similarity:
+                continue
+            chosen.append(node)
+            row = vectors @ vectors[position]
+            closest = row if closest is None else maximum(closest, row)
+            closest_values = closest.tolist()
+        return chosen
+
+    def _place(self, node: int, vector) -> int:
+        """Store a new node's normalised vector and draw its level"""
+        if node in self._levels:
+            raise ValueError(f"Node {node} is already in the graph")
+        if len(vector) != self.dim:
+            raise ValueError(f"Expected a {self.dim}-dimensional vector, got {len(vector)}")
+        if node >= len(self._vectors):
+            grown = np.zeros((max(node + 1, 2 * len(self._vectors)), self.dim), dtype=np.float32)
+            grown[:len(self._vectors)] = self._vectors
+            self._vectors = grown
+        self._vectors[node] = _normalize(vector)
+        level = min(int(-math.log(1.0 - self._random.random()) * self._level_scale), MAX_LEVEL)
+        self._levels[node] = level
+        self._links[node] = [[] for _ in range(level + 1)]
+        return level
+
+    def _connect(self, node: int, layer: int, candidates: Iterable[Tuple[float, int]]):
+        """Link a node to its selected candidates on one layer, re-pruning neighbours that overflow"""
+        chosen = self._select(self._vectors[node], candidates, self.m)
+        self._links[node][layer] = chosen
+        limit = self._layer_limit(layer)
+        for neighbor in chosen:
+            links = self._links[neighbor][layer]
+            links.append(node)
+            if len(links) > limit:
+                similarities = (self._vectors[links] @ self._vectors[neighbor]).tolist()
+                self._links[neighbor][layer] = self._select(
+                    self._vectors[neighbor], zip(similarities, links), limit)
+
+    def _promote(self, node: int, level: int):
+        if self.entry_point is None or level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def add(self, node: int, vector):
+        """Insert a chunk vector; node ids must be unique and are never reused"""
+        level = self._place(node, vector)
+        if self.entry_point is None:
+            self._promote(node, level)
+            return
+        query = self._vectors[node]
+        current = [(float(self._vectors[self.entry_point] @ query), self.entry_point)]
+        for layer in range(self.max_level, level, -1):
+            current = [max(self._search_layer(query, current, 1, layer))]
+        for layer in range(min(level, self.max_level), -1, -1):
+            current = self._search_layer(query, current, self.ef_construction, layer)
+            self._connect(node, layer, current)
+        self._promote(node, level)
+
+    def add_batch(self, nodes: Sequence[int], vectors):
+        """Insert many chunk vectors, taking each one's neighbour candidates from a numpy block product
+
+        Every block of BUILD_BLOCK new nodes is scored against all live nodes inserted
+        before it in one matrix product, and each node takes its ef_construction most
+        similar predecessors per layer instead of walking the graph, which is several
+        times faster than add() and gives exact candidates. Past EXACT_BUILD_LIMIT
+        nodes the rest are inserted by add().
+        """
+        if len(nodes) != len(vectors):
+            raise ValueError(f"{len(nodes)} nodes but {len(vectors)} vectors")
+        pool = [node for node in self._levels if node not in self._deleted]
+        pool_levels = [self._levels[node] for node in pool]
+        position = 0
+        while position < len(nodes) and len(pool) + BUILD_BLOCK <= EXACT_BUILD_LIMIT:
+            block = list(nodes[position:position + BUILD_BLOCK])
+            block_vectors = vectors[position:position + BUILD_BLOCK]
+            levels = [self._place(node, vector) for node, vector in zip(block, block_vectors)]
+            before = len(pool)
+            pool.extend(block)
+            pool_levels.extend(levels)
+            pool_array = np.asarray(pool, dtype=np.int64)
+            level_array = np.asarray(pool_levels)
+            scores = self._vectors[block] @ self._vectors[pool_array].T
+            for offset, (node, level) in enumerate(zip(block, levels)):
+                # Predecessors only: the nodes inserted before this one
+                count = before + offset
+                for layer in range(min(level, self.max_level), -1, -1):
+                    eligible = np.flatnonzero(level_array[:count] >= layer) if layer else np.arange(count)
+                    row = scores[offset, eligible]
+                    if len(eligible) > self.ef_construction:
+                        top = np.argpartition(row, -self.ef_construction)[-self.ef_construction:]
+                        eligible, row = eligible[top], row[top]
+                    self._connect(node, layer, zip(row.tolist(), pool_array[eligible].tolist()))
+                self._promote(node, level)
+            position += len(block)
+        for node, vector in zip(nodes[position:], vectors[position:]):
+            self.add(node, vector)
+
+    def remove(self, node: int):
+        """Tombstone a node; it stays reachable for routing until the next export"""
+        if node in self._levels:
+            self._deleted.add(node)
+
+    def export(self, renumber: Dict[int, int], count: int) -> Tuple[Dict, Dict[str, array]]:
+        """Flatten the live graph onto renumbered chunk ids for a snapshot
+
+        Returns header metadata and the ann_levels ('B', one per chunk, NO_LEVEL when
+        absent), ann_node_lists ('Q'), ann_link_offsets ('Q') and ann_links ('I')
+        sections. Links to tombstoned nodes are replaced by those nodes' own live
+        neighbours and re-pruned, so removals do not cut the graph apart.
+        """
+        levels = array('B', [NO_LEVEL]) * count
+        node_lists = array('Q', [0])
+        link_offsets = array('Q', [0])
+        links = array('I')
+        owners: List[Optional[int]] = [None] * count
+        for node in self._levels:
+            if node not in self._deleted and node in renumber:
+                owners[renumber[node]] = node
+
+        for new_id, node in enumerate(owners):
+            if node is not None:
+                levels[new_id] = self._levels[node]
+                for layer, neighbors in enumerate(self._links[node]):
+                    for neighbor in self._repaired(node, layer, neighbors):
+                        links.append(renumber[neighbor])
+                    link_offsets.append(len(links))
+            node_lists.append(len(link_offsets) - 1)
+
+        live = [(level, node) for node, level in self._levels.items()
+                if node not in self._deleted and node in renumber]
+        entry = self.entry_point
+        if entry is None or entry not in renumber or entry in self._deleted:
+            entry = max(live)[1] if live else None
+        meta = dict(self.params(), dim=self.dim,
+                    entry_point=renumber[entry] if entry is not None else None,
+                    max_level=self._levels[entry] if entry is not None else -1)
+        sections = {"ann_levels": levels, "ann_node_lists": node_lists,
+                    "ann_link_offsets": link_offsets, "ann_links": links}
+        return meta, sections
+
+    def _repaired(self, node: int, layer: int, neighbors: List[int]) -> List[int]:
+        if not self._deleted.intersection(neighbors):
+            return neighbors
+        candidates = set()
+        for neighbor in neighbors:
+            if neighbor in self._deleted:
+                candidates.update(self.neighbors(neighbor, layer))
+            else:
+                candidates.add(neighbor)
+        candidates = [c for c in candidates if c != node and c not in self._deleted]
+        similarities = (self._vectors[candidates] @ self._vectors[node]).tolist() if candidates else []
+        return self._select(self._vectors[node], zip(similarities, candidates), self._layer_limit(layer))
+
+
+class FrozenHNSW(HNSWGraph):
+    """Read-only graph over snapshot sections
+
+    vectors scores the traversal (the float32 rows, or int8/PQ codes from
+    rag_quantization); exact_vectors holds the float32 rows for re-ranking and thawing.
+    """
+
+    def __init__(self, meta: Dict, sections: Dict[str, Sequence[int]], vectors, exact_vectors):
+        self.meta = meta
+        self.dim = meta["dim"]
+        self.ef_search = meta["ef_search"]
+        self.entry_point = meta["entry_point"]
+        self.max_level = meta["max_level"]
+        self._levels = sections["ann_levels"]
+        self._node_lists = sections["ann_node_lists"]
+        self._link_offsets = sections["ann_link_offsets"]
+        self._links = sections["ann_links"]
+        self.vectors = vectors
+        self.exact_vectors = exact_vectors
+        self.quantized = vectors is not exact_vectors
+        self.rerank_factor = vectors.rerank_factor
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(np.frombuffer(self._levels, dtype=np.uint8) != NO_LEVEL))
+
+    def __contains__(self, node: int) -> bool:
+        return 0 <= node < len(self._levels) and self._levels[node] != NO_LEVEL
+
+    def neighbors(self, node: int, layer: int) -> List[int]:
+        first = self._node_lists[node]
+        if layer >= self._node_lists[node + 1] - first:
+            return []
+        return self._links[self._link_offsets[first + layer]:self._link_offsets[first + layer + 1]].tolist()
+
+    def is_live(self, node: int) -> bool:
+        return self._levels[node] != NO_LEVEL
+
+    def live_nodes(self) -> List[int]:
+        return np.flatnonzero(np.frombuffer(self._levels, dtype=np.uint8) != NO_LEVEL).tolist()
+
+    def vector(self, node: int):
+        return self.exact_vectors.matrix[node]
+
+    def _prepare(self, vector):
+        return self.vectors.prepare(vector)
+
+    def _similarities(self, query, nodes):
+        return self.vectors.similarities(query, nodes)
+
+    def rerank(self, vector, candidates: List[Tuple[float, int]], k: int) -> List[Tuple[float, int]]:
+        if not self.quantized:
+            return candidates[:k]
+        return self.exact_vectors.rerank(vector, candidates, k)
+
+    def thaw(self) -> HNSWIndex:
+        """Mutable copy with the same node ids, for the writer that builds the next generation"""
+        graph = HNSWIndex(self.dim, self.meta["m"], self.meta["ef_construction"], self.ef_search)
+        nodes = self.live_nodes()
+        if nodes:
+            top = max(nodes)
+            graph._vectors = np.zeros((top + 1, self.dim), dtype=np.float32)
+            norms = self.exact_vectors.norms[nodes]
+            # All-zero vectors stay zero, as _normalize leaves them when building
+            norms = np.where(norms == 0, 1.0, norms).astype(np.float32)
+            graph._vectors[nodes] = self.exact_vectors.matrix[nodes] / norms[:, None]
+        for node in nodes:
+            level = self._levels[node]
+            graph._levels[node] = level
+            graph._links[node] = [self.neighbors(node, layer) for layer in range(level + 1)]
+        graph.entry_point, graph.max_level = self.entry_point, self.max_level
+        return graph
+
+
+def embedding_norms(matrix, dim: int) -> array:
+    """Per-row L2 norms of a flat float32 embedding matrix"""
+    rows = np.frombuffer(matrix, dtype=np.float32).reshape(-1, dim)
+    return array('f', np.linalg.norm(rows, axis=1).astype(np.float32).tobytes())
+
+
+if __name__ == "__main__":
+    # Recall/latency self-check on random vectors: python rag_ann.py [count] [dim] [ef_search]
+    logging.basicConfig(level=logging.INFO)
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    ef_search = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_EF_SEARCH
+    vectors = np.random.default_rng(0).standard_normal((count, dim)).astype(np.float32)
+    graph = HNSWIndex(dim, ef_search=ef_search, seed=0)
+    started = time.perf_counter()
+    graph.add_batch(range(count), vectors)
+    logger.info(f"Inserted {count} vectors in {time.perf_counter() - started:.1f}s")
+    for k in (1, 10):
+        logger.info(f"recall@{k}: {graph.recall_at_k(k=k)}")
@@ -0,0 +1,107 @@
+"""
+Optional dependency registry for the MedDoc RAG servers
+Heavy optional libraries (PyPDF2, python-docx, numpy, supabase, openai, requests,
+pytesseract, psycopg2) are probed with importlib.util.find_spec, which reads no module code,
+and imported on first use. A cold start therefore pays only for Flask, and /health can report
+what is installed without loading any of it.
+
+RAG_PRELOAD_IMPORTS=1 warms every installed capability on a background thread
+after startup, for long-running servers that would rather not pay the import on
+the first request that needs it.
+"""
+
+import importlib
+import importlib.util
+import logging
+import threading
+import time
+import types
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Capability name -> (module, what it enables)
+CAPABILITIES: Dict[str, tuple] = {
+    "pdf": ("PyPDF2", "PDF text extraction"),
+    "docx": ("docx", "DOCX text extraction"),
+    "numpy": ("numpy", "ANN index and vector quantization"),
+    "supabase": ("supabase", "Supabase storage"),
+    "openai": ("openai", "LLM answers"),
+    "http": ("requests", "document downloads"),
+    "ocr": ("pytesseract", "OCR of scanned PDF pages"),
+    "postgres": ("psycopg2", "pgvector chunk store"),
+}
+
+_available: Dict[str, bool] = {}
+_modules: Dict[str, types.ModuleType] = {}
+_import_ms: Dict[str, float] = {}
+
+
+def available(name: str) -> bool:
+    """Whether the capability's module is installed; never imports it"""
+    if name not in _available:
+        try:
+            _available[name] = importlib.util.find_spec(CAPABILITIES[name][0]) is not None
+        except (ImportError, ValueError):
+            _available[name] = False
+    return _available[name]
+
+
+def load(name: str) -> Optional[types.ModuleType]:
+    """Import the capability's module on first use; None when it is not installed"""
+    module = _modules.get(name)
+    if module is not None or not available(name):
+        return module
+    # The import system locks per module, so concurrent first uses import once
+    started = time.perf_counter()
+    try:
+        module = importlib.import_module(CAPABILITIES[name][0])
+    except ImportError as e:
+        logger.warning(f"{CAPABILITIES[name][0]} is installed but failed to import: {e}")
+        _available[name] = False
+        return None
+    if _modules.setdefault(name, module) is module and name not in _import_ms:
+        _import_ms[name] = round(1000 * (time.perf_counter() - started), 2)
+        logger.info(f"Loaded {CAPABILITIES[name][0]} for {CAPABILITIES[name][1]} in {_import_ms[name]}ms")
+    return module
+
+
+class LazyModule(types.ModuleType):
+    """Module stand-in that imports the capability on first attribute access"""
+
+    def __init__(self, name: str):
+        super().__init__(CAPABILITIES[name][0])
+        self._capability = name
+
+    def __getattr__(self, attribute: str):
+        module = load(self._capability)
+        if module is None:
+            raise ImportError(f"{CAPABILITIES[self._capability][0]} is not installed "
+                              f"({CAPABILITIES[self._capability][1]} unavailable)")
+        return getattr(module, attribute)
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def report() -> Dict[str, Dict]:
+    """Availability, load state and import cost of every capability, without importing"""
+    return {
+        name: {"available": available(name), "loaded": name in _modules, "import_ms": _import_ms.get(name)}
+        for name in CAPABILITIES
+    }
+
+
+def preload(names: Optional[Iterable[str]] = None, background: bool = True):
+    """Import capabilities ahead of use, by default on a daemon thread"""
+    names = list(names or CAPABILITIES)
+
+    def warm():
+        for name in names:
+            load(name)
+
+    if background:
+        threading.Thread(target=warm, name="rag-preload", daemon=True).start()
+    else:
+        warm()
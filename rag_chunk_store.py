@@ -0,0 +1,312 @@
+"""
+Chunk-level embedding storage with top-k vector search
+One row per (document, chunk index) holds the chunk text, the sha256 of its text,
+the embedding model and the embedding, so semantic search sees every chunk of a
+document rather than one vector for its first 8000 characters. A store runs in
+one of three places, chosen by URL (open_chunk_store):
+
+    memory                      in-process HNSW graph (rag_ann); nothing persists
+    sqlite:///chunks.db         the same graph, loaded from and written through to SQLite
+    postgresql://...            the document_chunks table of a Postgres with pgvector
+                                (supabase/migrations/20251018_add_document_chunks.sql)
+
+All stores replace a document's chunks in one batched, parameterized write and
+answer several query vectors per round trip (search_batch). Searches walk the
+ANN index (HNSW in process, the pgvector HNSW index in Postgres), never every
+document in turn.
+
+pgvector filters by document after the HNSW scan, which yields at most
+hnsw.ef_search candidates, so a search restricted to a few documents can return
+fewer than k chunks. Filtered searches widen the scan to RAG_PG_FILTERED_EF_SEARCH
+candidates; a filter that matches still fewer chunks near the query gets fewer hits.
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+from urllib.parse import urlsplit
+
+from rag_ann import NUMPY_AVAILABLE, HNSWIndex
+from rag_capabilities import load
+from rag_index import EXACT_SEARCH_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT batch when writing chunks
+WRITE_BATCH = 500
+
+CHUNKS_TABLE = "document_chunks"
+
+# hnsw.ef_search for searches restricted to documents (pgvector's default is 40, its maximum 1000)
+FILTERED_EF_SEARCH = min(int(os.environ.get('RAG_PG_FILTERED_EF_SEARCH', 400)), 1000)
+
+
+class ChunkHit(NamedTuple):
+    document_id: str
+    chunk_index: int
+    content: str
+    similarity: float
+
+
+def chunk_hash(text: str) -> str:
+    """sha256 of a chunk's text, stored with its embedding to detect changed chunks"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def vector_literal(vector: Sequence[float]) -> str:
+    """pgvector text form of a vector, passed as a query parameter and cast with ::vector"""
+    return "[" + ",".join(repr(float(value)) for value in vector) + "]"
+
+
+class ChunkStore:
+    """Chunk embeddings of many documents with top-k search
+
+    Subclasses implement write(), delete(), chunk_hashes() and search_batch().
+    """
+
+    def write(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+              model: str) -> int:
+        """Replace a document's chunks and their embeddings; returns the number stored"""
+        raise NotImplementedError
+
+    def delete(self, document_id: str):
+        raise NotImplementedError
+
+    def chunk_hashes(self, document_id: str) -> List[str]:
+        """Text hashes of a document's stored chunks in chunk order; empty when it has none"""
+        raise NotImplementedError
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], k: int = 5,
+                     document_ids: Optional[Sequence[str]] = None) -> List[List[ChunkHit]]:
+        """Top-k chunks for each query vector, optionally within the given documents"""
+        raise NotImplementedError
+
+    def search(self, vector: Sequence[float], k: int = 5,
+               document_ids: Optional[Sequence[str]] = None) -> List[ChunkHit]:
+        return self.search_batch([vector], k, document_ids)[0]
+
+    def close(self):
+        pass
+
+
+class MemoryChunkStore(ChunkStore):
+    """Chunks in process memory, searched through an HNSW graph"""
+
+    def __init__(self, ann_params: Optional[Dict] = None):
+        if not NUMPY_AVAILABLE:
+            raise RuntimeError("numpy is required for the in-process chunk store")
+        self.ann_params = ann_params or {}
+        self.graph: Optional[HNSWIndex] = None
+        self._lock = threading.RLock()
+        self._next_node = 0
+        self._rows: Dict[int, Tuple[str, int, str, str]] = {}
+        self._documents: Dict[str, array] = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _store(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]]) -> List[int]:
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"{len(chunks)} chunks but {len(embeddings)} embeddings")
+        with self._lock:
+            self._drop(document_id)
+            nodes = array('q')
+            for chunk_index, text in enumerate(chunks):
+                node = self._next_node
+                self._next_node += 1
+                self._rows[node] = (document_id, chunk_index, text, chunk_hash(text))
+                nodes.append(node)
+            if nodes:
+                if self.graph is None:
+                    self.graph = HNSWIndex(len(embeddings[0]), **self.ann_params)
+                self.graph.add_batch(nodes, embeddings)
+                self._documents[document_id] = nodes
+            return list(nodes)
+
+    def _drop(self, document_id: str):
+        for node in self._documents.pop(document_id, ()):
+            self.graph.remove(node)
+            del self._rows[node]
+
+    def write(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+              model: str) -> int:
+        return len(self._store(document_id, chunks, embeddings))
+
+    def delete(self, document_id: str):
+        with self._lock:
+            self._drop(document_id)
+
+    def chunk_hashes(self, document_id: str) -> List[str]:
+        with self._lock:
+            return [self._rows[node][3] for node in self._documents.get(document_id, ())]
+
+    def _allowed(self, document_ids: Optional[Sequence[str]]) -> Optional[Set[int]]:
+        if document_ids is None:
+            return None
+        return {node for document_id in document_ids for node in self._documents.get(document_id, ())}
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], k: int = 5,
+                     document_ids: Optional[Sequence[str]] = None) -> List[List[ChunkHit]]:
+        with self._lock:
+            if self.graph is None:
+                return [[] for _ in vectors]
+            allowed = self._allowed(document_ids)
+            results = []
+            for vector in vectors:
+                if allowed is not None and len(allowed) <= EXACT_SEARCH_LIMIT:
+                    hits = self.graph.exact(vector, k, sorted(allowed))
+                else:
+                    hits = self.graph.query(vector, k, allowed=allowed)
+                    if allowed is not None and len(hits) < k:
+                        # Selective filters can starve the graph's candidate list
+                        hits = self.graph.exact(vector, k, sorted(allowed))
+                results.append([ChunkHit(*self._rows[node][:3], similarity) for similarity, node in hits])
+            return results
+
+
+class SQLiteChunkStore(MemoryChunkStore):
+    """In-process store written through to a SQLite file with the document_chunks layout
+
+    A local stand-in for the pgvector table: embeddings are float32 blobs, the
+    graph is rebuilt from the file on open.
+    """
+
+    def __init__(self, path: str, ann_params: Optional[Dict] = None):
+        super().__init__(ann_params)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"""CREATE TABLE IF NOT EXISTS {CHUNKS_TABLE} (
+            document_id TEXT NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            embedding_model TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            PRIMARY KEY (document_id, chunk_index))""")
+        self._load()
+
+    def _load(self):
+        document_id = None
+        chunks: List[str] = []
+        vectors: List[array] = []
+        rows = self._db.execute(f"SELECT document_id, content, embedding FROM {CHUNKS_TABLE} "
+                                f"ORDER BY document_id, chunk_index")
+        for row_document, content, blob in rows:
+            if row_document != document_id:
+                if chunks:
+                    self._store(document_id, chunks, vectors)
+                document_id, chunks, vectors = row_document, [], []
+            chunks.append(content)
+            vectors.append(array('f', blob))
+        if chunks:
+            self._store(document_id, chunks, vectors)
+        logger.info(f"Loaded {len(self)} chunk embeddings from {self.path}")
+
+    def write(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+              model: str) -> int:
+        with self._lock:
+            count = len(self._store(document_id, chunks, embeddings))
+            with self._db:
+                self._db.execute(f"DELETE FROM {CHUNKS_TABLE} WHERE document_id = ?", (document_id,))
+                self._db.executemany(
+                    f"INSERT INTO {CHUNKS_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                    [(document_id, chunk_index, text, chunk_hash(text), model, array('f', vector).tobytes())
+                     for chunk_index, (text, vector) in enumerate(zip(chunks, embeddings))])
+            return count
+
+    def delete(self, document_id: str):
+        with self._lock:
+            self._drop(document_id)
+            with self._db:
+                self._db.execute(f"DELETE FROM {CHUNKS_TABLE} WHERE document_id = ?", (document_id,))
+
+    def close(self):
+        self._db.close()
+
+
+class PgVectorChunkStore(ChunkStore):
+    """The document_chunks table of a Postgres database with the pgvector extension (psycopg2)"""
+
+    def __init__(self, dsn: str):
+        psycopg2 = load("postgres")
+        if psycopg2 is None:
+            raise RuntimeError("psycopg2 is required for the pgvector chunk store")
+        self._extras = importlib.import_module("psycopg2.extras")
+        self._db = psycopg2.connect(dsn)
+        self._lock = threading.Lock()
+
+    def write(self, document_id: str, chunks: Sequence[str], embeddings: Sequence[Sequence[float]],
+              model: str) -> int:
+        if len(chunks) != len(embeddings):
+            raise ValueError(f"{len(chunks)} chunks but {len(embeddings)} embeddings")
+        rows = [(document_id, chunk_index, text, chunk_hash(text), model, vector_literal(vector))
+                for chunk_index, (text, vector) in enumerate(zip(chunks, embeddings))]
+        with self._lock, self._db, self._db.cursor() as cursor:
+            # One transaction: searches see the old chunks or the new ones, never a mix
+            cursor.execute(f"DELETE FROM {CHUNKS_TABLE} WHERE document_id = %s", (document_id,))
+            self._extras.execute_values(
+                cursor,
+                f"INSERT INTO {CHUNKS_TABLE} (document_id, chunk_index, content, content_hash, "
+                f"embedding_model, embedding) VALUES %s",
+                rows, template="(%s, %s, %s, %s, %s, %s::vector)", page_size=WRITE_BATCH)
+        return len(rows)
+
+    def delete(self, document_id: str):
+        with self._lock, self._db, self._db.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {CHUNKS_TABLE} WHERE document_id = %s", (document_id,))
+
+    def chunk_hashes(self, document_id: str) -> List[str]:
+        with self._lock, self._db, self._db.cursor() as cursor:
+            cursor.execute(f"SELECT content_hash FROM {CHUNKS_TABLE} WHERE document_id = %s "
+                           f"ORDER BY chunk_index", (document_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_batch(self, vectors: Sequence[Sequence[float]], k: int = 5,
+                     document_ids: Optional[Sequence[str]] = None) -> List[List[ChunkHit]]:
+        """All query vectors in one statement: a LATERAL top-k per vector over the HNSW index"""
+        if not vectors:
+            return []
+        with self._lock, self._db, self._db.cursor() as cursor:
+            if document_ids is not None:
+                # The filter is applied after the index scan; scan wider so it leaves k rows
+                cursor.execute("SET LOCAL hnsw.ef_search = %s", (max(FILTERED_EF_SEARCH, min(k, 1000)),))
+            cursor.execute(
+                f"""SELECT q.ordinal, c.document_id, c.chunk_index, c.content, 1 - c.distance
+                    FROM unnest(%s::text[]) WITH ORDINALITY AS q(embedding, ordinal)
+                    CROSS JOIN LATERAL (
+                        SELECT document_id, chunk_index, content, embedding <=> q.embedding::vector AS distance
+                        FROM {CHUNKS_TABLE}
+                        WHERE %s::uuid[] IS NULL OR document_id = ANY(%s::uuid[])
+                        ORDER BY embedding <=> q.embedding::vector
+                        LIMIT %s
+                    ) AS c
+                    ORDER BY q.ordinal, c.distance""",
+                ([vector_literal(vector) for vector in vectors],
+                 list(document_ids) if document_ids is not None else None,
+                 list(document_ids) if document_ids is not None else None, k))
+            results: List[List[ChunkHit]] = [[] for _ in vectors]
+            for ordinal, document_id, chunk_index, content, similarity in cursor.fetchall():
+                results[ordinal - 1].append(ChunkHit(str(document_id), chunk_index, content, float(similarity)))
+            return results
+
+    def close(self):
+        self._db.close()
+
+
+def open_chunk_store(url: Optional[str] = None, ann_params: Optional[Dict] = None) -> ChunkStore:
+    """Chunk store for a URL: "memory", "sqlite:///path" or a postgresql:// DSN (default RAG_CHUNK_STORE)"""
+    url = url or os.environ.get('RAG_CHUNK_STORE', 'memory')
+    scheme = urlsplit(url).scheme
+    if url == 'memory':
+        return MemoryChunkStore(ann_params)
+    if scheme == 'sqlite':
+        # As in SQLAlchemy: sqlite:///relative/path, sqlite:////absolute/path
+        return SQLiteChunkStore(url[len('sqlite:///'):], ann_params)
+    if scheme in ('postgres', 'postgresql'):
+        return PgVectorChunkStore(url)
+    raise ValueError(f"Unknown chunk store {url!r}: use memory, sqlite:///path or postgresql://...")
@@ -0,0 +1,103 @@
+"""
+Text chunking shared by the RAG servers and the embedding scripts
+Chunks overlap their neighbours and end after a sentence break in their last 100
+characters when there is one. No server imports, so scripts chunk exactly as
+ingest does without building the Flask app.
+"""
+
+from typing import List, Tuple
+
+
+def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+    """Split text into overlapping chunks for better context retrieval"""
+    if len(text) <= chunk_size:
+        return [text]
+
+    chunks = []
+    start = 0
+
+    while start < len(text):
+        end = start + chunk_size
+
+        # Try to break at sentence boundaries
+        if end < len(text):
+            # Look for sentence endings within the last 100 characters
+            sentence_end = text.rfind('.', start, end)
+            if sentence_end > start + chunk_size - 100:
+                end = sentence_end + 1
+
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        start = end - overlap
+        if start >= len(text):
+            break
+
+    return chunks
+
+
+class IncrementalChunker:
+    """chunk_text() over text that arrives page by page
+
+    A chunk is emitted as soon as text beyond its end has arrived, since later text
+    can no longer move its sentence break; only the unfinished tail is kept. Feeding
+    every page and then calling finish() yields the same chunks as chunk_text() on
+    the stripped, concatenated text.
+    """
+
+    def __init__(self, chunk_size: int = 1000, overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.length = 0
+        self.chunks_count = 0
+        self._tail = ""
+        # Trailing whitespace is held back until more text follows, as strip() would drop it
+        self._held = ""
+
+    def feed(self, text: str) -> Tuple[str, List[str]]:
+        """Add a page; returns the text accepted into the document and the chunks completed by it"""
+        if not self.length:
+            text = text.lstrip()
+        body = text.rstrip()
+        if not body:
+            if self.length:
+                self._held += text
+            return "", []
+        accepted = self._held + body
+        self._held = text[len(body):]
+        self.length += len(accepted)
+        self._tail += accepted
+        return accepted, self._drain(final=False)
+
+    def finish(self) -> List[str]:
+        """Chunks of the remaining tail once the last page is in"""
+        if not self.chunks_count and len(self._tail) <= self.chunk_size:
+            chunks = [self._tail] if self._tail else []
+        else:
+            chunks = self._drain(final=True)
+        self.chunks_count += len(chunks)
+        self._tail = ""
+        return chunks
+
+    def _drain(self, final: bool) -> List[str]:
+        text = self._tail
+        chunks = []
+        start = 0
+        while start < len(text):
+            end = start + self.chunk_size
+            if end < len(text):
+                sentence_end = text.rfind('.', start, end)
+                if sentence_end > start + self.chunk_size - 100:
+                    end = sentence_end + 1
+            elif not final:
+                # The break may still move once the next page arrives
+                break
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            start = end - self.overlap
+        if not final:
+            self._tail = text[start:]
+            self.chunks_count += len(chunks)
+        return chunks
@@ -0,0 +1,77 @@
+"""
+Per-conversation retrieval state
+A follow-up question ("en wat staat er over de PGB?") usually concerns the
+documents the previous answer came from. Each conversation keeps the documents its
+last answers were drawn from (pinned), and the chunks of those documents are the
+candidate set the next question is searched in first; it falls back to a full corpus
+search only when they do not answer it.
+
+States expire RAG_CONVERSATION_TTL seconds after their last use and the least
+recently used ones are evicted beyond RAG_CONVERSATION_CACHE_SIZE conversations.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from rag_metrics import REGISTRY
+
+DEFAULT_TTL_SECONDS = 1800
+DEFAULT_MAX_CONVERSATIONS = 1000
+
+# Documents a conversation keeps searching first
+PINNED_DOCUMENTS = 3
+
+RETRIEVALS = REGISTRY.counter("rag_conversation_retrievals_total",
+                              "Chat retrievals by conversation outcome (new, cached, fallback)", ["outcome"])
+
+
+class ConversationState:
+    """Documents a conversation's last answers drew on"""
+
+    def __init__(self, pinned: List[str]):
+        self.pinned = pinned
+        self.used_at = time.monotonic()
+        self.turns = 1
+
+
+class ConversationCache:
+    """Conversation states by id with TTL expiry and LRU eviction"""
+
+    def __init__(self, max_conversations: int = DEFAULT_MAX_CONVERSATIONS, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_conversations = max_conversations
+        self.ttl = ttl_seconds
+        self._states: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, conversation_id: str) -> Optional[ConversationState]:
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is None:
+                return None
+            if time.monotonic() - state.used_at > self.ttl:
+                del self._states[conversation_id]
+                return None
+            state.used_at = time.monotonic()
+            self._states.move_to_end(conversation_id)
+            return state
+
+    def remember(self, conversation_id: str, pinned: List[str]):
+        """Record the documents of a conversation's latest answer"""
+        with self._lock:
+            previous = self._states.pop(conversation_id, None)
+            state = ConversationState(pinned[:PINNED_DOCUMENTS])
+            if previous is not None:
+                state.turns = previous.turns + 1
+            self._states[conversation_id] = state
+            now = time.monotonic()
+            # Expired states sit at the least recently used end
+            while self._states:
+                oldest = next(iter(self._states.values()))
+                if len(self._states) <= self.max_conversations and now - oldest.used_at <= self.ttl:
+                    break
+                self._states.popitem(last=False)
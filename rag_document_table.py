@@ -0,0 +1,349 @@
+"""
+Columnar document metadata for /documents
+Metadata is held column by column: counts in typed arrays, repeated values
+(client, document type, format, status) as interned integer codes of their text,
+so a client_id sent as a JSON number is listed and filtered as a string, and the rest
+in plain per-column lists, with an overflow dict only for rows that carry extra
+fields. Secondary indexes map client and document type codes to sorted row lists
+and keep (date, row) pairs sorted, so a filtered page touches only the rows it can
+return. Rows are numbered in insertion order; the cursor of a page is the last
+row it returned.
+
+The table follows an index's documents mapping through sync(), which compares
+metadata objects by identity and re-encodes only the documents that changed.
+"""
+
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+INTERNED_FIELDS = ("client_id", "document_type", "category", "file_format", "content_type", "status")
+TEXT_FIELDS = ("id", "title", "file_url", "processed_at", "date")
+COUNT_FIELDS = ("file_size", "text_length", "chunks_count", "pages_indexed")
+# Derived per row rather than stored
+COMPUTED_FIELDS = ("has_content", "chunks_available")
+
+MISSING = -1
+
+# Dead rows kept before the table is rebuilt; rebuilding renumbers rows and expires cursors
+COMPACT_MIN_DEAD = 1024
+
+
+def parse_timestamp(value, end_of_day: bool = False) -> Optional[float]:
+    """Epoch seconds of an ISO date or datetime; a bare date is its start (or end) of day"""
+    if not value or not isinstance(value, str):
+        return None
+    text = value.strip().replace('Z', '+00:00')
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if end_of_day and len(text) == 10:
+        return moment.timestamp() + 86400 - 1e-6
+    return moment.timestamp()
+
+
+class StringPool:
+    """Interns strings as small integer codes"""
+
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def code(self, value) -> int:
+        if value is None:
+            return MISSING
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, value: str) -> Optional[int]:
+        """Code of a value that was interned before, without interning it"""
+        return self._codes.get(value)
+
+
+class DocumentTable:
+    """Document metadata in columns with client, type and date indexes
+
+    With derived=False rows hold only their own fields: no status default and no
+    has_content/chunks_available, for servers whose documents do not track chunks.
+    """
+
+    def __init__(self, derived: bool = True):
+        self.derived = derived
+        self.strings = StringPool()
+        self.epoch = 0
+        self.source_key = None
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._interned = {field: array('i') for field in INTERNED_FIELDS}
+        self._text: Dict[str, List[Optional[str]]] = {field: [] for field in TEXT_FIELDS}
+        self._counts = {field: array('q') for field in COUNT_FIELDS}
+        self._dates = array('d')
+        self._extras: List[Optional[Dict]] = []
+        self._live = array('b')
+        self._sources: List[Optional[Mapping]] = []
+        self._rows: Dict[str, int] = {}
+        self._by_client: Dict[int, array] = {}
+        self._by_type: Dict[int, array] = {}
+        self._by_date: List[Tuple[float, int]] = []
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def sync(self, documents: Mapping[str, Mapping], key=None):
+        """Bring the table in line with a documents mapping; a no-op while key is unchanged"""
+        with self._lock:
+            if key is not None and key == self.source_key:
+                return
+            items = list(documents.items())
+            for doc_id, metadata in items:
+                self.upsert(doc_id, metadata)
+            if len(self._rows) > len(items):
+                present = {doc_id for doc_id, _ in items}
+                for doc_id in [doc_id for doc_id in self._rows if doc_id not in present]:
+                    self.remove(doc_id)
+            dead = len(self._live) - len(self._rows)
+            if dead > max(COMPACT_MIN_DEAD, len(self._rows)):
+                self._compact()
+            self.source_key = key
+
+    def upsert(self, doc_id: str, metadata: Mapping):
+        with self._lock:
+            row = self._rows.get(doc_id)
+            if row is not None:
+                if self._sources[row] is metadata:
+                    return
+                self._unindex(row)
+                self._write(row, doc_id, metadata)
+            else:
+                row = len(self._live)
+                self._append(doc_id, metadata)
+                self._rows[doc_id] = row
+            self._index(row)
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                return False
+            self._unindex(row)
+            self._live[row] = 0
+            self._sources[row] = None
+            self._extras[row] = None
+            return True
+
+    def _append(self, doc_id: str, metadata: Mapping):
+        for column in self._interned.values():
+            column.append(MISSING)
+        for column in self._text.values():
+            column.append(None)
+        for column in self._counts.values():
+            column.append(MISSING)
+        self._dates.append(math.nan)
+        self._extras.append(None)
+        self._live.append(1)
+        self._sources.append(None)
+        self._write(len(self._live) - 1, doc_id, metadata)
+
+    def _write(self, row: int, doc_id: str, metadata: Mapping):
+        for column in self._interned.values():
+            column[row] = MISSING
+        for column in self._text.values():
+            column[row] = None
+        for column in self._counts.values():
+            column[row] = MISSING
+        extras = None
+        for field, value in metadata.items():
+            if field in self._interned and isinstance(value, (str, int)) and not isinstance(value, bool):
+                self._interned[field][row] = self.strings.code(value)
+            elif field in self._text and isinstance(value, str):
+                self._text[field][row] = value
+            elif field in self._counts and isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+                self._counts[field][row] = value
+            else:
+                # Other fields, and values a column cannot hold, keep their own type in the overflow
+                extras = extras or {}
+                extras[field] = value
+        if self._text["id"][row] is None:
+            self._text["id"][row] = doc_id
+        date = parse_timestamp(metadata.get("date")) or parse_timestamp(metadata.get("processed_at"))
+        self._dates[row] = date if date is not None else math.nan
+        self._extras[row] = extras
+        self._sources[row] = metadata
+
+    def _index(self, row: int):
+        for column, index in (("client_id", self._by_client), ("document_type", self._by_type)):
+            code = self._interned[column][row]
+            if code != MISSING:
+                rows = index.setdefault(code, array('i'))
+                if not rows or rows[-1] < row:
+                    rows.append(row)
+                else:
+                    rows.insert(bisect_left(rows, row), row)
+        if not math.isnan(self._dates[row]):
+            insort(self._by_date, (self._dates[row], row))
+
+    def _unindex(self, row: int):
+        for column, index in (("client_id", self._by_client), ("document_type", self._by_type)):
+            code = self._interned[column][row]
+            rows = index.get(code)
+            if rows:
+                position = bisect_left(rows, row)
+                if position < len(rows) and rows[position] == row:
+                    del rows[position]
+                if not rows:
+                    del index[code]
+        if not math.isnan(self._dates[row]):
+            position = bisect_left(self._by_date, (self._dates[row], row))
+            if position < len(self._by_date) and self._by_date[position] == (self._dates[row], row):
+                del self._by_date[position]
+
+    def _compact(self):
+        live = [(doc_id, self._sources[row]) for doc_id, row in sorted(self._rows.items(), key=lambda item: item[1])]
+        self._reset()
+        self.epoch += 1
+        for doc_id, metadata in live:
+            self.upsert(doc_id, metadata)
+
+    def _value(self, row: int, field: str):
+        """(present, value) of one field of a row"""
+        if field in self._interned:
+            code = self._interned[field][row]
+            if code != MISSING:
+                return True, self.strings.values[code]
+            if field == "status" and self.derived:
+                # Documents indexed before ingest reported progress are complete
+                return True, "complete"
+        elif field in self._text:
+            value = self._text[field][row]
+            if value is not None:
+                return True, value
+        elif field in self._counts:
+            value = self._counts[field][row]
+            if value != MISSING:
+                return True, value
+        elif field == "has_content" and self.derived:
+            return True, True
+        elif field == "chunks_available" and self.derived:
+            return True, self._counts["chunks_count"][row] > 0
+        extras = self._extras[row]
+        if extras is not None and field in extras:
+            return True, extras[field]
+        return False, None
+
+    def _row(self, row: int, fields: Optional[Sequence[str]]) -> Dict:
+        if fields is None:
+            fields = INTERNED_FIELDS + TEXT_FIELDS + COUNT_FIELDS + (COMPUTED_FIELDS if self.derived else ()) \
+                + tuple(self._extras[row] or ())
+        document = {}
+        for field in fields:
+            present, value = self._value(row, field)
+            if present:
+                document[field] = value
+        return document
+
+    def query(self, client_id: Optional[str] = None, document_type: Optional[str] = None,
+              date_from: Optional[float] = None, date_to: Optional[float] = None,
+              after: Optional[int] = None, limit: Optional[int] = None,
+              fields: Optional[Sequence[str]] = None) -> Tuple[List[Dict], Optional[int], int]:
+        """One page of matching documents in insertion order, the cursor row of the next page
+        and the number of documents matching the filters on all pages
+
+        The smallest applicable index drives the scan; the other filters are checked
+        on the column values of its rows only.
+        """
+        with self._lock:
+            drivers: List[Iterable[int]] = []
+            client_code = type_code = None
+            if client_id is not None:
+                client_code = self.strings.lookup(str(client_id))
+                if client_code not in self._by_client:
+                    return [], None, 0
+                drivers.append(self._by_client[client_code])
+            if document_type is not None:
+                type_code = self.strings.lookup(str(document_type))
+                if type_code not in self._by_type:
+                    return [], None, 0
+                drivers.append(self._by_type[type_code])
+            dated = date_from is not None or date_to is not None
+            if dated:
+                low = bisect_left(self._by_date, (date_from if date_from is not None else -math.inf, -1))
+                high = bisect_right(self._by_date, (date_to if date_to is not None else math.inf, math.inf))
+                if not drivers or high - low < min(len(rows) for rows in drivers):
+                    drivers = [sorted(row for _, row in self._by_date[low:high])]
+            rows = min(drivers, key=len) if drivers else range(len(self._live))
+
+            start = 0 if after is None else bisect_right(rows, after)
+            page: List[Dict] = []
+            last_row = next_row = None
+            matched = 0
+            for position in range(len(rows)):
+                row = rows[position]
+                if not self._live[row]:
+                    continue
+                if client_code is not None and self._interned["client_id"][row] != client_code:
+                    continue
+                if type_code is not None and self._interned["document_type"][row] != type_code:
+                    continue
+                if dated:
+                    date = self._dates[row]
+                    if math.isnan(date) or (date_from is not None and date < date_from) \
+                            or (date_to is not None and date > date_to):
+                        continue
+                matched += 1
+                # Rows before the cursor and past the page are only counted
+                if position < start or next_row is not None:
+                    continue
+                if limit is not None and len(page) == limit:
+                    next_row = last_row
+                    continue
+                page.append(self._row(row, fields))
+                last_row = row
+            return page, next_row, matched
+
+    def page(self, params: Mapping[str, str], max_limit: int = 1000) -> Tuple[Dict, int]:
+        """A /documents response body and status for request parameters
+
+        client_id, type (document_type), date_from and date_to (ISO dates, matched
+        against the document date or else processed_at), fields (comma-separated),
+        limit and cursor (next_cursor of the previous page). Without limit every
+        match is returned.
+        """
+        limit = None
+        if params.get('limit'):
+            if not params['limit'].isdigit() or not 0 < int(params['limit']) <= max_limit:
+                return {"error": f"limit must be between 1 and {max_limit}"}, 400
+            limit = int(params['limit'])
+        after = None
+        if params.get('cursor'):
+            epoch, _, row = params['cursor'].partition('-')
+            if not epoch.isdigit() or not row.isdigit():
+                return {"error": "Invalid cursor"}, 400
+            if int(epoch) != self.epoch:
+                return {"error": "Cursor expired, start again without a cursor"}, 400
+            after = int(row)
+        bounds = {}
+        for name in ('date_from', 'date_to'):
+            if params.get(name):
+                bounds[name] = parse_timestamp(params[name], end_of_day=name == 'date_to')
+                if bounds[name] is None:
+                    return {"error": f"{name} must be an ISO date"}, 400
+        fields = [field for field in params['fields'].split(',') if field] if params.get('fields') else None
+
+        with self._lock:
+            documents, last_row, matched = self.query(params.get('client_id'), params.get('type'), bounds.get('date_from'),
+                                             bounds.get('date_to'), after, limit, fields)
+            return {
+                "documents": documents,
+                "total_count": matched,
+                "next_cursor": f"{self.epoch}-{last_row}" if last_row is not None else None,
+            }, 200
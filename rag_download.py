@@ -0,0 +1,206 @@
+"""
+Streaming document downloads for the MedDoc RAG servers
+Bodies are streamed to a temporary file instead of being buffered in memory. The
+first bytes decide the real format (PDF, DOCX/ZIP, legacy DOC, plain text)
+whatever the title claims, and a declared or running size above the limit aborts
+the transfer, so rejected and oversized uploads cost one small read.
+
+PDF and DOCX keep their index at the end of the file (xref table, ZIP central
+directory), so their parsers start once the last byte is on disk; plain text is
+decoded incrementally while it arrives. Text is read as UTF-8, and bytes that are
+not valid UTF-8 are read as Windows-1252, the encoding of text exported on Dutch
+Windows machines ("cliënt", "één").
+"""
+
+import codecs
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Callable, Iterable, Mapping, Optional, Tuple
+
+import rag_capabilities
+
+logger = logging.getLogger(__name__)
+
+requests = rag_capabilities.lazy_module("http")
+
+# Bytes inspected before the format is decided
+SNIFF_BYTES = 4096
+
+# Read size of the streamed body
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get('RAG_MAX_DOWNLOAD_MB', 50)) * 1024 * 1024)
+
+# Share of control (and undecodable) characters above which a body is not treated as text
+TEXT_CONTROL_RATIO = 0.01
+
+# Decode error handler for text: invalid UTF-8 bytes are decoded as Windows-1252 instead
+TEXT_ERRORS = "utf8-cp1252-fallback"
+
+
+def _cp1252_fallback(error: UnicodeError):
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    return error.object[error.start:error.end].decode('cp1252', errors='replace'), error.end
+
+
+codecs.register_error(TEXT_ERRORS, _cp1252_fallback)
+
+
+def text_decoder():
+    """Incremental UTF-8 decoder that falls back to Windows-1252 per invalid byte"""
+    return codecs.getincrementaldecoder('utf-8')(errors=TEXT_ERRORS)
+
+
+class DownloadRejected(Exception):
+    """A download refused for its size or content; status is the HTTP code to answer with"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    """Real file format from the first bytes: 'pdf', 'docx', 'doc', 'txt' or None"""
+    if head.startswith(b"%PDF-") or b"%PDF-" in head[:1024]:
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        # An Office Open XML package; python-docx rejects ZIPs that are not documents
+        return "docx"
+    if head.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return "doc"
+    if not head or b"\x00" in head:
+        return None
+    # A multi-byte character cut off at the end of head is left pending, not counted
+    text = text_decoder().decode(head)
+    controls = sum(1 for char in text if char < ' ' and char not in '\t\n\r\f')
+    if text.count('\ufffd') + controls > TEXT_CONTROL_RATIO * len(text):
+        return None
+    return "txt"
+
+
+class StreamedDownload:
+    """A downloaded body on disk, with its sniffed format, sha256 and, for text, the decoded string"""
+
+    def __init__(self, path: str, file_format: str, size: int, content_type: str, text: Optional[str] = None,
+                 sha256: Optional[str] = None, etag: Optional[str] = None):
+        self.path = path
+        self.file_format = file_format
+        self.size = size
+        self.content_type = content_type
+        self.text = text
+        self.sha256 = sha256
+        self.etag = etag
+
+    def cleanup(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class DownloadSink:
+    """Consumes a body chunk by chunk: sniffs the format, enforces the size limit, spools to disk"""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, declared_length: Optional[int] = None,
+                 content_type: str = 'unknown', etag: Optional[str] = None):
+        if declared_length is not None and declared_length > max_bytes:
+            raise DownloadRejected(
+                f"Document is {declared_length} bytes, larger than the {max_bytes} byte limit", 413)
+        self.max_bytes = max_bytes
+        self.content_type = content_type
+        self.etag = etag
+        self.size = 0
+        self.file_format: Optional[str] = None
+        self._head = b""
+        self._file = None
+        self._decoder = None
+        self._text_parts = []
+        self._digest = hashlib.sha256()
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.discard()
+            raise DownloadRejected(f"Document exceeds the {self.max_bytes} byte limit", 413)
+        self._digest.update(chunk)
+        if self._file is None:
+            self._head += chunk
+            if len(self._head) >= SNIFF_BYTES:
+                self._open(self._head)
+                self._head = b""
+        else:
+            self._write(chunk)
+
+    def finish(self) -> StreamedDownload:
+        if self._file is None:
+            self._open(self._head)
+        self._file.close()
+        text = None
+        if self._decoder is not None:
+            self._text_parts.append(self._decoder.decode(b"", final=True))
+            text = "".join(self._text_parts).strip()
+        return StreamedDownload(self._file.name, self.file_format, self.size, self.content_type, text,
+                                self._digest.hexdigest(), self.etag)
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+            self._file = None
+
+    def _open(self, head: bytes):
+        self.file_format = sniff_format(head[:SNIFF_BYTES])
+        if self.file_format is None:
+            raise DownloadRejected("Unsupported or unrecognised file content. Supported: PDF, DOCX, TXT", 415)
+        if self.file_format == "txt":
+            self._decoder = text_decoder()
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{self.file_format}')
+        self._write(head)
+
+    def _write(self, chunk: bytes):
+        self._file.write(chunk)
+        if self._decoder is not None:
+            self._text_parts.append(self._decoder.decode(chunk))
+
+
+def spool_bytes(content: bytes, content_type: str = 'unknown', max_bytes: int = DEFAULT_MAX_BYTES) -> StreamedDownload:
+    """Run an in-memory body through the same sniffing and limits as a streamed download"""
+    return consume([content], DownloadSink(max_bytes, len(content), content_type))
+
+
+def consume(chunks: Iterable[bytes], sink: DownloadSink) -> StreamedDownload:
+    try:
+        for chunk in chunks:
+            sink.feed(chunk)
+        return sink.finish()
+    except BaseException:
+        sink.discard()
+        raise
+
+
+# Called with the ETag and size of a response before its body is read; True skips the body
+KnownVersion = Callable[[Optional[str], Optional[int]], bool]
+
+
+def response_version(headers: Mapping[str, str]) -> Tuple[Optional[str], Optional[int]]:
+    """ETag and size of an object from its response headers; None where the server does not say"""
+    length = headers.get('content-length')
+    return headers.get('etag'), int(length) if length and length.isdigit() else None
+
+
+def stream_download(file_url: str, max_bytes: int = DEFAULT_MAX_BYTES, timeout: int = 30,
+                    known: Optional[KnownVersion] = None) -> Optional[StreamedDownload]:
+    """Download to a temporary file, rejecting oversized or unrecognised bodies early
+
+    When known(etag, size) recognises the object version from the response headers
+    the body is left unread and None is returned, so a cached version costs no
+    extra request and no transfer.
+    """
+    with requests.get(file_url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        etag, length = response_version(response.headers)
+        if known is not None and known(etag, length):
+            return None
+        sink = DownloadSink(max_bytes, length, response.headers.get('content-type', 'unknown'), etag)
+        return consume(response.iter_content(DOWNLOAD_CHUNK_BYTES), sink)
@@ -0,0 +1,166 @@
+"""
+Persistent cache of chunk embeddings
+Amended letters are re-uploaded with most of their chunks unchanged. Every
+embedding pass (scripts/generate_embeddings.py, scripts/build_index_bundle.py
+--embed) looks chunks up by (model, sha256 of the normalized chunk text) first and
+sends only the misses to the embedding API.
+
+Entries live in one SQLite file (WAL mode, so scripts and servers can share it)
+as float32 blobs. Once the stored vectors exceed the size limit the least
+recently used entries are evicted down to EVICT_TO of it.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from array import array
+from typing import Callable, Dict, List, Optional, Sequence
+
+from rag_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 512
+
+# Share of the size limit kept after an eviction, so evictions come in batches
+EVICT_TO = 0.9
+
+LOOKUPS = REGISTRY.counter("rag_embedding_cache_lookups_total", "Chunk embedding cache lookups by result (hit, miss)",
+                           ["result"])
+EVICTIONS = REGISTRY.counter("rag_embedding_cache_evictions_total", "Chunk embeddings evicted from the cache")
+
+
+def normalize_chunk(text: str) -> str:
+    """Chunk text as keyed: NFC, whitespace runs collapsed, ends stripped"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_chunk(text)}".encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Embeddings by (model, normalized chunk text) in a size-bounded SQLite file"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._bytes = self._stored_bytes()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_environment(cls) -> Optional["EmbeddingCache"]:
+        """Cache at RAG_EMBEDDING_CACHE_PATH (a shared temp file by default) holding up to
+        RAG_EMBEDDING_CACHE_MB of vectors; RAG_EMBEDDING_CACHE=0 disables it"""
+        if os.environ.get('RAG_EMBEDDING_CACHE', '1').lower() in ('0', 'false', 'no', 'off'):
+            return None
+        path = os.environ.get('RAG_EMBEDDING_CACHE_PATH') or \
+            os.path.join(tempfile.gettempdir(), "meddoc-embedding-cache.sqlite3")
+        try:
+            return cls(path, int(float(os.environ.get('RAG_EMBEDDING_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Embedding cache disabled, {path} is not usable: {e}")
+            return None
+
+    def _stored_bytes(self) -> int:
+        return self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached embedding of each text, None where there is none"""
+        keys = [cache_key(model, text) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch)
+                found.update((key, array('f', blob).tolist()) for key, blob in rows)
+            if found:
+                now = time.time()
+                with self._db:
+                    self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key in found])
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        LOOKUPS.inc(hits, result="hit")
+        LOOKUPS.inc(len(keys) - hits, result="miss")
+        return [found.get(key) for key in keys]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        rows = {cache_key(model, text): array('f', vector).tobytes() for text, vector in zip(texts, vectors)}
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) "
+                                     "VALUES (?, ?, ?, ?)", [(key, model, blob, now) for key, blob in rows.items()])
+            self._bytes += sum(len(blob) for blob in rows.values())
+            if self._bytes > self.max_bytes:
+                # Other processes write to the same file; count before evicting
+                self._bytes = self._stored_bytes()
+                if self._bytes > self.max_bytes:
+                    self._evict()
+
+    def _evict(self):
+        excess = self._bytes - int(self.max_bytes * EVICT_TO)
+        keys = []
+        freed = 0
+        for key, size in self._db.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        with self._db:
+            self._db.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        self._bytes -= freed
+        EVICTIONS.inc(len(keys))
+        logger.info(f"Evicted {len(keys)} embeddings ({freed} bytes) from {self.path}")
+
+    def embed(self, model: str, texts: Sequence[str],
+              compute: Callable[[List[str]], Optional[List[List[float]]]]) -> Optional[List[List[float]]]:
+        """Embeddings of texts, calling compute only for texts the cache does not hold
+
+        compute receives each missing normalized text once and returns their
+        embeddings in order (or None on failure, which is passed on).
+        """
+        vectors = self.get_many(model, texts)
+        missing = list(dict.fromkeys(normalize_chunk(text) for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = compute(missing)
+            if computed is None:
+                return None
+            self.put_many(model, missing, computed)
+            by_text = dict(zip(missing, computed))
+            vectors = [vector if vector is not None else list(by_text[normalize_chunk(text)])
+                       for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {"entries": entries, "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else None}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,378 @@
+"""
+Shared on-disk cache of document extraction results
+The RAG servers, the bundle builder and scripts/pdf_parse_to_supabase.py parse the
+same Supabase storage objects. Each result is stored once per file content (the
+sha256 of its bytes) as zlib-compressed JSON holding the extracted text, the offset
+at which every page starts and the (start, end) span of every chunk. A small
+pointer file per storage object version (storage path + ETag + size) names the
+content hash, so the headers of the download response are enough to find a result
+before its body is read.
+
+Files are written with atomic renames and parsing holds a per-content lock file,
+so processes that meet the same object at once wait for one parse instead of
+repeating it. The first parser to see an object wins; entries record which one.
+
+Entries hold medical document text, so the directory must belong to the current
+user and be closed to everyone else (0700); the default is a per-user directory
+created that way. Entries unused for RAG_EXTRACTION_CACHE_DAYS are removed, and the
+least recently used ones beyond RAG_EXTRACTION_CACHE_MB, by a prune that runs at
+open and every PRUNE_INTERVAL_SECONDS after a write.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlsplit
+
+from rag_metrics import REGISTRY
+
+try:
+    import fcntl
+    LOCKING_AVAILABLE = True
+except ImportError:
+    LOCKING_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+DEFAULT_MAX_MB = 1024
+DEFAULT_MAX_AGE_DAYS = 30
+
+# Share of the size limit kept after a prune, so prunes come in batches
+EVICT_TO = 0.9
+
+# Minimum time between prunes triggered by writes
+PRUNE_INTERVAL_SECONDS = 600
+
+# Lock files older than this are no longer held by a running parse
+LOCK_MAX_AGE_SECONDS = 3600
+
+# Entry directories, pruned by size and age
+ENTRY_DIRS = ("objects", "versions", "pages")
+
+STORAGE_PREFIX = "/storage/v1/object/"
+STORAGE_ACCESS = ("public/", "sign/", "authenticated/")
+
+LOOKUPS = REGISTRY.counter("rag_extraction_cache_lookups_total",
+                           "Extraction cache lookups by key (version, content) and result", ["key", "result"])
+EVICTIONS = REGISTRY.counter("rag_extraction_cache_evictions_total", "Extraction cache files removed by pruning")
+
+
+def private_directory(directory: str):
+    """Create directory as 0700 and refuse one that another user owns or could write to"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return
+    stat = os.stat(directory)
+    if stat.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is owned by uid {stat.st_uid}, not by this user")
+    if stat.st_mode & 0o077:
+        raise PermissionError(f"{directory} is accessible to other users (mode {stat.st_mode & 0o777:o})")
+
+
+def default_cache_dir() -> str:
+    """A per-user directory under the temp dir, so users never share (or plant) entries"""
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"meddoc-extraction-cache-{user}")
+
+
+def storage_path(file_url: str) -> str:
+    """Stable identity of a storage object: bucket/path for Supabase URLs, else the URL without its query
+
+    Signed URLs differ per request, so tokens and other query parameters never
+    take part in the key.
+    """
+    parsed = urlsplit(file_url)
+    path = unquote(parsed.path)
+    marker = path.find(STORAGE_PREFIX)
+    if marker >= 0:
+        path = path[marker + len(STORAGE_PREFIX):]
+    elif parsed.scheme:
+        return f"{parsed.netloc}{path}"
+    for access in STORAGE_ACCESS:
+        if path.startswith(access):
+            return path[len(access):]
+    return path
+
+
+def chunk_spans(text: str, chunks: Sequence[str]) -> List[Tuple[int, int]]:
+    """(start, end) of each chunk in the text; chunks are ordered, possibly overlapping substrings"""
+    spans = []
+    position = 0
+    for chunk in chunks:
+        start = text.find(chunk, position)
+        if start < 0:
+            raise ValueError("chunk is not a substring of the text")
+        spans.append((start, start + len(chunk)))
+        position = start
+    return spans
+
+
+class Extraction:
+    """Extracted text of one file with its page offsets, chunk spans and file details"""
+
+    def __init__(self, text: str, page_offsets: List[int], chunk_spans: Optional[List[Tuple[int, int]]] = None,
+                 parser: str = "", file_format: str = "", file_size: Optional[int] = None,
+                 content_type: str = 'unknown'):
+        self.text = text
+        self.page_offsets = page_offsets
+        self.chunk_spans = chunk_spans
+        self.parser = parser
+        self.file_format = file_format
+        self.file_size = file_size
+        self.content_type = content_type
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[str], **details) -> "Extraction":
+        """Join page texts and strip the ends, as the extractors do, recording where each page starts"""
+        offsets = []
+        length = 0
+        parts = []
+        for page in pages:
+            offsets.append(length)
+            parts.append(page)
+            length += len(page)
+        joined = "".join(parts)
+        text = joined.strip()
+        lead = len(joined) - len(joined.lstrip())
+        return cls(text, [min(max(offset - lead, 0), len(text)) for offset in offsets], **details)
+
+    def pages(self) -> List[str]:
+        bounds = list(self.page_offsets) + [len(self.text)]
+        return [self.text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+    def chunks(self) -> Optional[List[str]]:
+        if self.chunk_spans is None:
+            return None
+        return [self.text[start:end] for start, end in self.chunk_spans]
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(json.dumps({
+            "format": FORMAT_VERSION,
+            "text": self.text,
+            "page_offsets": self.page_offsets,
+            "chunk_spans": self.chunk_spans,
+            "parser": self.parser,
+            "file_format": self.file_format,
+            "file_size": self.file_size,
+            "content_type": self.content_type,
+        }).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional["Extraction"]:
+        entry = json.loads(zlib.decompress(data))
+        if entry.get("format") != FORMAT_VERSION:
+            return None
+        spans = entry.get("chunk_spans")
+        return cls(entry["text"], entry["page_offsets"],
+                   [tuple(span) for span in spans] if spans is not None else None,
+                   entry.get("parser", ""), entry.get("file_format", ""), entry.get("file_size"),
+                   entry.get("content_type", 'unknown'))
+
+
+class ExtractionCache:
+    """Content-addressed extraction results plus storage-version pointers in one directory"""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        private_directory(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        for name in ("objects", "versions", "locks", "pages"):
+            os.makedirs(os.path.join(directory, name), mode=0o700, exist_ok=True)
+        self._prune_lock = threading.Lock()
+        self._pruned_at = 0.0
+        self._stats = {"entries": 0, "bytes": 0}
+        self.prune()
+
+    @classmethod
+    def from_environment(cls) -> Optional["ExtractionCache"]:
+        """Cache under RAG_EXTRACTION_CACHE_DIR (a private per-user temp directory by default), bounded by
+        RAG_EXTRACTION_CACHE_MB and RAG_EXTRACTION_CACHE_DAYS; RAG_EXTRACTION_CACHE=0 disables it"""
+        if os.environ.get('RAG_EXTRACTION_CACHE', '1').lower() in ('0', 'false', 'no', 'off'):
+            return None
+        directory = os.environ.get('RAG_EXTRACTION_CACHE_DIR') or default_cache_dir()
+        try:
+            return cls(directory, int(float(os.environ.get('RAG_EXTRACTION_CACHE_MB', DEFAULT_MAX_MB)) * 1024 * 1024),
+                       float(os.environ.get('RAG_EXTRACTION_CACHE_DAYS', DEFAULT_MAX_AGE_DAYS)))
+        except OSError as e:
+            logger.warning(f"Extraction cache disabled, {directory} is not usable: {e}")
+            return None
+
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, "objects", content_hash[:2], f"{content_hash}.json.z")
+
+    def _version_path(self, storage: str, etag: Optional[str], size: Optional[int]) -> Optional[str]:
+        # Without an ETag a replaced object of the same size would look unchanged
+        if not etag:
+            return None
+        key = hashlib.sha256(f"{storage}\n{etag.strip()}\n{size if size is not None else ''}".encode()).hexdigest()
+        return os.path.join(self.directory, "versions", key)
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        if time.time() - self._pruned_at > PRUNE_INTERVAL_SECONDS:
+            self.prune()
+
+    @staticmethod
+    def _touch(path: str):
+        """Mark an entry as used, so pruning removes the least recently used first"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def get(self, content_hash: str) -> Optional[Extraction]:
+        """The extraction of a file with this sha256, if any process stored one"""
+        path = self._object_path(content_hash)
+        try:
+            with open(path, 'rb') as handle:
+                extraction = Extraction.from_bytes(handle.read())
+            self._touch(path)
+        except FileNotFoundError:
+            extraction = None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Unreadable extraction cache entry {content_hash}: {e}")
+            extraction = None
+        LOOKUPS.inc(key="content", result="hit" if extraction is not None else "miss")
+        return extraction
+
+    def put(self, content_hash: str, extraction: Extraction):
+        self._write(self._object_path(content_hash), extraction.to_bytes())
+
+    def lookup(self, storage: str, etag: Optional[str], size: Optional[int]) -> Optional[Tuple[str, Extraction]]:
+        """(content hash, extraction) of a storage object version, found without downloading it"""
+        path = self._version_path(storage, etag, size)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r') as handle:
+                content_hash = handle.read().strip()
+            self._touch(path)
+        except FileNotFoundError:
+            LOOKUPS.inc(key="version", result="miss")
+            return None
+        LOOKUPS.inc(key="version", result="hit")
+        extraction = self.get(content_hash)
+        return (content_hash, extraction) if extraction is not None else None
+
+    def version_lookup(self, file_url: str) -> "VersionLookup":
+        return VersionLookup(self, file_url)
+
+    def link(self, storage: str, etag: Optional[str], size: Optional[int], content_hash: str):
+        """Point a storage object version at the extraction of its content"""
+        path = self._version_path(storage, etag, size)
+        if path is not None:
+            self._write(path, content_hash.encode())
+
+    def get_page(self, key: str) -> Optional[str]:
+        """Cached text of one page (e.g. an OCR result), by a key the caller derives from the page"""
+        path = os.path.join(self.directory, "pages", key[:2], key)
+        try:
+            with open(path, 'rb') as handle:
+                text = zlib.decompress(handle.read()).decode('utf-8')
+            self._touch(path)
+            return text
+        except FileNotFoundError:
+            return None
+        except (OSError, zlib.error, UnicodeDecodeError) as e:
+            logger.warning(f"Unreadable page cache entry {key}: {e}")
+            return None
+
+    def put_page(self, key: str, text: str):
+        self._write(os.path.join(self.directory, "pages", key[:2], key), zlib.compress(text.encode('utf-8')))
+
+    @contextmanager
+    def parsing(self, content_hash: str):
+        """Hold the parse of one file exclusively across processes; re-check get() once inside"""
+        with open(os.path.join(self.directory, "locks", f"{content_hash}.lock"), 'a') as lock_file:
+            if LOCKING_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if LOCKING_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def prune(self) -> Dict[str, int]:
+        """Remove entries past the age limit, then the least recently used ones beyond the size limit"""
+        if not self._prune_lock.acquire(blocking=False):
+            return self.stats()
+        try:
+            self._pruned_at = now = time.time()
+            files: List[Tuple[float, int, str]] = []
+            removed = 0
+            for name in ENTRY_DIRS + ("locks",):
+                for root, _, names in os.walk(os.path.join(self.directory, name)):
+                    for file_name in names:
+                        path = os.path.join(root, file_name)
+                        try:
+                            stat = os.stat(path)
+                        except FileNotFoundError:
+                            continue
+                        limit = LOCK_MAX_AGE_SECONDS if name == "locks" else self.max_age
+                        if now - stat.st_mtime > limit:
+                            removed += self._remove(path)
+                        elif name != "locks":
+                            files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            if total > self.max_bytes:
+                files.sort()
+                while files and total > self.max_bytes * EVICT_TO:
+                    _, size, path = files.pop(0)
+                    removed += self._remove(path)
+                    total -= size
+            if removed:
+                logger.info(f"Pruned {removed} extraction cache files from {self.directory}")
+            self._stats = {"entries": sum(1 for _, _, path in files if path.endswith('.json.z')), "bytes": total}
+            return self.stats()
+        finally:
+            self._prune_lock.release()
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return 0
+        EVICTIONS.inc()
+        return 1
+
+    def stats(self) -> Dict:
+        """Entries and bytes as of the last prune, with the limits"""
+        return dict(self._stats, max_bytes=self.max_bytes, max_age_days=self.max_age / 86400,
+                    pruned_at=round(self._pruned_at))
+
+
+class VersionLookup:
+    """Recognises a cached object version from a download's headers (known= of stream_download)
+
+    After a hit, found holds the (content hash, extraction) of that version.
+    """
+
+    def __init__(self, cache: ExtractionCache, file_url: str):
+        self.cache = cache
+        self.storage = storage_path(file_url)
+        self.found: Optional[Tuple[str, Extraction]] = None
+
+    def __call__(self, etag: Optional[str], size: Optional[int]) -> bool:
+        self.found = self.cache.lookup(self.storage, etag, size)
+        return self.found is not None
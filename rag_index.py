@@ -0,0 +1,605 @@
+"""
+Corpus index for the MedDoc RAG servers
+Holds document metadata, extracted text, chunks and a lexical postings index,
+so a question is answered from postings instead of rescanning every chunk.
+"""
+
+import heapq
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from concurrent.futures import Executor
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from rag_analysis import DEFAULT_ANALYZER, Analyzer, get_analyzer
+from rag_ann import NUMPY_AVAILABLE, HNSWGraph, HNSWIndex
+from rag_metrics import span
+
+
+# Per-chunk answer span kinds precomputed at ingest (see IntelligentAnswerer.analyze_chunk)
+FEATURE_KINDS = ("definitions", "procedures", "explanations", "summary")
+
+
+# Number of tokens shown around the matches of a hit
+PASSAGE_WINDOW_TOKENS = 32
+
+# Quoted phrases in a question, with straight or typographic quotes
+PHRASE_PATTERN = re.compile(r'["\u201c\u201d\u201e]([^"\u201c\u201d\u201e]+)["\u201c\u201d\u201e]')
+
+# Score added per quoted phrase found in a chunk, above the term overlap of a typical question
+PHRASE_BOOST = 10.0
+
+# Largest bonus for matched terms standing together; below 1 so it never outweighs a matched term
+PROXIMITY_WEIGHT = 0.5
+
+# Overlap candidates per requested result that get the proximity pass
+PROXIMITY_CANDIDATES = 4
+
+# Filtered semantic searches over at most this many chunks skip the graph and scan exactly
+EXACT_SEARCH_LIMIT = 4096
+
+Postings = List[Tuple[int, Sequence[int]]]
+
+
+def densest_window(positions: List[int], window: int) -> Tuple[int, int]:
+    """Return the first and last sorted position of the window holding the most matches"""
+    best = (0, 0)
+    left = 0
+    for right in range(len(positions)):
+        while positions[right] - positions[left] >= window:
+            left += 1
+        if right - left > best[1] - best[0]:
+            best = (left, right)
+    return positions[best[0]], positions[best[1]]
+
+
+def shifted_intersection(starts: List[int], positions: Sequence[int], offset: int) -> List[int]:
+    """Keep the sorted starts s for which s + offset is in the sorted positions (linear merge)"""
+    kept = []
+    i = j = 0
+    while i < len(starts) and j < len(positions):
+        target = starts[i] + offset
+        if positions[j] < target:
+            j += 1
+        elif positions[j] > target:
+            i += 1
+        else:
+            kept.append(starts[i])
+            i += 1
+            j += 1
+    return kept
+
+
+def min_cover_span(position_lists: List[Sequence[int]]) -> int:
+    """Token length of the shortest window holding a position from every sorted list"""
+    heap = [(positions[0], index, 0) for index, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    high = max(position for position, _, _ in heap)
+    best = high - heap[0][0] + 1
+    while True:
+        low, index, cursor = heapq.heappop(heap)
+        best = min(best, high - low + 1)
+        if cursor + 1 == len(position_lists[index]):
+            return best
+        following = position_lists[index][cursor + 1]
+        high = max(high, following)
+        heapq.heappush(heap, (following, index, cursor + 1))
+
+
+def _chunk_positions(postings: Postings, chunk_id: int) -> Optional[Sequence[int]]:
+    """Positions of a chunk in one term's postings, or None when the term is absent"""
+    found = bisect_left(postings, (chunk_id,))
+    if found < len(postings) and postings[found][0] == chunk_id:
+        return postings[found][1]
+    return None
+
+
+class IndexReader:
+    """Query operations shared by the in-process index and shared snapshots
+
+    Subclasses provide the storage accessors (documents, get_content,
+    get_chunk_ids, get_chunk_text, chunk_doc_id, chunk_id_limit, postings,
+    get_chunk_features, get_token_offsets, get_embedding). postings() must return
+    (chunk_id, positions) pairs sorted by chunk id, positions being token numbers.
+    """
+
+    generation = 0
+    analyzer: Analyzer = get_analyzer(DEFAULT_ANALYZER)
+    ann: Optional[HNSWGraph] = None
+
+    def get_chunks(self, doc_id: str) -> List[str]:
+        """Return the chunk texts of a document in order"""
+        return [self.get_chunk_text(cid) for cid in self.get_chunk_ids(doc_id)]
+
+    def _allowed_chunks(self, doc_ids: Optional[Iterable[str]]) -> Optional[set]:
+        """Chunk ids a search is restricted to, or None for the whole corpus"""
+        if doc_ids is None:
+            return None
+        allowed = set()
+        for doc_id in doc_ids:
+            allowed.update(self.get_chunk_ids(doc_id))
+        return allowed
+
+    def search(self, query: str, max_chunks: int = 3,
+               doc_ids: Optional[Iterable[str]] = None, shards: int = 1,
+               executor: Optional[Executor] = None) -> List[Tuple[float, int]]:
+        """Score chunks by query word overlap and return the global top (score, chunk_id) pairs
+
+        All candidates are scored in one pass over the query terms' postings and kept
+        in a bounded heap, so cost follows the matching postings rather than the number
+        of documents. Quoted phrases add PHRASE_BOOST per chunk containing them, and the
+        best candidates get a proximity bonus for matched terms standing close together.
+        With an executor and shards > 1 the chunk id space is split into ranges that are
+        scored in parallel and merged.
+        """
+        allowed = self._allowed_chunks(doc_ids)
+        term_postings, phrases = self._plan(query)
+        return self._rank(term_postings, phrases, allowed, max_chunks, shards, executor)
+
+    def _plan(self, query: str,
+              fetched: Optional[Dict[str, Postings]] = None) -> Tuple[List[Postings], List[List[Tuple[int, Postings]]]]:
+        """Postings per distinct query term, plus (relative position, postings) lists per quoted phrase
+
+        Phrase offsets come from the token positions of the phrase itself, so a stopword
+        inside the quotes still counts as a gap of one token. Queries planned with the
+        same fetched dict share the postings of their common terms.
+        """
+        fetched = fetched if fetched is not None else {}
+
+        def postings(term: str) -> Postings:
+            if term not in fetched:
+                fetched[term] = self.postings(term)
+            return fetched[term]
+
+        term_postings = [postings(term) for term in self.analyzer.query_terms(query)]
+        phrases = []
+        for match in PHRASE_PATTERN.finditer(query):
+            token_terms, _ = self.analyzer.analyze(match.group(1))
+            # The first term of a token is the whole word; decompounded parts are extras
+            kept = [(position, terms[0]) for position, terms in enumerate(token_terms) if terms]
+            if len(kept) < 2:
+                continue
+            base = kept[0][0]
+            phrases.append([(position - base, postings(term)) for position, term in kept])
+        return term_postings, phrases
+
+    def _rank(self, term_postings: List[Postings], phrases: List[List[Tuple[int, Postings]]],
+              allowed: Optional[set], max_chunks: int, shards: int,
+              executor: Optional[Executor]) -> List[Tuple[float, int]]:
+        limit = self.chunk_id_limit()
+        if shards <= 1 or executor is None or limit < shards:
+            return self._score_range(term_postings, phrases, allowed, max_chunks, 0, limit)
+
+        step = -(-limit // shards)
+        futures = [
+            executor.submit(self._score_range, term_postings, phrases, allowed, max_chunks,
+                            low, min(low + step, limit))
+            for low in range(0, limit, step)
+        ]
+        return heapq.nlargest(max_chunks, chain.from_iterable(future.result() for future in futures))
+
+    @staticmethod
+    def _score_range(term_postings: List[Postings], phrases: List[List[Tuple[int, Postings]]],
+                     allowed: Optional[set], max_chunks: int, low: int, high: int) -> List[Tuple[float, int]]:
+        """Score the chunk ids in [low, high) and keep the best max_chunks"""
+        scores: Dict[int, float] = {}
+        for postings in term_postings:
+            # Postings are sorted by chunk id, so each shard bisects straight to its range
+            start = bisect_left(postings, (low,))
+            end = bisect_left(postings, (high,), start)
+            for chunk_id, _positions in postings[start:end]:
+                if allowed is None or chunk_id in allowed:
+                    scores[chunk_id] = scores.get(chunk_id, 0) + 1
+
+        for phrase in phrases:
+            for chunk_id in IndexReader._phrase_chunks(phrase, low, high):
+                if allowed is None or chunk_id in allowed:
+                    scores[chunk_id] = scores.get(chunk_id, 0) + PHRASE_BOOST
+
+        candidates = heapq.nlargest(max_chunks * PROXIMITY_CANDIDATES,
+                                    ((score, cid) for cid, score in scores.items()))
+        if len(term_postings) > 1:
+            candidates = [
+                (score + IndexReader._proximity_bonus(term_postings, cid), cid)
+                for score, cid in candidates
+            ]
+        return heapq.nlargest(max_chunks, candidates)
+
+    @staticmethod
+    def _phrase_chunks(phrase: List[Tuple[int, Postings]], low: int, high: int) -> Dict[int, List[int]]:
+        """Chunks in [low, high) containing the phrase, mapped to the phrase start positions
+
+        Walks the rarest term's postings and merges the sorted position lists of the
+        other terms, shifted by their offset in the phrase.
+        """
+        ranges = []
+        for offset, postings in phrase:
+            start = bisect_left(postings, (low,))
+            end = bisect_left(postings, (high,), start)
+            ranges.append((offset, postings[start:end]))
+        driver = min((postings for _, postings in ranges), key=len)
+
+        matches = {}
+        for chunk_id, _positions in driver:
+            position_lists = []
+            for offset, postings in ranges:
+                positions = _chunk_positions(postings, chunk_id)
+                if positions is None:
+                    break
+                position_lists.append((offset, positions))
+            else:
+                first_offset, first_positions = position_lists[0]
+                starts = [position - first_offset for position in first_positions]
+                for offset, positions in position_lists[1:]:
+                    starts = shifted_intersection(starts, positions, offset)
+                    if not starts:
+                        break
+                if starts:
+                    matches[chunk_id] = starts
+        return matches
+
+    @staticmethod
+    def term_positions(term_postings: List[Postings], chunk_id: int) -> List[Sequence[int]]:
+        """Token positions of each query term present in a chunk"""
+        position_lists = []
+        for postings in term_postings:
+            positions = _chunk_positions(postings, chunk_id)
+            if positions:
+                position_lists.append(positions)
+        return position_lists
+
+    @staticmethod
+    def _proximity_bonus(term_postings: List[Postings], chunk_id: int) -> float:
+        """Up to PROXIMITY_WEIGHT when the chunk's matched terms fall in a tight window"""
+        position_lists = IndexReader.term_positions(term_postings, chunk_id)
+        if len(position_lists) < 2:
+            return 0.0
+        # Decompounded parts share their word's position, so a span can be shorter than the term count
+        return PROXIMITY_WEIGHT * min(1.0, len(position_lists) / min_cover_span(position_lists))
+
+    def search_hits(self, query: str, max_chunks: int = 3,
+                    doc_ids: Optional[Iterable[str]] = None, shards: int = 1,
+                    executor: Optional[Executor] = None, reranker=None) -> List[Dict]:
+        """Search and resolve each hit to its text, features, match positions, passage and term coverage
+
+        A reranker (rag_rerank.FeatureReranker) re-orders the top reranker.candidates
+        of the first pass before the best max_chunks are resolved.
+        """
+        term_postings, phrases = self._plan(query)
+        return self._hits(query, term_postings, phrases, self._allowed_chunks(doc_ids), max_chunks,
+                          shards, executor, reranker)
+
+    def search_hits_batch(self, queries: Sequence[Tuple[str, Optional[Iterable[str]], int]],
+                          reranker=None) -> List[List[Dict]]:
+        """search_hits for many (query, doc_ids, max_chunks) at once
+
+        Postings of terms the queries share are fetched once for the whole batch, and
+        queries restricted to the same documents share one allowed chunk set.
+        """
+        fetched: Dict[str, Postings] = {}
+        allowed_sets: Dict[Optional[Tuple[str, ...]], Optional[set]] = {}
+        results = []
+        for query, doc_ids, max_chunks in queries:
+            scope = tuple(doc_ids) if doc_ids is not None else None
+            if scope not in allowed_sets:
+                allowed_sets[scope] = self._allowed_chunks(scope)
+            term_postings, phrases = self._plan(query, fetched)
+            results.append(self._hits(query, term_postings, phrases, allowed_sets[scope], max_chunks,
+                                      1, None, reranker))
+        return results
+
+    def _hits(self, query: str, term_postings: List[Postings], phrases: List[List[Tuple[int, Postings]]],
+              allowed: Optional[set], max_chunks: int, shards: int, executor: Optional[Executor],
+              reranker) -> List[Dict]:
+        if reranker is not None:
+            ranked = self._rank(term_postings, phrases, allowed, max(max_chunks, reranker.candidates),
+                                shards, executor)
+            ranked = reranker.rerank(self, self.analyzer.query_terms(query), term_postings, ranked, max_chunks)
+        else:
+            ranked = self._rank(term_postings, phrases, allowed, max_chunks, shards, executor)
+        hits = []
+        for score, chunk_id in ranked:
+            positions = self._match_positions(term_postings, chunk_id)
+            text = self.get_chunk_text(chunk_id)
+            hits.append({
+                "chunk_id": chunk_id,
+                "doc_id": self.chunk_doc_id(chunk_id),
+                "score": score,
+                "text": text,
+                "features": self.get_chunk_features(chunk_id),
+                "positions": positions,
+                "passage": self.passage(chunk_id, text, positions),
+                # Share of the distinct query terms the chunk contains, whatever the ranking bonuses
+                "coverage": len(self.term_positions(term_postings, chunk_id)) / len(term_postings)
+                if term_postings else 0.0,
+            })
+        return hits
+
+    @staticmethod
+    def _match_positions(term_postings: List[Postings], chunk_id: int) -> List[int]:
+        """Collect the token positions of a chunk from the query terms' postings"""
+        positions = []
+        for postings in term_postings:
+            found = _chunk_positions(postings, chunk_id)
+            if found is not None:
+                positions.extend(found)
+        positions.sort()
+        return positions
+
+    def passage(self, chunk_id: int, text: str, positions: List[int],
+                window: int = PASSAGE_WINDOW_TOKENS) -> Dict:
+        """Cut the densest window of matches out of a chunk using stored token offsets
+
+        Highlight offsets are relative to the passage text.
+        """
+        offsets = self.get_token_offsets(chunk_id)
+        token_count = len(offsets) // 2
+        if not positions or not token_count:
+            end = min(len(text), 200)
+            return {"text": text[:end], "start": 0, "end": end, "highlights": []}
+
+        first, last = densest_window(positions, window)
+        start_token = max(0, first - (window - (last - first + 1)) // 2)
+        end_token = min(token_count, start_token + window)
+        start_token = max(0, end_token - window)
+
+        # Windows touching the chunk edges keep the leading/trailing punctuation
+        start = offsets[2 * start_token] if start_token > 0 else 0
+        end = offsets[2 * end_token - 1] if end_token < token_count else len(text)
+        highlights = [
+            [offsets[2 * position] - start, offsets[2 * position + 1] - start]
+            for position in positions if start_token <= position < end_token
+        ]
+        return {"text": text[start:end], "start": start, "end": end, "highlights": highlights}
+
+    def semantic_search(self, vector: Sequence[float], max_chunks: int = 5,
+                        doc_ids: Optional[Iterable[str]] = None,
+                        ef: Optional[int] = None) -> List[Tuple[float, int]]:
+        """Top (cosine similarity, chunk_id) pairs for a query embedding
+
+        Uses the ANN graph when there is one; small filtered searches and indexes
+        without a graph fall back to an exact scan. Candidates found over quantized
+        vectors are re-ranked with the float32 embeddings.
+        """
+        allowed = self._allowed_chunks(doc_ids)
+        if self.ann is not None:
+            # Quantized graphs over-fetch and re-rank the candidates in float32
+            fetch = max_chunks * self.ann.rerank_factor
+            if allowed is not None and len(allowed) <= EXACT_SEARCH_LIMIT:
+                hits = self.ann.exact(vector, fetch, [cid for cid in allowed if cid in self.ann])
+            else:
+                hits = self.ann.query(vector, fetch, ef, allowed)
+                if allowed is not None and len(hits) < fetch:
+                    # Selective filters can starve the graph's candidate list
+                    hits = self.ann.exact(vector, fetch, [cid for cid in allowed if cid in self.ann])
+            with span("rerank"):
+                return self.ann.rerank(vector, hits, max_chunks)
+
+        query_norm = sum(value * value for value in vector) ** 0.5 or 1.0
+        scored = []
+        for chunk_id in (allowed if allowed is not None else range(self.chunk_id_limit())):
+            embedding = self.get_embedding(chunk_id)
+            if embedding is None:
+                continue
+            norm = sum(value * value for value in embedding) ** 0.5 or 1.0
+            scored.append((sum(a * b for a, b in zip(vector, embedding)) / (query_norm * norm), chunk_id))
+        return heapq.nlargest(max_chunks, scored)
+
+    def search_chunks(self, query: str, doc_id: str, max_chunks: int = 3) -> List[str]:
+        """Return the most relevant chunk texts of one document"""
+        hits = self.search(query, max_chunks=max_chunks, doc_ids=[doc_id])
+        return [self.get_chunk_text(cid) for _, cid in hits]
+
+
+class CorpusIndex(IndexReader):
+    """Mutable in-process index; the authoritative copy in single-process mode
+
+    Chunk embeddings also go into an HNSW graph when numpy is installed; ann_params
+    are passed to HNSWIndex (m, ef_construction, ef_search). The graph's normalised
+    float32 rows are then the only copy of the embeddings; without numpy they are
+    kept as lists.
+    """
+
+    def __init__(self, analyzer: Optional[Analyzer] = None, ann_params: Optional[Dict] = None):
+        if analyzer is not None:
+            self.analyzer = analyzer
+        self.ann_params = ann_params or {}
+        self.ann: Optional[HNSWIndex] = None
+        self.documents: Dict[str, Dict] = {}
+        self.contents: Dict[str, str] = {}
+        self._doc_chunk_ids: Dict[str, List[int]] = {}
+        self._chunk_texts: Dict[int, str] = {}
+        self._chunk_docs: Dict[int, str] = {}
+        self._postings: Dict[str, Dict[int, List[int]]] = {}
+        self._token_offsets: Dict[int, array] = {}
+        self._embeddings: Dict[int, List[float]] = {}
+        self._chunk_features: Dict[int, Dict] = {}
+        self._next_chunk_id = 0
+        self._lock = threading.RLock()
+
+    def add_document(self, doc_id: str, metadata: Dict, text: str, chunks: List[str],
+                     embeddings: Optional[List[List[float]]] = None,
+                     features: Optional[List[Dict]] = None):
+        """Add or replace a document with its chunks and optional chunk embeddings/features"""
+        with self._lock:
+            self.remove_document(doc_id)
+            chunk_ids = self._index_chunks(doc_id, chunks, embeddings, features)
+            self.documents[doc_id] = metadata
+            self.contents[doc_id] = text
+            self._doc_chunk_ids[doc_id] = chunk_ids
+            self.generation += 1
+
+    def append_chunks(self, doc_id: str, metadata: Dict, text: str, chunks: List[str],
+                      embeddings: Optional[List[List[float]]] = None,
+                      features: Optional[List[Dict]] = None):
+        """Extend a document with more text and chunks, replacing its metadata
+
+        Used by incremental ingest to publish a document page window by page window;
+        a document that is not indexed yet is added.
+        """
+        with self._lock:
+            if doc_id not in self.documents:
+                self.add_document(doc_id, metadata, text, chunks, embeddings, features)
+                return
+            chunk_ids = self._index_chunks(doc_id, chunks, embeddings, features)
+            # New objects rather than in-place growth, so concurrent readers see either version
+            self._doc_chunk_ids[doc_id] = self._doc_chunk_ids[doc_id] + chunk_ids
+            self.contents[doc_id] = self.contents.get(doc_id, "") + text
+            self.documents[doc_id] = metadata
+            self.generation += 1
+
+    def _index_chunks(self, doc_id: str, chunks: List[str], embeddings: Optional[List[List[float]]],
+                      features: Optional[List[Dict]]) -> List[int]:
+        chunk_ids = []
+        graph_ids, graph_vectors = [], []
+        for position, chunk in enumerate(chunks):
+            chunk_id = self._next_chunk_id
+            self._next_chunk_id += 1
+            chunk_ids.append(chunk_id)
+            self._chunk_texts[chunk_id] = chunk
+            self._chunk_docs[chunk_id] = doc_id
+            token_terms, self._token_offsets[chunk_id] = self.analyzer.analyze(chunk)
+            for token_position, terms in enumerate(token_terms):
+                for term in terms:
+                    self._postings.setdefault(term, {}).setdefault(chunk_id, []).append(token_position)
+            if embeddings is not None and embeddings[position] is not None:
+                if NUMPY_AVAILABLE:
+                    graph_ids.append(chunk_id)
+                    graph_vectors.append(embeddings[position])
+                else:
+                    self._embeddings[chunk_id] = embeddings[position]
+            if features is not None:
+                self._chunk_features[chunk_id] = features[position]
+        self._add_to_graph(graph_ids, graph_vectors)
+        return chunk_ids
+
+    def set_embeddings(self, doc_id: str, embeddings: Sequence[Optional[List[float]]]):
+        """Attach embeddings to a document's indexed chunks, in chunk order, without re-analysing them"""
+        with self._lock:
+            graph_ids, graph_vectors = [], []
+            for chunk_id, vector in zip(self._doc_chunk_ids.get(doc_id, []), embeddings):
+                if vector is None:
+                    continue
+                if NUMPY_AVAILABLE:
+                    graph_ids.append(chunk_id)
+                    graph_vectors.append(vector)
+                else:
+                    self._embeddings[chunk_id] = vector
+            self._add_to_graph(graph_ids, graph_vectors)
+            self.generation += 1
+
+    def remove_document(self, doc_id: str) -> bool:
+        """Drop a document and its postings; returns False when it was not indexed"""
+        with self._lock:
+            if doc_id not in self.documents:
+                return False
+            for chunk_id in self._doc_chunk_ids.pop(doc_id, []):
+                token_terms, _ = self.analyzer.analyze(self._chunk_texts.pop(chunk_id))
+                for term in set(chain.from_iterable(token_terms)):
+                    term_postings = self._postings.get(term)
+                    if term_postings is not None:
+                        term_postings.pop(chunk_id, None)
+                        if not term_postings:
+                            del self._postings[term]
+                self._chunk_docs.pop(chunk_id, None)
+                self._token_offsets.pop(chunk_id, None)
+                if self._embeddings.pop(chunk_id, None) is None and self.ann is not None:
+                    self.ann.remove(chunk_id)
+                self._chunk_features.pop(chunk_id, None)
+            del self.documents[doc_id]
+            self.contents.pop(doc_id, None)
+            self.generation += 1
+            return True
+
+    def _add_to_graph(self, chunk_ids: List[int], vectors: List[List[float]]):
+        if not NUMPY_AVAILABLE or not chunk_ids:
+            return
+        if self.ann is None:
+            self.ann = HNSWIndex(len(vectors[0]), **self.ann_params)
+        # A graph adopted from a snapshot already holds the chunk under the same id
+        fresh = [position for position, chunk_id in enumerate(chunk_ids) if chunk_id not in self.ann]
+        self.ann.add_batch([chunk_ids[position] for position in fresh], [vectors[position] for position in fresh])
+
+    def get_content(self, doc_id: str) -> Optional[str]:
+        return self.contents.get(doc_id)
+
+    def get_chunk_ids(self, doc_id: str) -> List[int]:
+        return self._doc_chunk_ids.get(doc_id, [])
+
+    def get_chunk_text(self, chunk_id: int) -> str:
+        return self._chunk_texts[chunk_id]
+
+    def chunk_doc_id(self, chunk_id: int) -> Optional[str]:
+        return self._chunk_docs.get(chunk_id)
+
+    def chunk_id_limit(self) -> int:
+        return self._next_chunk_id
+
+    def postings(self, term: str) -> List[Tuple[int, List[int]]]:
+        # Chunk ids only grow, so insertion order is already chunk id order
+        with self._lock:
+            return list(self._postings.get(term, {}).items())
+
+    def get_embedding(self, chunk_id: int) -> Optional[List[float]]:
+        if self.ann is not None and chunk_id in self.ann and self.ann.is_live(chunk_id):
+            return self.ann.vector(chunk_id).tolist()
+        return self._embeddings.get(chunk_id)
+
+    def get_chunk_features(self, chunk_id: int) -> Optional[Dict]:
+        return self._chunk_features.get(chunk_id)
+
+    def get_token_offsets(self, chunk_id: int) -> Sequence[int]:
+        return self._token_offsets.get(chunk_id, ())
+
+    def vocabulary(self) -> List[str]:
+        """Return all indexed terms"""
+        with self._lock:
+            return list(self._postings)
+
+    def search(self, query: str, max_chunks: int = 3,
+               doc_ids: Optional[Iterable[str]] = None, shards: int = 1,
+               executor: Optional[Executor] = None) -> List[Tuple[float, int]]:
+        with self._lock:
+            return IndexReader.search(self, query, max_chunks, doc_ids, shards, executor)
+
+    def search_hits(self, query: str, max_chunks: int = 3,
+                    doc_ids: Optional[Iterable[str]] = None, shards: int = 1,
+                    executor: Optional[Executor] = None, reranker=None) -> List[Dict]:
+        with self._lock:
+            return IndexReader.search_hits(self, query, max_chunks, doc_ids, shards, executor, reranker)
+
+    def search_hits_batch(self, queries: Sequence[Tuple[str, Optional[Iterable[str]], int]],
+                          reranker=None) -> List[List[Dict]]:
+        with self._lock:
+            return IndexReader.search_hits_batch(self, queries, reranker)
+
+    def semantic_search(self, vector: Sequence[float], max_chunks: int = 5,
+                        doc_ids: Optional[Iterable[str]] = None,
+                        ef: Optional[int] = None) -> List[Tuple[float, int]]:
+        with self._lock:
+            return IndexReader.semantic_search(self, vector, max_chunks, doc_ids, ef)
+
+    @classmethod
+    def from_reader(cls, reader: IndexReader, ann_params: Optional[Dict] = None) -> "CorpusIndex":
+        """Rebuild a mutable index from any reader (e.g. a shared snapshot)"""
+        index = cls(reader.analyzer, ann_params)
+        if reader.ann is not None and hasattr(reader.ann, "thaw"):
+            # Chunks are re-added in the reader's id order, so a snapshot's dense ids
+            # map onto themselves and the stored graph is adopted instead of rebuilt
+            index.ann = reader.ann.thaw()
+        for doc_id, metadata in reader.documents.items():
+            chunk_ids = list(reader.get_chunk_ids(doc_id))
+            embeddings = [reader.get_embedding(cid) for cid in chunk_ids]
+            features = [reader.get_chunk_features(cid) for cid in chunk_ids]
+            index.add_document(
+                doc_id,
+                dict(metadata),
+                reader.get_content(doc_id) or "",
+                [reader.get_chunk_text(cid) for cid in chunk_ids],
+                embeddings if any(e is not None for e in embeddings) else None,
+                features if all(f is not None for f in features) else None,
+            )
+        index.generation = reader.generation
+        return index
@@ -0,0 +1,150 @@
+"""
+OCR fallback for scanned PDF pages
+Scanned intake forms have pages whose text layer is empty. Only those pages are
+sent to OCR: their embedded images go to a separate process pool with its own
+worker limit, so OCR never holds the GIL or the threads of normal ingest, and each
+result is cached per page image in the extraction cache.
+
+The engine is local Tesseract (pytesseract + Pillow) by default. RAG_OCR_ENGINE
+may instead name any "module:function" taking (images: List[bytes], language: str)
+and returning the page text; it is imported in the worker processes.
+"""
+
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+import rag_capabilities
+from rag_extraction_cache import ExtractionCache
+from rag_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Pages with fewer extracted characters than this are treated as scanned
+DEFAULT_MIN_CHARS = 16
+
+# Scanned pages OCR'd per document; later ones keep their empty text layer
+DEFAULT_MAX_PAGES = 200
+
+OCR_PAGES = REGISTRY.counter("rag_ocr_pages_total", "Pages sent to the OCR stage by outcome (cached, ocr, failed)",
+                             ["outcome"])
+
+
+def tesseract_engine(images: List[bytes], language: str) -> str:
+    """OCR page images with the local tesseract binary"""
+    import io
+    import pytesseract
+    from PIL import Image
+    return "\n".join(pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang=language).strip()
+                     for data in images).strip()
+
+
+ENGINES = {"tesseract": tesseract_engine}
+
+
+def resolve_engine(spec: str) -> Callable[[List[bytes], str], str]:
+    if spec in ENGINES:
+        return ENGINES[spec]
+    module_name, _, function = spec.partition(":")
+    return getattr(importlib.import_module(module_name), function)
+
+
+def run_engine(spec: str, images: List[bytes], language: str) -> str:
+    """Process pool entry point; resolves the engine inside the worker"""
+    return resolve_engine(spec)(images, language)
+
+
+def page_images(page) -> List[bytes]:
+    """Image data embedded in a PyPDF2 page (needs Pillow); empty when they cannot be decoded"""
+    try:
+        return [image.data for image in page.images]
+    except Exception as e:
+        logger.warning(f"Could not extract page images for OCR: {e}")
+        return []
+
+
+class OCRStage:
+    """Runs OCR of scanned pages on a bounded process pool, caching results per page image"""
+
+    def __init__(self, engine: str = "tesseract", workers: int = 2, language: str = "nld+eng",
+                 min_chars: int = DEFAULT_MIN_CHARS, max_pages: int = DEFAULT_MAX_PAGES,
+                 cache: Optional[ExtractionCache] = None):
+        self.engine = engine
+        self.workers = workers
+        self.language = language
+        self.min_chars = min_chars
+        self.max_pages = max_pages
+        self.cache = cache
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, cache: Optional[ExtractionCache] = None) -> Optional["OCRStage"]:
+        """OCR stage from RAG_OCR_ENGINE, RAG_OCR_WORKERS, RAG_OCR_LANGUAGE, RAG_OCR_MIN_CHARS and RAG_OCR_MAX_PAGES
+
+        None when RAG_OCR=0 or the default Tesseract engine is not installed.
+        """
+        if os.environ.get('RAG_OCR', '1').lower() in ('0', 'false', 'no', 'off'):
+            return None
+        engine = os.environ.get('RAG_OCR_ENGINE', 'tesseract')
+        if engine == 'tesseract' and not (rag_capabilities.available("ocr") and shutil.which('tesseract')):
+            logger.info("OCR fallback unavailable: install pytesseract, Pillow and the tesseract binary")
+            return None
+        return cls(engine, int(os.environ.get('RAG_OCR_WORKERS', 2)), os.environ.get('RAG_OCR_LANGUAGE', 'nld+eng'),
+                   int(os.environ.get('RAG_OCR_MIN_CHARS', DEFAULT_MIN_CHARS)),
+                   int(os.environ.get('RAG_OCR_MAX_PAGES', DEFAULT_MAX_PAGES)), cache)
+
+    def needs_ocr(self, text: str) -> bool:
+        return len(text.strip()) < self.min_chars
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                # Spawned, not forked: the servers fork from threaded processes
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _page_key(self, images: List[bytes]) -> str:
+        digest = hashlib.sha256(f"{self.engine}\n{self.language}\n".encode())
+        for data in images:
+            digest.update(hashlib.sha256(data).digest())
+        return digest.hexdigest()
+
+    def submit(self, images: List[bytes]) -> Future:
+        """Future of the OCR text of one page's images; completed at once on a cache hit"""
+        key = self._page_key(images)
+        cached = self.cache.get_page(key) if self.cache is not None else None
+        if cached is not None:
+            OCR_PAGES.inc(outcome="cached")
+            future = Future()
+            future.set_result(cached)
+            return future
+        future = self._executor().submit(run_engine, self.engine, images, self.language)
+
+        def record(done: Future):
+            if done.cancelled() or done.exception() is not None:
+                OCR_PAGES.inc(outcome="failed")
+                return
+            OCR_PAGES.inc(outcome="ocr")
+            if self.cache is not None:
+                # Runs as a future callback, where concurrent.futures would only log the exception
+                try:
+                    self.cache.put_page(key, done.result())
+                except OSError as e:
+                    logger.warning(f"Could not cache OCR page {key}: {e}")
+
+        future.add_done_callback(record)
+        return future
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
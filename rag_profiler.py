@@ -0,0 +1,232 @@
+"""
+Slow-request profiler for the MedDoc RAG servers
+Opt-in (RAG_PROFILE_SLOW_MS): every request is profiled while it runs and the
+profile is kept only when the request exceeds the latency threshold. Kept profiles
+live in a bounded ring buffer together with the request's stage timings and can be
+downloaded in pstats (snakeviz, `python -m pstats`) or collapsed-stack
+(flamegraph.pl, speedscope) format.
+
+Two modes:
+- sample: a background thread reads the stacks of threads serving a request every
+  few milliseconds; cheap enough for production load
+- cprofile: deterministic cProfile per request thread; exact call counts, but
+  slows the profiled code noticeably. Python 3.12+ allows one active cProfile per
+  process, so concurrent requests beyond the first go unprofiled there.
+"""
+
+import cProfile
+import itertools
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from rag_metrics import timings_block
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("sample", "cprofile")
+
+PROFILE_FORMATS = ("pstats", "collapsed")
+
+# Frames beyond this depth are dropped from the root end of a sampled stack
+MAX_STACK_DEPTH = 128
+
+# (filename, first line, function name), the function key pstats uses
+FrameKey = Tuple[str, int, str]
+
+
+def frame_label(key: FrameKey) -> str:
+    filename, line, name = key
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class RequestProfile:
+    """One kept profile: request metadata, stage timings and the raw profile data"""
+
+    def __init__(self, profile_id: int, method: str, endpoint: str, duration: float,
+                 timings: Dict[str, float], mode: str, interval: float):
+        self.profile_id = profile_id
+        self.method = method
+        self.endpoint = endpoint
+        self.duration = duration
+        self.timings = timings
+        self.mode = mode
+        self.interval = interval
+        self.captured_at = datetime.now().isoformat()
+        # sample mode: root-to-leaf stacks and how often each was seen
+        self.stacks: Counter = Counter()
+        # cprofile mode: the pstats dictionary
+        self.stats: Optional[Dict] = None
+
+    def summary(self) -> Dict:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "endpoint": self.endpoint,
+            "duration_ms": round(1000 * self.duration, 3),
+            "timings": timings_block(self.timings),
+            "mode": self.mode,
+            "samples": sum(self.stacks.values()),
+            "captured_at": self.captured_at,
+            "formats": list(self.formats()),
+        }
+
+    def formats(self) -> Tuple[str, ...]:
+        # cProfile records caller/callee pairs, not whole stacks
+        return PROFILE_FORMATS if self.mode == "sample" else ("pstats",)
+
+    def collapsed(self) -> str:
+        """One 'root;...;leaf count' line per distinct stack"""
+        return "".join(f"{';'.join(frame_label(key) for key in stack)} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+    def pstats(self) -> bytes:
+        """Marshalled stats dictionary, the file format pstats.Stats loads"""
+        return marshal.dumps(self.stats if self.stats is not None else self._sampled_stats())
+
+    def _sampled_stats(self) -> Dict:
+        """pstats view of the samples: calls are sample counts, times are samples * interval"""
+        # key -> [primitive calls, calls, own time, cumulative time, {caller: [cc, nc, tt, ct]}]
+        entries: Dict[FrameKey, List] = {}
+        for stack, count in self.stacks.items():
+            elapsed = count * self.interval
+            seen = set()
+            for depth, key in enumerate(stack):
+                entry = entries.setdefault(key, [0, 0, 0.0, 0.0, {}])
+                leaf = depth == len(stack) - 1
+                if leaf:
+                    entry[2] += elapsed
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += elapsed
+                if depth:
+                    edge = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                    edge[0] += count
+                    edge[1] += count
+                    edge[2] += elapsed if leaf else 0.0
+                    edge[3] += elapsed
+        return {key: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+                for key, (cc, nc, tt, ct, callers) in entries.items()}
+
+
+class _ActiveRequest:
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.started = time.perf_counter()
+        self.stacks: Counter = Counter()
+        self.profiler: Optional[cProfile.Profile] = None
+
+
+class SlowRequestProfiler:
+    """Profiles every request, keeps the ones slower than the threshold"""
+
+    def __init__(self, threshold_ms: float, mode: str = "sample", interval_ms: float = 5.0,
+                 capacity: int = 50):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}', expected one of {', '.join(PROFILE_MODES)}")
+        self.threshold = threshold_ms / 1000
+        self.mode = mode
+        self.interval = interval_ms / 1000
+        self.profiles: Deque[RequestProfile] = deque(maxlen=capacity)
+        self._active: Dict[int, _ActiveRequest] = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._sampler: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_environment(cls) -> Optional["SlowRequestProfiler"]:
+        """The configured profiler, or None when RAG_PROFILE_SLOW_MS is unset"""
+        threshold = os.environ.get('RAG_PROFILE_SLOW_MS')
+        if not threshold:
+            return None
+        profiler = cls(
+            float(threshold),
+            os.environ.get('RAG_PROFILE_MODE', 'sample'),
+            float(os.environ.get('RAG_PROFILE_INTERVAL_MS', 5)),
+            int(os.environ.get('RAG_PROFILE_CAPACITY', 50)),
+        )
+        logger.info(f"Profiling requests slower than {threshold}ms ({profiler.mode} mode)")
+        return profiler
+
+    def start(self) -> _ActiveRequest:
+        """Begin profiling the request served by the calling thread"""
+        active = _ActiveRequest(threading.get_ident())
+        if self.mode == "cprofile":
+            try:
+                active.profiler = cProfile.Profile()
+                active.profiler.enable()
+            except ValueError:
+                # Another request holds the process-wide profiler (Python 3.12+)
+                active.profiler = None
+        else:
+            self._ensure_sampler()
+            with self._lock:
+                self._active[active.thread_id] = active
+        return active
+
+    def finish(self, active: _ActiveRequest, method: str, endpoint: str,
+               timings: Optional[Dict[str, float]] = None) -> Optional[RequestProfile]:
+        """Stop profiling; returns the kept profile when the request was slow"""
+        duration = time.perf_counter() - active.started
+        if active.profiler is not None:
+            active.profiler.disable()
+        with self._lock:
+            self._active.pop(active.thread_id, None)
+        if duration < self.threshold or (self.mode == "cprofile" and active.profiler is None):
+            return None
+
+        profile = RequestProfile(next(self._ids), method, endpoint, duration, dict(timings or {}),
+                                 self.mode, self.interval)
+        if active.profiler is not None:
+            active.profiler.create_stats()
+            profile.stats = active.profiler.stats
+        else:
+            with self._lock:
+                profile.stacks = active.stacks
+        with self._lock:
+            self.profiles.append(profile)
+        logger.info(f"Kept profile {profile.profile_id}: {method} {endpoint} took {1000 * duration:.0f}ms")
+        return profile
+
+    def list(self) -> List[Dict]:
+        with self._lock:
+            profiles = list(self.profiles)
+        return [profile.summary() for profile in reversed(profiles)]
+
+    def get(self, profile_id: int) -> Optional[RequestProfile]:
+        with self._lock:
+            return next((profile for profile in self.profiles if profile.profile_id == profile_id), None)
+
+    def _ensure_sampler(self):
+        if self._sampler is not None:
+            return
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample_loop, name="rag-profiler", daemon=True)
+                self._sampler.start()
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, active in self._active.items():
+                    frame = frames.get(thread_id)
+                    stack = []
+                    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                        frame = frame.f_back
+                    if stack:
+                        active.stacks[tuple(reversed(stack))] += 1
@@ -0,0 +1,331 @@
+"""
+Quantized embedding storage for the MedDoc RAG index
+int8 scalar quantization with a per-vector scale, and product quantization (PQ)
+scored through asymmetric distance tables. Vectors are L2-normalised before
+encoding so both codecs approximate cosine similarity; a float32 re-rank of the
+top candidates restores the exact order.
+"""
+
+import heapq
+import json
+import logging
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rag_capabilities import available, lazy_module
+
+# numpy loads on first vector operation, not at import
+NUMPY_AVAILABLE = available("numpy")
+np = lazy_module("numpy")
+
+logger = logging.getLogger(__name__)
+
+VECTOR_CODECS = ("float32", "int8", "pq")
+
+# Centroids per PQ subspace, so every code is one byte
+PQ_CENTROIDS = 256
+
+# Dimensions per PQ subspace: 1536-d ada-002 vectors become 192 one-byte codes
+PQ_SUBSPACE_DIM = 8
+
+# Coarse centroids for residual PQ (ids fit in two bytes), about one per PQ_COARSE_POINTS vectors
+PQ_COARSE_CENTROIDS = 1024
+PQ_COARSE_POINTS = 32
+
+PQ_TRAINING_SAMPLE = 20000
+PQ_ITERATIONS = 12
+
+# Rows per batch when assigning codes, to bound the temporary distance matrices
+ENCODE_BATCH = 65536
+
+
+def normalize_rows(matrix) -> "np.ndarray":
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _normalize(vector) -> "np.ndarray":
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def pq_subspaces(dim: int) -> int:
+    """Number of subspaces for a dimension: about PQ_SUBSPACE_DIM wide, dividing dim evenly"""
+    target = max(1, dim // PQ_SUBSPACE_DIM)
+    for subspaces in range(target, 0, -1):
+        if dim % subspaces == 0:
+            return subspaces
+    return 1
+
+
+class FloatVectors:
+    """Exact cosine scoring over a float32 matrix with precomputed row norms"""
+
+    codec = "float32"
+    # Candidates per requested result scored in float32 after searching these vectors
+    rerank_factor = 1
+
+    def __init__(self, matrix, norms):
+        self.matrix = matrix
+        self.norms = norms
+
+    def bytes_per_vector(self) -> int:
+        return self.matrix.shape[1] * 4
+
+    def prepare(self, vector):
+        return _normalize(vector)
+
+    def similarities(self, query, nodes):
+        # All-zero rows (chunks without a vector, or a zero embedding) score 0 rather than NaN
+        norms = self.norms[nodes]
+        return (self.matrix[nodes] @ query) / np.where(norms == 0, 1.0, norms)
+
+    def rerank(self, vector, candidates: Sequence[Tuple[float, int]], k: int) -> List[Tuple[float, int]]:
+        """Rescore approximate (score, id) candidates exactly and keep the best k"""
+        nodes = [node for _, node in candidates]
+        if not nodes:
+            return []
+        similarities = self.similarities(self.prepare(vector), nodes).tolist()
+        return heapq.nlargest(k, zip(similarities, nodes))
+
+
+class Int8Vectors:
+    """One signed byte per dimension plus a float32 scale per vector (about 4x smaller)"""
+
+    codec = "int8"
+    rerank_factor = 4
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @staticmethod
+    def encode(matrix) -> Tuple["np.ndarray", "np.ndarray"]:
+        rows = normalize_rows(matrix)
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def bytes_per_vector(self) -> int:
+        return self.codes.shape[1] + 4
+
+    def prepare(self, vector):
+        return _normalize(vector)
+
+    def similarities(self, query, nodes):
+        return (self.codes[nodes].astype(np.float32) @ query) * self.scales[nodes]
+
+
+class PQVectors:
+    """Residual product quantization: a coarse centroid id plus one byte per subspace
+
+    Each vector is assigned to a coarse k-means centroid and its residual is split
+    into subspaces quantized against per-subspace codebooks. A query is scored from
+    its dot products with the coarse centroids plus an asymmetric distance table.
+    """
+
+    codec = "pq"
+    rerank_factor = 10
+
+    def __init__(self, coarse_ids, codes, coarse, centroids):
+        self.coarse_ids = coarse_ids
+        self.codes = codes
+        self.coarse = coarse
+        self.centroids = centroids
+        self._columns = np.arange(centroids.shape[0])
+
+    @staticmethod
+    def _kmeans(points, count: int, iterations: int, rng) -> "np.ndarray":
+        means = points[rng.choice(len(points), count, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = PQVectors._nearest(points, means)
+            sums = np.zeros_like(means)
+            np.add.at(sums, assignment, points)
+            sizes = np.bincount(assignment, minlength=count)
+            empty = sizes == 0
+            means[~empty] = sums[~empty] / sizes[~empty, None]
+            # Re-seed empty clusters on random points so every code stays in use
+            if empty.any():
+                means[empty] = points[rng.choice(len(points), int(empty.sum()))]
+        return means
+
+    @staticmethod
+    def train(matrix, subspaces: int, centroids: int = PQ_CENTROIDS,
+              sample: int = PQ_TRAINING_SAMPLE, iterations: int = PQ_ITERATIONS,
+              seed: int = 0) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Coarse centroids (coarse, dim) and residual codebooks (subspaces, centroids, dim / subspaces)"""
+        rows = normalize_rows(matrix)
+        rng = np.random.default_rng(seed)
+        if len(rows) > sample:
+            rows = rows[rng.choice(len(rows), sample, replace=False)]
+        coarse = PQVectors._kmeans(rows, min(PQ_COARSE_CENTROIDS, max(1, len(rows) // PQ_COARSE_POINTS)),
+                                   iterations, rng)
+        residuals = rows - coarse[PQVectors._nearest(rows, coarse)]
+
+        width = rows.shape[1] // subspaces
+        count = min(centroids, len(rows))
+        codebooks = np.zeros((subspaces, centroids, width), dtype=np.float32)
+        for subspace in range(subspaces):
+            means = PQVectors._kmeans(residuals[:, subspace * width:(subspace + 1) * width],
+                                      count, iterations, rng)
+            codebooks[subspace, :count] = means
+            # Tiny corpora leave slots unused; they repeat the first centroid
+            codebooks[subspace, count:] = means[0]
+        return coarse, codebooks
+
+    @staticmethod
+    def _nearest(points, means) -> "np.ndarray":
+        assignment = np.empty(len(points), dtype=np.int64)
+        mean_norms = (means * means).sum(axis=1)
+        for start in range(0, len(points), ENCODE_BATCH):
+            batch = points[start:start + ENCODE_BATCH]
+            assignment[start:start + len(batch)] = (mean_norms - 2 * batch @ means.T).argmin(axis=1)
+        return assignment
+
+    @staticmethod
+    def encode(matrix, coarse, codebooks) -> Tuple["np.ndarray", "np.ndarray"]:
+        rows = normalize_rows(matrix)
+        coarse_ids = PQVectors._nearest(rows, coarse)
+        residuals = rows - coarse[coarse_ids]
+        subspaces, _, width = codebooks.shape
+        codes = np.empty((len(rows), subspaces), dtype=np.uint8)
+        for subspace in range(subspaces):
+            points = residuals[:, subspace * width:(subspace + 1) * width]
+            codes[:, subspace] = PQVectors._nearest(points, codebooks[subspace])
+        return coarse_ids.astype(np.uint16), codes
+
+    def bytes_per_vector(self) -> int:
+        return self.codes.shape[1] + 2
+
+    def prepare(self, vector):
+        """Query . coarse centroid scores plus the asymmetric distance table per subspace"""
+        subspaces, _, width = self.centroids.shape
+        query = _normalize(vector)
+        return self.coarse @ query, np.einsum('skw,sw->sk', self.centroids, query.reshape(subspaces, width))
+
+    def similarities(self, prepared, nodes):
+        coarse_scores, table = prepared
+        return coarse_scores[self.coarse_ids[nodes]] + table[self._columns, self.codes[nodes]].sum(axis=1)
+
+
+def float_vectors(embeddings, norms, dim: int) -> FloatVectors:
+    """Zero-copy float32 view over flat embedding and norm buffers"""
+    return FloatVectors(np.frombuffer(embeddings, dtype=np.float32).reshape(-1, dim),
+                        np.frombuffer(norms, dtype=np.float32))
+
+
+def encode_vectors(embeddings, dim: int, codec: str,
+                   codebook: Optional[Tuple[Dict, Tuple]] = None) -> Tuple[Dict, List[Tuple]]:
+    """Header metadata and (name, data, typecode) snapshot sections for a codec
+
+    A PQ codebook (meta, (coarse, centroids)) from the previous generation is reused
+    while the corpus is less than twice the size it was trained on, so publishing
+    does not retrain k-means every time.
+    """
+    matrix = np.frombuffer(embeddings, dtype=np.float32).reshape(-1, dim)
+    if codec == "int8":
+        codes, scales = Int8Vectors.encode(matrix)
+        return {"codec": "int8"}, [("vector_codes", codes, 'b'), ("vector_scales", scales, 'f')]
+    if codec == "pq":
+        if codebook is not None and codebook[0]["dim"] == dim and 2 * codebook[0]["trained_on"] >= len(matrix):
+            trained_on = codebook[0]["trained_on"]
+            coarse, centroids = codebook[1]
+        else:
+            started = time.perf_counter()
+            trained_on = len(matrix)
+            coarse, centroids = PQVectors.train(matrix, pq_subspaces(dim))
+            logger.info(f"Trained PQ codebooks on {trained_on} vectors in {time.perf_counter() - started:.1f}s")
+        coarse_ids, codes = PQVectors.encode(matrix, coarse, centroids)
+        meta = {"codec": "pq", "dim": dim, "coarse": len(coarse), "subspaces": centroids.shape[0],
+                "trained_on": trained_on}
+        return meta, [("pq_coarse", coarse, 'f'), ("pq_centroids", centroids, 'f'),
+                      ("pq_coarse_ids", coarse_ids, 'H'), ("pq_codes", codes, 'B')]
+    raise ValueError(f"Unknown vector codec: {codec}")
+
+
+def open_vectors(meta: Optional[Dict], sections: Dict, dim: int, exact: FloatVectors):
+    """Scoring view over a snapshot's vector sections (the float32 matrix when not quantized)"""
+    if not meta:
+        return exact
+    if meta["codec"] == "int8":
+        codes = np.frombuffer(sections["vector_codes"], dtype=np.int8).reshape(-1, dim)
+        return Int8Vectors(codes, np.frombuffer(sections["vector_scales"], dtype=np.float32))
+    if meta["codec"] == "pq":
+        subspaces = meta["subspaces"]
+        return PQVectors(
+            np.frombuffer(sections["pq_coarse_ids"], dtype=np.uint16),
+            np.frombuffer(sections["pq_codes"], dtype=np.uint8).reshape(-1, subspaces),
+            np.frombuffer(sections["pq_coarse"], dtype=np.float32).reshape(meta["coarse"], dim),
+            np.frombuffer(sections["pq_centroids"], dtype=np.float32).reshape(
+                subspaces, PQ_CENTROIDS, dim // subspaces),
+        )
+    raise ValueError(f"Unknown vector codec: {meta['codec']}")
+
+
+def evaluate(matrix, k: int = 10, queries: Optional[Sequence] = None, samples: int = 100,
+             rerank_factor: Optional[int] = None, seed: int = 0) -> Dict:
+    """Recall@k of each codec against exact float32 search, before and after re-rank
+
+    Without explicit queries, noisy copies of sampled stored vectors are used. Each
+    codec re-ranks its own rerank_factor unless one is given.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    exact = FloatVectors(matrix, np.linalg.norm(matrix, axis=1))
+    codes, scales = Int8Vectors.encode(matrix)
+    coarse, codebooks = PQVectors.train(matrix, pq_subspaces(matrix.shape[1]), seed=seed)
+    codecs = [Int8Vectors(codes, scales), PQVectors(*PQVectors.encode(matrix, coarse, codebooks), coarse, codebooks)]
+
+    rng = np.random.default_rng(seed)
+    if queries is None:
+        picks = rng.choice(len(matrix), min(samples, len(matrix)), replace=False)
+        queries = matrix[picks] + rng.normal(0, 0.1, (len(picks), matrix.shape[1])) * matrix[picks].std()
+    nodes = np.arange(len(matrix))
+
+    report = {"vectors": len(matrix), "dim": matrix.shape[1], "k": k,
+              "float32": {"bytes_per_vector": exact.bytes_per_vector()}}
+    for vectors in codecs:
+        fetch = min(k * (rerank_factor or vectors.rerank_factor), len(matrix))
+        found = reranked = expected = 0
+        seconds = 0.0
+        for query in queries:
+            truth = {node for _, node in _top(exact.similarities(exact.prepare(query), nodes), k)}
+            started = time.perf_counter()
+            candidates = _top(vectors.similarities(vectors.prepare(query), nodes), fetch)
+            seconds += time.perf_counter() - started
+            found += len(truth & {node for _, node in candidates[:k]})
+            reranked += len(truth & {node for _, node in exact.rerank(query, candidates, k)})
+            expected += len(truth)
+        report[vectors.codec] = {
+            "bytes_per_vector": vectors.bytes_per_vector(),
+            "compression": exact.bytes_per_vector() / vectors.bytes_per_vector(),
+            "recall": found / expected,
+            "recall_reranked": reranked / expected,
+            "rerank_candidates": fetch,
+            "scan_ms": 1000 * seconds / len(queries),
+        }
+    return report
+
+
+def _top(similarities, k: int) -> List[Tuple[float, int]]:
+    top = np.argpartition(similarities, -k)[-k:] if len(similarities) > k else np.arange(len(similarities))
+    return sorted(((float(similarities[i]), int(i)) for i in top), reverse=True)
+
+
+if __name__ == "__main__":
+    # Recall eval: python rag_quantization.py [vectors.npy | count dim]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) == 2:
+        vectors = np.load(sys.argv[1])
+    else:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+        dim = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+        # Clustered synthetic vectors, closer to real embeddings than uniform noise
+        rng = np.random.default_rng(0)
+        centers = rng.standard_normal((64, dim))
+        vectors = (centers[rng.integers(0, 64, count)] + 0.5 * rng.standard_normal((count, dim))).astype(np.float32)
+    print(json.dumps(evaluate(vectors), indent=2))
@@ -0,0 +1,77 @@
+"""
+Feature-based re-ranking of retrieved chunks under a latency budget
+Lexical retrieval ranks by matched terms, with phrase and proximity bonuses for
+its best candidates (every candidate the re-ranker gets has had the proximity
+pass). The re-ranker takes the top candidates of that ranking and adds a bonus
+per chunk from features the first pass does not see:
+
+    coverage    share of the distinct query terms the chunk contains
+    title       share of the query terms in the document title
+    recency     exp(-age / half-life) of the document date (or processed_at)
+
+Candidates are scored in first-pass order and the budget is checked after each
+one. When it runs out the rest keep their first-pass score: bonuses are never
+negative, so the result is still the best ranking of what was scored.
+"""
+
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from rag_document_table import parse_timestamp
+from rag_index import IndexReader, Postings
+from rag_metrics import REGISTRY, span
+
+DEFAULT_WEIGHTS = {"coverage": 1.0, "title": 0.5, "recency": 0.25}
+
+# Age at which the recency feature has halved
+RECENCY_HALF_LIFE_DAYS = 365
+
+RERANKED = REGISTRY.counter("rag_rerank_candidates_total",
+                            "Re-ranking candidates by outcome (scored, or skipped when the budget ran out)",
+                            ["outcome"])
+
+
+class FeatureReranker:
+    """Re-orders the top first-pass candidates by coverage, title and recency"""
+
+    def __init__(self, budget_ms: float = 15.0, candidates: int = 20, weights: Optional[Dict[str, float]] = None,
+                 half_life_days: float = RECENCY_HALF_LIFE_DAYS):
+        self.budget = budget_ms / 1000.0
+        self.candidates = candidates
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.half_life = half_life_days * 86400
+
+    def rerank(self, reader: IndexReader, query_terms: Sequence[str], term_postings: List[Postings],
+               ranked: List[Tuple[float, int]], max_chunks: int,
+               now: Optional[float] = None) -> List[Tuple[float, int]]:
+        """Top max_chunks of ranked (score, chunk_id) pairs after adding each scored chunk's bonus"""
+        with span("rerank"):
+            deadline = time.perf_counter() + self.budget
+            now = now if now is not None else datetime.now().timestamp()
+            documents = reader.documents
+            titles: Dict[str, frozenset] = {}
+            distinct = len(term_postings) or 1
+            scored = []
+            for position, (score, chunk_id) in enumerate(ranked):
+                if position and time.perf_counter() > deadline:
+                    RERANKED.inc(len(ranked) - position, outcome="skipped")
+                    scored.extend(ranked[position:])
+                    break
+                bonus = self.weights["coverage"] * len(reader.term_positions(term_postings, chunk_id)) / distinct
+
+                doc_id = reader.chunk_doc_id(chunk_id)
+                metadata = documents.get(doc_id, {})
+                if doc_id not in titles:
+                    titles[doc_id] = frozenset(reader.analyzer.query_terms(metadata.get('title') or ""))
+                if query_terms and titles[doc_id]:
+                    matched = sum(term in titles[doc_id] for term in query_terms)
+                    bonus += self.weights["title"] * matched / len(query_terms)
+                dated = parse_timestamp(metadata.get('date')) or parse_timestamp(metadata.get('processed_at'))
+                if dated is not None:
+                    bonus += self.weights["recency"] * math.exp(-math.log(2) * max(0.0, now - dated) / self.half_life)
+
+                scored.append((score + bonus, chunk_id))
+                RERANKED.inc(outcome="scored")
+            return sorted(scored, key=lambda pair: (-pair[0], pair[1]))[:max_chunks]
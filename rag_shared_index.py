@@ -0,0 +1,557 @@
+"""
+Shared-memory index generations for multi-worker RAG serving
+A single writer (whoever holds the publish lock) serialises the corpus index into
+an immutable generation file on a shared mmap directory (/dev/shm by default).
+Every worker maps the current generation read-only, so the corpus is held once
+no matter how many gunicorn workers are running.
+
+With a vector codec the generation holds only the int8/PQ codes; the float32 rows
+used to re-rank candidates go to a separate rows file on disk, mapped alongside
+it, so only the pages of re-ranked chunks are ever read into memory.
+
+Publishing re-encodes the whole corpus into a fresh generation, so every ingest
+(or ingest window) costs O(corpus) bytes written regardless of how small the change
+is. The server already publishes partial page windows at most once per
+RAG_PARTIAL_PUBLISH_SECONDS; beyond a few hundred MB of index, batch changes into
+fewer publishes.
+"""
+
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from array import array
+from contextlib import contextmanager
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from rag_analysis import Analyzer, get_analyzer
+from rag_ann import NUMPY_AVAILABLE, FrozenHNSW, embedding_norms
+from rag_quantization import encode_vectors, float_vectors, open_vectors
+from rag_index import FEATURE_KINDS, CorpusIndex, IndexReader
+
+try:
+    import fcntl
+    LOCKING_AVAILABLE = True
+except ImportError:
+    LOCKING_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MDRAGIX1"
+POINTER_FILE = "CURRENT"
+ROWS_MAGIC = b"MDRAGRW1"
+LOCK_FILE = "publish.lock"
+ALIGNMENT = 8
+
+# Document scopes (e.g. one client's documents) whose chunk id sets a snapshot keeps
+ALLOWED_SCOPES = 64
+
+
+def default_shared_dir() -> str:
+    """Prefer the RAM-backed /dev/shm so generations never touch disk"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "meddoc-rag")
+
+
+def default_rows_dir() -> str:
+    """Disk-backed directory for float32 re-rank rows, which should not sit in RAM"""
+    base = "/var/tmp" if os.path.isdir("/var/tmp") else tempfile.gettempdir()
+    return os.path.join(base, "meddoc-rag-rows")
+
+
+def _encode_strings(values: List[str]) -> Tuple[bytes, array]:
+    """Concatenate strings into one UTF-8 arena with an offsets array"""
+    offsets = array('Q', [0])
+    parts = []
+    total = 0
+    for value in values:
+        encoded = value.encode('utf-8')
+        parts.append(encoded)
+        total += len(encoded)
+        offsets.append(total)
+    return b"".join(parts), offsets
+
+
+def write_bundle(path: str, index: IndexReader, vector_codec: str = "float32",
+                 info: Optional[Dict] = None) -> List[str]:
+    """Write an index as a read-only bundle; returns the files written
+
+    With vector_codec "int8" or "pq" the graph is traversed over quantized codes
+    and the float32 rows only re-rank candidates, so they go to a path + ".rows"
+    file next to the bundle (referenced relative to it) instead of doubling its
+    size. info is free-form metadata (e.g. how a bundle was built) exposed as
+    SnapshotView.info.
+    """
+    rows_path = f"{path}.rows" if vector_codec != "float32" else None
+    data, rows = encode_generation(index, 1, vector_codec, info=info,
+                                   rows_path=os.path.basename(rows_path) if rows_path else None)
+    written = []
+    if rows is not None:
+        write_snapshot(rows_path, rows)
+        written.append(rows_path)
+    write_snapshot(path, data)
+    return [path] + written
+
+
+def encode_generation(index: IndexReader, generation: int, vector_codec: str = "float32",
+                      codebook: Optional[Tuple[Dict, object]] = None, info: Optional[Dict] = None,
+                      rows_path: Optional[str] = None) -> Tuple[bytes, Optional[bytes]]:
+    """Generation bytes, and the rows file bytes when the float32 rows are split off
+
+    With rows_path and a quantized codec the embeddings and their norms are left
+    out of the generation, which records rows_path instead (a relative path is
+    resolved against the generation's directory); the caller writes the returned
+    rows bytes there before publishing.
+    """
+    doc_ids = list(index.documents)
+    chunk_texts: List[str] = []
+    chunk_embeddings: List[Optional[List[float]]] = []
+    # Feature spans as (kind, start, end) triplets; chunks without features keep an empty range
+    feature_offsets = array('Q', [0])
+    feature_spans = array('I')
+    # Token (start, end) character offsets per chunk, for passages and highlights
+    token_offsets = array('Q', [0])
+    token_spans = array('I')
+    doc_chunk_bounds = array('I', [0])
+    chunk_renumber: Dict[int, int] = {}
+    for doc_id in doc_ids:
+        for old_id in index.get_chunk_ids(doc_id):
+            chunk_renumber[old_id] = len(chunk_texts)
+            chunk_texts.append(index.get_chunk_text(old_id))
+            chunk_embeddings.append(index.get_embedding(old_id))
+            features = index.get_chunk_features(old_id) or {}
+            for kind_id, kind in enumerate(FEATURE_KINDS):
+                for start, end in features.get(kind, []):
+                    feature_spans.extend((kind_id, start, end))
+            feature_offsets.append(len(feature_spans) // 3)
+            token_spans.extend(index.get_token_offsets(old_id))
+            token_offsets.append(len(token_spans))
+        doc_chunk_bounds.append(len(chunk_texts))
+
+    vocabulary = sorted(index.vocabulary(), key=lambda term: term.encode('utf-8'))
+    posting_offsets = array('Q', [0])
+    posting_chunks = array('I')
+    position_offsets = array('Q', [0])
+    positions = array('I')
+    for term in vocabulary:
+        for old_id, term_positions in sorted(index.postings(term)):
+            posting_chunks.append(chunk_renumber[old_id])
+            positions.extend(term_positions)
+            position_offsets.append(len(positions))
+        posting_offsets.append(len(posting_chunks))
+
+    # Chunks without a vector get a zero row and a cleared presence flag
+    dim = next((len(vector) for vector in chunk_embeddings if vector is not None), 0)
+    embeddings = array('f')
+    embedding_flags = bytearray(len(chunk_embeddings) if dim else 0)
+    if dim:
+        for position, vector in enumerate(chunk_embeddings):
+            if vector is None:
+                embeddings.extend([0.0] * dim)
+            else:
+                embeddings.extend(vector)
+                embedding_flags[position] = 1
+
+    content_arena, content_offsets = _encode_strings([index.get_content(d) or "" for d in doc_ids])
+    chunk_arena, chunk_offsets = _encode_strings(chunk_texts)
+    vocab_arena, vocab_offsets = _encode_strings(vocabulary)
+
+    sections = [
+        ("content_arena", content_arena, 'B'),
+        ("content_offsets", content_offsets, 'Q'),
+        ("chunk_arena", chunk_arena, 'B'),
+        ("chunk_offsets", chunk_offsets, 'Q'),
+        ("doc_chunk_bounds", doc_chunk_bounds, 'I'),
+        ("vocab_arena", vocab_arena, 'B'),
+        ("vocab_offsets", vocab_offsets, 'Q'),
+        ("posting_offsets", posting_offsets, 'Q'),
+        ("posting_chunks", posting_chunks, 'I'),
+        ("position_offsets", position_offsets, 'Q'),
+        ("positions", positions, 'I'),
+        ("embeddings", embeddings, 'f'),
+        ("embedding_flags", bytes(embedding_flags), 'B'),
+        ("feature_offsets", feature_offsets, 'Q'),
+        ("feature_spans", feature_spans, 'I'),
+        ("token_offsets", token_offsets, 'Q'),
+        ("token_spans", token_spans, 'I'),
+    ]
+
+    # The ANN graph is stored as links over the new chunk ids; its vectors are the
+    # embeddings section above, with per-row norms for cosine scoring
+    ann_meta = None
+    ann = getattr(index, "ann", None)
+    if dim and ann is not None and hasattr(ann, "export"):
+        ann_meta, ann_sections = ann.export(chunk_renumber, len(chunk_texts))
+        sections.append(("ann_norms", embedding_norms(embeddings, dim), 'f'))
+        sections.extend((name, data, data.typecode) for name, data in ann_sections.items())
+
+    vector_meta = None
+    rows = None
+    if ann_meta is not None and vector_codec != "float32":
+        vector_meta, vector_sections = encode_vectors(embeddings, dim, vector_codec, codebook)
+        sections.extend(vector_sections)
+        if rows_path is not None:
+            rows = [section for section in sections if section[0] in ROW_SECTIONS]
+            sections = [section for section in sections if section[0] not in ROW_SECTIONS]
+
+    layout, body = _layout(sections)
+    rows_meta = None
+    rows_data = None
+    if rows is not None:
+        rows_layout, rows_body = _layout(rows)
+        rows_meta = {"path": rows_path, "generation": generation, "sections": rows_layout}
+        rows_data = ROWS_MAGIC + struct.pack('<Q', generation) + rows_body
+
+    header = json.dumps({
+        "generation": generation,
+        "doc_ids": doc_ids,
+        "documents": [index.documents[d] for d in doc_ids],
+        "embedding_dim": dim,
+        "analyzer": index.analyzer.name,
+        "ann": ann_meta,
+        "vectors": vector_meta,
+        "rows": rows_meta,
+        "info": info or {},
+        "sections": layout,
+    }).encode('utf-8')
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % ALIGNMENT)
+    return MAGIC + struct.pack('<I', len(header)) + header + body, rows_data
+
+
+# Sections moved to the rows file of a quantized generation
+ROW_SECTIONS = ("embeddings", "ann_norms")
+
+
+def _layout(sections: List[Tuple]) -> Tuple[Dict, bytes]:
+    """Section table (name -> [offset, length, typecode]) and the aligned concatenated body"""
+    layout = {}
+    blobs = []
+    offset = 0
+    for name, data, typecode in sections:
+        raw = data if isinstance(data, bytes) else data.tobytes()
+        layout[name] = [offset, len(raw), typecode]
+        padding = -len(raw) % ALIGNMENT
+        blobs.append(raw + b"\0" * padding)
+        offset += len(raw) + padding
+    return layout, b"".join(blobs)
+
+
+def _section(body: memoryview, offset: int, length: int, typecode: str):
+    section = body[offset:offset + length]
+    return section if typecode == 'B' else section.cast(typecode)
+
+
+class SnapshotView(IndexReader):
+    """Read-only index over a mapped generation; nothing is copied out except decoded strings"""
+
+    def __init__(self, buffer, source: str = ""):
+        view = memoryview(buffer)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a RAG index generation: {source}")
+        (header_len,) = struct.unpack_from('<I', view, len(MAGIC))
+        body_start = len(MAGIC) + 4 + header_len
+        header = json.loads(bytes(view[len(MAGIC) + 4:body_start]))
+
+        self._buffer = buffer
+        self.source = source
+        self.generation = header["generation"]
+        self.info: Dict = header.get("info", {})
+        self.embedding_dim = header["embedding_dim"]
+        # Queries must be analysed the same way the generation was indexed
+        self.analyzer = get_analyzer(header.get("analyzer", "whitespace"))
+        self._doc_ids: List[str] = header["doc_ids"]
+        self.documents: Dict[str, Dict] = dict(zip(self._doc_ids, header["documents"]))
+        self._doc_positions = {doc_id: i for i, doc_id in enumerate(self._doc_ids)}
+
+        body = view[body_start:]
+        self._sections = {name: _section(body, *entry) for name, entry in header["sections"].items()}
+        self._rows_buffer = None
+        self._allowed_sets: Dict[Tuple[str, ...], frozenset] = {}
+        if header.get("rows"):
+            self._attach_rows(header["rows"])
+
+        self.vector_meta = header.get("vectors")
+        if header.get("ann") and NUMPY_AVAILABLE:
+            exact = float_vectors(self._sections["embeddings"], self._sections["ann_norms"],
+                                  self.embedding_dim)
+            vectors = open_vectors(self.vector_meta, self._sections, self.embedding_dim, exact)
+            self.ann = FrozenHNSW(header["ann"], self._sections, vectors, exact)
+
+    def _attach_rows(self, rows: Dict):
+        """Map the float32 rows file of a quantized generation; pages load when re-ranking touches them"""
+        path = os.path.join(os.path.dirname(os.path.abspath(self.source)), rows["path"])
+        with open(path, 'rb') as handle:
+            self._rows_buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._rows_buffer)
+        prefix = len(ROWS_MAGIC) + 8
+        if bytes(view[:len(ROWS_MAGIC)]) != ROWS_MAGIC \
+                or struct.unpack_from('<Q', view, len(ROWS_MAGIC))[0] != rows["generation"]:
+            raise ValueError(f"{path} does not hold the rows of generation {rows['generation']}")
+        body = view[prefix:]
+        self._sections.update((name, _section(body, *entry)) for name, entry in rows["sections"].items())
+
+    def _decode(self, arena: str, offsets: str, position: int) -> str:
+        bounds = self._sections[offsets]
+        return bytes(self._sections[arena][bounds[position]:bounds[position + 1]]).decode('utf-8')
+
+    def get_content(self, doc_id: str) -> Optional[str]:
+        position = self._doc_positions.get(doc_id)
+        if position is None:
+            return None
+        return self._decode("content_arena", "content_offsets", position)
+
+    def get_chunk_ids(self, doc_id: str) -> range:
+        position = self._doc_positions.get(doc_id)
+        if position is None:
+            return range(0)
+        bounds = self._sections["doc_chunk_bounds"]
+        return range(bounds[position], bounds[position + 1])
+
+    def _allowed_chunks(self, doc_ids: Optional[Iterable[str]]) -> Optional[frozenset]:
+        """Chunk ids of a document scope, built once per scope since a snapshot never changes"""
+        if doc_ids is None:
+            return None
+        scope = tuple(doc_ids)
+        allowed = self._allowed_sets.get(scope)
+        if allowed is None:
+            allowed = frozenset(chain.from_iterable(self.get_chunk_ids(doc_id) for doc_id in scope))
+            if len(self._allowed_sets) >= ALLOWED_SCOPES:
+                self._allowed_sets.clear()
+            self._allowed_sets[scope] = allowed
+        return allowed
+
+    def get_chunk_text(self, chunk_id: int) -> str:
+        return self._decode("chunk_arena", "chunk_offsets", chunk_id)
+
+    def chunk_doc_id(self, chunk_id: int) -> Optional[str]:
+        bounds = self._sections["doc_chunk_bounds"]
+        position = bisect.bisect_right(bounds, chunk_id) - 1
+        if 0 <= position < len(self._doc_ids):
+            return self._doc_ids[position]
+        return None
+
+    def chunk_id_limit(self) -> int:
+        return len(self._sections["chunk_offsets"]) - 1
+
+    def _term_position(self, term: str) -> Optional[int]:
+        """Binary search the sorted vocabulary arena"""
+        target = term.encode('utf-8')
+        arena = self._sections["vocab_arena"]
+        offsets = self._sections["vocab_offsets"]
+        low, high = 0, len(offsets) - 1
+        while low < high:
+            middle = (low + high) // 2
+            probe = bytes(arena[offsets[middle]:offsets[middle + 1]])
+            if probe < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(offsets) - 1 and bytes(arena[offsets[low]:offsets[low + 1]]) == target:
+            return low
+        return None
+
+    def postings(self, term: str) -> List[Tuple[int, Sequence[int]]]:
+        position = self._term_position(term)
+        if position is None:
+            return []
+        offsets = self._sections["posting_offsets"]
+        start, end = offsets[position], offsets[position + 1]
+        position_offsets = self._sections["position_offsets"]
+        positions = self._sections["positions"]
+        return [
+            (chunk_id, positions[position_offsets[entry]:position_offsets[entry + 1]])
+            for entry, chunk_id in enumerate(self._sections["posting_chunks"][start:end], start)
+        ]
+
+    def get_token_offsets(self, chunk_id: int) -> Sequence[int]:
+        offsets = self._sections["token_offsets"]
+        return self._sections["token_spans"][offsets[chunk_id]:offsets[chunk_id + 1]]
+
+    def vocabulary(self) -> List[str]:
+        count = len(self._sections["vocab_offsets"]) - 1
+        return [self._decode("vocab_arena", "vocab_offsets", i) for i in range(count)]
+
+    def get_embedding(self, chunk_id: int) -> Optional[List[float]]:
+        if not self.embedding_dim or not self._sections["embedding_flags"][chunk_id]:
+            return None
+        start = chunk_id * self.embedding_dim
+        return self._sections["embeddings"][start:start + self.embedding_dim].tolist()
+
+    def get_chunk_features(self, chunk_id: int) -> Dict[str, List[Tuple[int, int]]]:
+        offsets = self._sections["feature_offsets"]
+        spans = self._sections["feature_spans"]
+        features = {kind: [] for kind in FEATURE_KINDS}
+        for position in range(offsets[chunk_id], offsets[chunk_id + 1]):
+            kind_id, start, end = spans[3 * position:3 * position + 3]
+            features[FEATURE_KINDS[kind_id]].append((start, end))
+        return features
+
+    def codebook(self) -> Optional[Tuple[Dict, object]]:
+        """PQ metadata with the coarse and residual centroids, for the next generation to reuse"""
+        if self.ann is None or not self.vector_meta or self.vector_meta["codec"] != "pq":
+            return None
+        return self.vector_meta, (self.ann.vectors.coarse, self.ann.vectors.centroids)
+
+    def embedding_matrix(self):
+        """Zero-copy float32 view of all chunk embeddings (rows follow chunk ids)"""
+        return self._sections["embeddings"]
+
+
+def open_snapshot(path: str) -> SnapshotView:
+    """Map a generation or bundle file read-only; pages load on first touch"""
+    with open(path, 'rb') as handle:
+        mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+    return SnapshotView(mapped, source=path)
+
+
+def write_snapshot(path: str, data: bytes):
+    """Write a generation or bundle file atomically (temp file + rename)"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(data)
+    os.replace(temp_path, path)
+
+
+class SharedIndex:
+    """Publishes and attaches index generations in a shared directory"""
+
+    def __init__(self, directory: Optional[str] = None, analyzer: Optional[Analyzer] = None,
+                 ann_params: Optional[Dict] = None, vector_codec: str = "float32",
+                 rows_directory: Optional[str] = None):
+        self.directory = directory or default_shared_dir()
+        self.analyzer = analyzer
+        self.ann_params = ann_params
+        self.vector_codec = vector_codec
+        self.rows_directory = rows_directory or default_rows_dir()
+        os.makedirs(self.directory, exist_ok=True)
+        if vector_codec != "float32":
+            os.makedirs(self.rows_directory, exist_ok=True)
+        self._pointer_path = os.path.join(self.directory, POINTER_FILE)
+        self._view: Optional[SnapshotView] = None
+        self._pointer_stamp = None
+        self._attach_lock = threading.Lock()
+        # Mutable copy of the generation this instance published last, reused while no one else publishes
+        self._writer_id = uuid.uuid4().hex
+        self._writer: Optional[CorpusIndex] = None
+
+    @contextmanager
+    def _publish_lock(self):
+        """Serialise writers across processes so there is one publisher per generation"""
+        with open(os.path.join(self.directory, LOCK_FILE), 'a') as lock_file:
+            if LOCKING_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if LOCKING_AVAILABLE:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_pointer(self) -> Dict:
+        try:
+            with open(self._pointer_path, 'r') as pointer:
+                return json.load(pointer)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _generation_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"generation-{generation}.idx")
+
+    def _rows_path(self, generation: int) -> str:
+        # Named after the generation directory too, so several shared indexes can share rows_directory
+        name = os.path.basename(os.path.normpath(self.directory))
+        return os.path.abspath(os.path.join(self.rows_directory, f"{name}-generation-{generation}.rows"))
+
+    def current(self) -> Optional[SnapshotView]:
+        """Return the latest generation, re-attaching only when the pointer changed"""
+        try:
+            stat = os.stat(self._pointer_path)
+        except FileNotFoundError:
+            return None
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._pointer_stamp and self._view is not None:
+            return self._view
+
+        with self._attach_lock:
+            if stamp != self._pointer_stamp or self._view is None:
+                pointer = self._read_pointer()
+                if pointer:
+                    try:
+                        self._view = self._attach(pointer["generation"])
+                        self._pointer_stamp = stamp
+                        if pointer.get("writer") != self._writer_id:
+                            # Another worker published; the kept writer copy is stale
+                            self._writer = None
+                    except FileNotFoundError:
+                        # Superseded between reading the pointer and opening it; retry next call
+                        logger.warning(f"Generation {pointer['generation']} vanished before attach")
+        return self._view
+
+    def _attach(self, generation: int) -> SnapshotView:
+        view = open_snapshot(self._generation_path(generation))
+        logger.info(f"Attached shared index generation {generation} ({len(view._buffer)} bytes)")
+        return view
+
+    def update(self, mutate: Callable[[CorpusIndex], None]) -> int:
+        """Apply a mutation on top of the latest generation and publish the result
+
+        The mutable index this instance published last is kept and mutated in place
+        while the pointer still names that publish, so a run of ingests by one worker
+        costs only the changed documents plus serialisation. When another worker
+        published in between (or removals have tombstoned more graph nodes than are
+        live) it is rebuilt from the shared generation, which re-analyses every
+        chunk: O(corpus), at most once per change of publishing worker. Encoding the
+        new generation is O(corpus) on every call.
+        """
+        with self._publish_lock():
+            pointer = self._read_pointer()
+            latest = pointer.get("generation", 0)
+            index = self._writer_for(pointer)
+            codebook = None
+            if latest and (index is None or self.vector_codec == "pq"):
+                previous = self._attach(latest)
+                codebook = previous.codebook()
+                if index is None:
+                    logger.info(f"Rebuilding the writer index from shared generation {latest}")
+                    index = CorpusIndex.from_reader(previous, self.ann_params)
+            index = index or CorpusIndex(self.analyzer, self.ann_params)
+            # _writer stays cleared while mutating: a failed mutation may leave the index half changed
+            mutate(index)
+            generation = latest + 1
+            rows_path = self._rows_path(generation) if self.vector_codec != "float32" else None
+            data, rows = encode_generation(index, generation, self.vector_codec, codebook, rows_path=rows_path)
+            if rows is not None:
+                write_snapshot(rows_path, rows)
+            self._write_generation(data, generation)
+            index.generation = generation
+            self._writer = index
+            # Keep the previous generation around for readers that are mid-attach
+            for stale in (self._generation_path(latest - 1), self._rows_path(latest - 1)):
+                if latest > 1 and os.path.exists(stale):
+                    os.unlink(stale)
+            return generation
+
+    def _writer_for(self, pointer: Dict) -> Optional[CorpusIndex]:
+        """The kept writer index when the latest generation is still this instance's publish"""
+        index = self._writer
+        # Anything else is released at once so at most the shared copy stays resident
+        self._writer = None
+        if index is None or pointer.get("writer") != self._writer_id or pointer.get("generation") != index.generation:
+            return None
+        if index.ann is not None and index.ann.tombstoned() > len(index.ann):
+            return None
+        return index
+
+    def _write_generation(self, data: bytes, generation: int):
+        write_snapshot(self._generation_path(generation), data)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as handle:
+            json.dump({"generation": generation, "size": len(data), "writer": self._writer_id}, handle)
+        os.replace(temp_path, self._pointer_path)
+        logger.info(f"Published shared index generation {generation} ({len(data)} bytes)")
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Build a read-only index bundle for vercel_rag_server.py
+Extracts, chunks and indexes documents ahead of deployment and writes them as one
+mmap-able file: document metadata and text, chunks, positional postings and,
+with --embed, chunk embeddings plus their HNSW graph. Ship the file with the
+deployment and point RAG_INDEX_BUNDLE at it (or name it rag_bundle.idx next to
+the server); cold instances then answer without ingest or database round trips.
+With --vector-codec int8 or pq the float32 re-rank rows go to <output>.rows, which
+must ship next to the bundle.
+
+Usage:
+    python scripts/build_index_bundle.py --input-dir ./docs --client-id 42 --output rag_bundle.idx
+    python scripts/build_index_bundle.py --supabase --client-id 42 --output rag_bundle.idx --embed
+    python scripts/build_index_bundle.py --manifest bundle.json --output rag_bundle.idx
+
+A manifest is a JSON list of {"path", "document_id", "title", "client_id"} objects.
+"""
+
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import advanced_rag_server as server  # noqa: E402
+from rag_embedding_cache import EmbeddingCache  # noqa: E402
+from rag_quantization import VECTOR_CODECS  # noqa: E402
+from rag_shared_index import open_snapshot, write_bundle  # noqa: E402
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_BATCH = 64
+# Chunks embedded by an earlier build or script are reused (RAG_EMBEDDING_CACHE=0 disables)
+embedding_cache = EmbeddingCache.from_environment()
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".doc", ".txt")
+
+logger = logging.getLogger("build_index_bundle")
+
+
+def local_documents(directory: str, client_id: Optional[str]) -> Iterator[Tuple[Dict, bytes]]:
+    """Every supported file under a directory; the file name is the title, its stem the id"""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as handle:
+                content = handle.read()
+            yield {"document_id": os.path.splitext(name)[0], "title": name, "source": path,
+                   "client_id": client_id}, content
+
+
+def manifest_documents(manifest: str) -> Iterator[Tuple[Dict, bytes]]:
+    base = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as handle:
+        entries = json.load(handle)
+    for entry in entries:
+        path = os.path.join(base, entry["path"])
+        with open(path, 'rb') as handle:
+            content = handle.read()
+        yield {"document_id": str(entry.get("document_id") or os.path.splitext(os.path.basename(path))[0]),
+               "title": entry.get("title") or os.path.basename(path), "source": path,
+               "client_id": entry.get("client_id")}, content
+
+
+def supabase_documents(client_id: Optional[str]) -> Iterator[Tuple[Dict, bytes]]:
+    """Documents rows (optionally of one client) with their files from Supabase storage"""
+    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
+        raise SystemExit("SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set for --supabase")
+    headers = {"apikey": SUPABASE_SERVICE_ROLE_KEY, "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"}
+    params = {"select": "id,title,file_path,client_id,category,date"}
+    if client_id:
+        params["client_id"] = f"eq.{client_id}"
+    response = requests.get(f"{SUPABASE_URL}/rest/v1/documents", headers=headers, params=params, timeout=30)
+    response.raise_for_status()
+    for row in response.json():
+        file_path = row.get("file_path")
+        if not file_path:
+            logger.warning(f"Document {row['id']} has no file_path, skipped")
+            continue
+        if file_path.startswith("http"):
+            url = file_path
+        else:
+            url = f"{SUPABASE_URL}/storage/v1/object/public/{file_path[len('public/'):] if file_path.startswith('public/') else file_path}"
+        download = requests.get(url, timeout=60)
+        if download.status_code != 200:
+            logger.warning(f"Could not download {url} ({download.status_code}), skipped")
+            continue
+        yield {"document_id": str(row["id"]), "title": row.get("title") or os.path.basename(file_path),
+               "source": url, "client_id": row.get("client_id"), "category": row.get("category"),
+               "date": row.get("date")}, download.content
+
+
+def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Chunk embeddings from the embedding cache, the rest from the OpenAI embeddings API"""
+    if embedding_cache is not None:
+        return embedding_cache.embed(EMBEDDING_MODEL, texts, request_embeddings)
+    return request_embeddings(texts)
+
+
+def request_embeddings(texts: List[str]) -> List[List[float]]:
+    """Embeddings from the OpenAI embeddings API, in batches"""
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH):
+        response = requests.post(
+            "https://api.openai.com/v1/embeddings",
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
+            json={"input": texts[start:start + EMBEDDING_BATCH], "model": EMBEDDING_MODEL},
+            timeout=60,
+        )
+        response.raise_for_status()
+        vectors.extend(item["embedding"] for item in sorted(response.json()["data"], key=lambda item: item["index"]))
+    return vectors
+
+
+def index_document(meta: Dict, content: bytes, embed: bool) -> bool:
+    """Extract, chunk and index one document into the build corpus"""
+    content_type = mimetypes.guess_type(meta["source"])[0] or 'unknown'
+    extra = {"client_id": str(meta["client_id"]) if meta.get("client_id") is not None else None}
+    extra.update({key: meta[key] for key in ("category", "date") if meta.get(key)})
+    doc_info, text = server.process_document(meta["document_id"], meta["title"], meta["source"], content,
+                                             content_type, extra)
+    if doc_info is None:
+        logger.warning(f"Skipped {meta['title']}: {text}")
+        return False
+    if embed:
+        # The chunks indexed above get their vectors in place; nothing is analysed twice
+        corpus = server.corpus
+        chunks = [corpus.get_chunk_text(chunk_id) for chunk_id in corpus.get_chunk_ids(meta["document_id"])]
+        corpus.set_embeddings(meta["document_id"], embed_texts(chunks))
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build a read-only RAG index bundle for serverless deployment")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input-dir", help="index every PDF/DOCX/TXT file under this directory")
+    source.add_argument("--manifest", help="JSON list of documents to index")
+    source.add_argument("--supabase", action="store_true", help="index documents from Supabase")
+    parser.add_argument("--client-id", help="client the documents belong to (filters --supabase)")
+    parser.add_argument("--output", default="rag_bundle.idx")
+    parser.add_argument("--embed", action="store_true", help="store OpenAI chunk embeddings and an HNSW graph")
+    parser.add_argument("--vector-codec", choices=VECTOR_CODECS, default="float32")
+    args = parser.parse_args()
+
+    if args.embed and not OPENAI_API_KEY:
+        print("Error: OPENAI_API_KEY environment variable is not set (needed for --embed)")
+        return 1
+    if server.shared_index is not None:
+        print("Error: unset RAG_SHARED_INDEX; the bundle is built from a private corpus")
+        return 1
+
+    if args.input_dir:
+        documents = local_documents(args.input_dir, args.client_id)
+    elif args.manifest:
+        documents = manifest_documents(args.manifest)
+    else:
+        documents = supabase_documents(args.client_id)
+
+    started = time.perf_counter()
+    indexed = skipped = 0
+    for meta, content in documents:
+        if index_document(meta, content, args.embed):
+            indexed += 1
+        else:
+            skipped += 1
+    if not indexed:
+        print("No documents indexed; bundle not written")
+        return 1
+
+    info = {
+        "kind": "bundle",
+        "built_at": datetime.now().isoformat(),
+        "client_id": args.client_id,
+        "documents": indexed,
+        "embedding_model": EMBEDDING_MODEL if args.embed else None,
+    }
+    written = write_bundle(args.output, server.corpus, args.vector_codec, info=info)
+
+    # Read the bundle back the way the server will, as a check
+    bundle = open_snapshot(args.output)
+    print(f"Wrote {args.output}: {len(bundle.documents)} documents, {bundle.chunk_id_limit()} chunks, "
+          f"{sum(os.path.getsize(path) for path in written)} bytes in {time.perf_counter() - started:.1f}s "
+          f"({skipped} skipped)")
+    if args.embed and embedding_cache is not None:
+        print(f"Embedding cache: {embedding_cache.stats()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,15 @@
 import os
+import sys
 import requests
 import io
+import hashlib
 from pdfminer.high_level import extract_text
-from typing import List
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag_download import response_version  # noqa: E402
+from rag_extraction_cache import Extraction, ExtractionCache, storage_path  # noqa: E402
 
 # Automatisch ingevulde Supabase gegevens
 SUPABASE_URL = os.environ.get("SUPABASE_URL", "https://ltasjbgamoljvqoclgkf.supabase.co")
@@ -18,6 +25,35 @@ headers = {
     "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}"
 }
 
+# Gedeelde extractiecache met de RAG servers (RAG_EXTRACTION_CACHE_DIR)
+cache = ExtractionCache.from_environment()
+
+def parse_pdf(pdf_url: str, content: bytes, etag: Optional[str]) -> str:
+    """Tekst van een PDF uit de cache, of met pdfminer geparsed en in de cache opgeslagen."""
+    if cache is None:
+        return extract_text(io.BytesIO(content))
+    content_hash = hashlib.sha256(content).hexdigest()
+    extraction = cache.get(content_hash)
+    if extraction is None:
+        with cache.parsing(content_hash):
+            extraction = cache.get(content_hash)
+            if extraction is None:
+                # pdfminer scheidt pagina's met een form feed
+                pages = extract_text(io.BytesIO(content)).split("\f")
+                extraction = Extraction.from_pages((page + "\n" for page in pages), parser="pdfminer",
+                                                   file_format="pdf", file_size=len(content),
+                                                   content_type="application/pdf")
+                cache.put(content_hash, extraction)
+    cache.link(storage_path(pdf_url), etag, len(content), content_hash)
+    return extraction.text
+
+def cached_text(pdf_url: str, response: requests.Response) -> Optional[str]:
+    """Tekst van een eerder geparste versie van dit storage object, herkend aan de headers van de download."""
+    if cache is None:
+        return None
+    found = cache.lookup(storage_path(pdf_url), *response_version(response.headers))
+    return found[1].text if found is not None else None
+
 def extract_documents() -> List[dict]:
     """Haalt documenten zonder content op, parseert PDF's, en werkt records bij."""
     res = requests.get(
@@ -41,18 +77,21 @@ def extract_documents() -> List[dict]:
             else:
                 pdf_url = f"{SUPABASE_URL}/storage/v1/object/public/{file_path}"
         print(f"Probeer te downloaden: {pdf_url}")
-        pdf_res = requests.get(pdf_url)
-        if pdf_res.status_code != 200:
-            print(f"Kan PDF niet downloaden: {pdf_url}")
-            continue
-
-        # Tekst extraheren
-        pdf_bytes = io.BytesIO(pdf_res.content)
-        try:
-            text = extract_text(pdf_bytes)
-        except Exception as e:
-            print(f"Fout bij extractie: {e}")
-            continue
+        # De body wordt pas gelezen als de cache deze versie (ETag + grootte) nog niet kent
+        with requests.get(pdf_url, stream=True) as pdf_res:
+            if pdf_res.status_code != 200:
+                print(f"Kan PDF niet downloaden: {pdf_url}")
+                continue
+            text = cached_text(pdf_url, pdf_res)
+            if text is None:
+                # Tekst extraheren (of uit de cache als dezelfde bytes al geparsed zijn)
+                try:
+                    text = parse_pdf(pdf_url, pdf_res.content, pdf_res.headers.get("etag"))
+                except Exception as e:
+                    print(f"Fout bij extractie: {e}")
+                    continue
+            else:
+                print(f"Tekst uit de extractiecache: {pdf_url}")
 
         # Bijwerken van Supabase record
         update_res = requests.patch(
@@ -0,0 +1,63 @@
+-- Chunk-level embeddings: one row per chunk instead of one vector per document,
+-- so similarity search covers the whole text and not just its first 8000 characters.
+-- Written by scripts/generate_embeddings.py (rag_chunk_store.PgVectorChunkStore).
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS public.document_chunks (
+  document_id UUID NOT NULL REFERENCES public.documents(id) ON DELETE CASCADE,
+  chunk_index INT NOT NULL,
+  content TEXT NOT NULL,
+  content_hash TEXT NOT NULL,
+  embedding_model TEXT NOT NULL,
+  embedding vector(1536) NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (document_id, chunk_index)
+);
+
+-- Top-k search walks this graph instead of scanning every chunk (pgvector >= 0.5)
+CREATE INDEX IF NOT EXISTS document_chunks_embedding_idx ON public.document_chunks
+USING hnsw (embedding vector_cosine_ops);
+
+-- Chunks carry document text, so they are visible only to the owner of their document
+ALTER TABLE public.document_chunks ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view chunks of their own documents"
+ON public.document_chunks FOR SELECT
+USING (auth.uid() IN (SELECT user_id FROM public.documents WHERE id = document_id));
+
+-- Most similar chunks, optionally of one client; runs as the caller so the RLS above applies.
+-- The client, deleted and RLS filters apply after the HNSW scan, which yields at most
+-- hnsw.ef_search candidates, so the scan is widened to 400; a filter matching fewer
+-- chunks near the query still returns fewer than match_count rows.
+CREATE OR REPLACE FUNCTION match_document_chunks (
+  query_embedding vector(1536),
+  match_count int,
+  client_id_filter uuid DEFAULT NULL
+)
+RETURNS TABLE (
+  document_id uuid,
+  chunk_index int,
+  content text,
+  title text,
+  similarity float
+)
+LANGUAGE sql STABLE SECURITY INVOKER
+SET hnsw.ef_search = 400
+AS $$
+  SELECT
+    c.document_id,
+    c.chunk_index,
+    c.content,
+    d.title,
+    1 - (c.embedding <=> query_embedding) AS similarity
+  FROM public.document_chunks c
+  JOIN public.documents d ON d.id = c.document_id
+  WHERE d.deleted_at IS NULL
+    AND (client_id_filter IS NULL OR d.client_id = client_id_filter)
+  ORDER BY c.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
+
+GRANT SELECT ON public.document_chunks TO authenticated;
+GRANT EXECUTE ON FUNCTION match_document_chunks TO authenticated;
@@ -7,12 +7,21 @@ Lightweight version without heavy ML dependencies for Vercel deployment.
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
-import requests
-import tempfile
 from datetime import datetime
 import logging
 import json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+import rag_capabilities
+from rag_document_table import DocumentTable
+from rag_download import TEXT_ERRORS, DownloadRejected, StreamedDownload, stream_download
+from rag_extraction_cache import Extraction, ExtractionCache, storage_path
+from rag_shared_index import SnapshotView, open_snapshot
+
+# Imported on first use, so a cold start only loads Flask
+PyPDF2 = rag_capabilities.lazy_module("pdf")
+docx = rag_capabilities.lazy_module("docx")
+openai = rag_capabilities.lazy_module("openai")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +33,44 @@ CORS(app)
 # In-memory storage for documents (in production, use Supabase)
 documents_store = {}
 document_contents = {}
+# Bumped on every change of documents_store, so /documents re-syncs its table only then
+documents_version = 0
+document_table = DocumentTable(derived=False)
+
+# Largest page /documents returns when a limit is given
+DOCUMENT_PAGE_LIMIT = int(os.environ.get('RAG_DOCUMENT_PAGE_LIMIT', 1000))
+
+# Precomputed read-only index (scripts/build_index_bundle.py) shipped with the
+# deployment; mapped at cold start so /chat works without any ingest
+INDEX_BUNDLE_PATH = os.environ.get('RAG_INDEX_BUNDLE',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rag_bundle.idx'))
+# Chunks of bundle context sent to the LLM per question
+BUNDLE_CONTEXT_CHUNKS = 5
+# Also retrieve by question embedding when the bundle holds chunk embeddings (one extra OpenAI call)
+BUNDLE_SEMANTIC = bool(os.environ.get('RAG_BUNDLE_SEMANTIC'))
+
+def load_bundle(path: str) -> Optional[SnapshotView]:
+    if not os.path.exists(path):
+        return None
+    try:
+        started = datetime.now()
+        view = open_snapshot(path)
+        logger.info(f"Mapped index bundle {path}: {len(view.documents)} documents "
+                    f"in {(datetime.now() - started).total_seconds() * 1000:.1f}ms")
+        return view
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not load index bundle {path}: {e}")
+        return None
+
+bundle = load_bundle(INDEX_BUNDLE_PATH)
+# Bundled document ids per client, built once since the bundle never changes
+bundle_clients: Dict[str, List[str]] = {}
+for bundled_id, bundled_info in (bundle.documents.items() if bundle is not None else ()):
+    bundle_clients.setdefault(str(bundled_info.get('client_id')), []).append(bundled_id)
+
+# Extraction results shared with the other servers and scripts (RAG_EXTRACTION_CACHE_DIR,
+# a private directory under /tmp by default, which a warm instance keeps between invocations)
+extraction_cache = ExtractionCache.from_environment()
 
 class LightweightDocumentProcessor:
     """Lightweight document processor without heavy dependencies"""
@@ -32,23 +79,23 @@ class LightweightDocumentProcessor:
     def extract_text_from_pdf(file_path: str) -> str:
         """Extract text from PDF file using PyPDF2"""
         try:
-            import PyPDF2
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text.strip()
+            return "".join(LightweightDocumentProcessor.extract_pages_from_pdf(file_path)).strip()
         except Exception as e:
             logger.error(f"Error extracting PDF text: {e}")
             return f"Error reading PDF: {str(e)}"
     
+    @staticmethod
+    def extract_pages_from_pdf(file_path: str) -> List[str]:
+        """Text of each PDF page; raises on unreadable files"""
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            return [page.extract_text() + "\n" for page in pdf_reader.pages]
+    
     @staticmethod
     def extract_text_from_docx(file_path: str) -> str:
         """Extract text from DOCX file using python-docx"""
         try:
-            from docx import Document as DocxDocument
-            doc = DocxDocument(file_path)
+            doc = docx.Document(file_path)
             text = ""
             for paragraph in doc.paragraphs:
                 text += paragraph.text + "\n"
@@ -61,7 +108,7 @@ class LightweightDocumentProcessor:
     def extract_text_from_txt(file_path: str) -> str:
         """Extract text from TXT file"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+            with open(file_path, 'r', encoding='utf-8', errors=TEXT_ERRORS) as file:
                 return file.read().strip()
         except Exception as e:
             logger.error(f"Error extracting TXT text: {e}")
@@ -70,17 +117,15 @@ class LightweightDocumentProcessor:
 class SimpleAnswerer:
     """Simple answer generator using OpenAI API directly"""
     
+    MODEL = "gpt-3.5-turbo"
+    MAX_TOKENS = 500
+    TEMPERATURE = 0.3
+    
     @staticmethod
-    def generate_answer(question: str, context: str, document_title: str = "") -> str:
-        """Generate answer using OpenAI API"""
-        try:
-            import openai
-            
-            # Set up OpenAI client
-            client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-            
-            # Create a simple prompt
-            prompt = f"""Based on the following document content, answer the user's question.
+    def build_messages(question: str, context: str, document_title: str = "") -> List[Dict]:
+        """Build the chat completion messages for a question and its document context"""
+        # Create a simple prompt
+        prompt = f"""Based on the following document content, answer the user's question.
 
 Document: {document_title}
 Content: {context[:2000]}  # Limit context size
@@ -89,14 +134,65 @@ Question: {question}
 
 Please provide a clear and helpful answer based on the document content. If the answer cannot be found in the content, say so."""
 
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on document content."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    @staticmethod
+    def build_group_messages(questions: List[str], context: str, document_title: str = "") -> List[Dict]:
+        """Messages answering several questions about the same context in one completion"""
+        numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+        prompt = f"""Based on the following document content, answer each of the user's questions.
+
+Document: {document_title}
+Content: {context[:2000]}
+
+Questions:
+{numbered}
+
+Reply with only a JSON object {{"answers": [...]}} holding one clear and helpful answer per question, in the same order. If an answer cannot be found in the content, say so in that answer."""
+
+        return [
+            {"role": "system", "content": "You are a helpful assistant that answers questions based on document content."},
+            {"role": "user", "content": prompt}
+        ]
+    
+    @staticmethod
+    def parse_group_answers(content: str, count: int) -> Optional[List[str]]:
+        """Answers of a grouped completion, or None when it did not return count of them"""
+        start, end = content.find("{"), content.rfind("}")
+        try:
+            answers = json.loads(content[start:end + 1])["answers"] if start >= 0 else None
+        except (ValueError, KeyError, TypeError):
+            return None
+        if not isinstance(answers, list) or len(answers) != count:
+            return None
+        return [str(answer).strip() for answer in answers]
+    
+    @staticmethod
+    def embed_question(question: str) -> Optional[List[float]]:
+        """Question embedding with the bundle's embedding model, or None on failure"""
+        try:
+            client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            response = client.embeddings.create(model=bundle.info.get("embedding_model"), input=question)
+            return response.data[0].embedding
+        except Exception as e:
+            logger.error(f"Error embedding question: {e}")
+            return None
+    
+    @staticmethod
+    def generate_answer(question: str, context: str, document_title: str = "") -> str:
+        """Generate answer using OpenAI API"""
+        try:
+            # Set up OpenAI client
+            client = openai.OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+            
             response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that answers questions based on document content."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.3
+                model=SimpleAnswerer.MODEL,
+                messages=SimpleAnswerer.build_messages(question, context, document_title),
+                max_tokens=SimpleAnswerer.MAX_TOKENS,
+                temperature=SimpleAnswerer.TEMPERATURE
             )
             
             return response.choices[0].message.content.strip()
@@ -105,6 +201,38 @@ Please provide a clear and helpful answer based on the document content. If the
             logger.error(f"Error generating answer: {e}")
             return f"I apologize, but I encountered an error while processing your question. Please try again later. Error: {str(e)}"
 
+def bundle_client_documents(client_id: Optional[str]) -> Optional[List[str]]:
+    """Bundled document ids visible to a client; None (the whole bundle) without a client"""
+    if not client_id:
+        return None
+    return bundle_clients.get(str(client_id), [])
+
+def bundle_context(question: str, doc_ids: Optional[List[str]], titled: bool = False) -> str:
+    """Best matching bundle chunks for a question, as LLM context; doc_ids None searches unfiltered"""
+    chunk_ids = [hit["chunk_id"] for hit in bundle.search_hits(question, BUNDLE_CONTEXT_CHUNKS, doc_ids)]
+    if BUNDLE_SEMANTIC and bundle.embedding_dim and bundle.info.get("embedding_model"):
+        vector = SimpleAnswerer.embed_question(question)
+        if vector is not None:
+            for _, chunk_id in bundle.semantic_search(vector, BUNDLE_CONTEXT_CHUNKS, doc_ids):
+                if chunk_id not in chunk_ids:
+                    chunk_ids.append(chunk_id)
+    if not chunk_ids and doc_ids is not None and len(doc_ids) == 1:
+        # Nothing matched: the start of the document is the best context there is
+        return bundle.get_content(doc_ids[0]) or ""
+    parts = []
+    for chunk_id in chunk_ids:
+        text = bundle.get_chunk_text(chunk_id)
+        if titled:
+            text = f"Document: {bundle.documents[bundle.chunk_doc_id(chunk_id)]['title']}\n{text}"
+        parts.append(text)
+    return "\n\n".join(parts)
+
+def all_documents() -> Dict[str, Dict]:
+    """Bundled documents overlaid with those ingested into this instance"""
+    documents = dict(bundle.documents) if bundle is not None else {}
+    documents.update(documents_store)
+    return documents
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -112,8 +240,16 @@ def health_check():
         "status": "healthy",
         "message": "Vercel RAG Server is running",
         "timestamp": datetime.now().isoformat(),
-        "documents_count": len(documents_store),
-        "version": "lightweight-1.0"
+        "documents_count": len(all_documents()),
+        "version": "lightweight-1.0",
+        "capabilities": rag_capabilities.report(),
+        "index_bundle": {
+            "path": bundle.source,
+            "documents": len(bundle.documents),
+            "chunks": bundle.chunk_id_limit(),
+            "embeddings": bool(bundle.embedding_dim),
+            "built_at": bundle.info.get("built_at")
+        } if bundle is not None else None
     })
 
 @app.route('/ingest', methods=['POST'])
@@ -127,74 +263,101 @@ def ingest_document():
         file_url = data.get('file_url')
         document_id = data.get('document_id')
         title = data.get('title', 'Unknown Document')
-        client_id = data.get('client_id')
+        # Stored as text so /documents?client_id= and chat filters match JSON numbers too
+        client_id = str(data['client_id']) if data.get('client_id') is not None else None
         
         if not file_url or not document_id:
             return jsonify({"error": "file_url and document_id are required"}), 400
         
         logger.info(f"Processing document: {title} (ID: {document_id})")
         
-        # Download and process the document
-        response = requests.get(file_url, timeout=30)
-        response.raise_for_status()
+        # Stream to a temporary file; the first bytes decide the parser, not the title. A storage
+        # object version parsed before is recognised from the response headers and its body skipped
+        lookup = extraction_cache.version_lookup(file_url) if extraction_cache is not None else None
+        try:
+            download = stream_download(file_url, known=lookup)
+        except DownloadRejected as e:
+            return jsonify({"error": str(e)}), e.status
+        if download is None:
+            extraction = lookup.found[1]
+        else:
+            extraction, error = extract_download(download, file_url)
+            if extraction is None:
+                return jsonify({"error": f"Failed to extract text: {error}"}), 400
+        extracted_text = extraction.text
         
-        # Save to temporary file for processing
-        file_extension = title.split('.')[-1].lower() if '.' in title else 'unknown'
+        documents_store[document_id] = {
+            "id": document_id,
+            "title": title,
+            "file_url": file_url,
+            "processed_at": datetime.now().isoformat(),
+            "file_size": extraction.file_size,
+            "content_type": extraction.content_type,
+            "text_length": len(extracted_text),
+            "client_id": client_id,
+            **{field: data[field] for field in ("document_type", "category", "date") if data.get(field) is not None}
+        }
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as temp_file:
-            temp_file.write(response.content)
-            temp_file_path = temp_file.name
+        document_contents[document_id] = extracted_text
+        global documents_version
+        documents_version += 1
         
-        # Extract text based on file type
-        try:
-            if file_extension == 'pdf':
-                extracted_text = LightweightDocumentProcessor.extract_text_from_pdf(temp_file_path)
-            elif file_extension in ['docx', 'doc']:
-                extracted_text = LightweightDocumentProcessor.extract_text_from_docx(temp_file_path)
-            elif file_extension == 'txt':
-                extracted_text = LightweightDocumentProcessor.extract_text_from_txt(temp_file_path)
-            else:
-                extracted_text = "Unsupported file format. Supported: PDF, DOCX, TXT"
-            
-            # Clean up temp file
-            os.unlink(temp_file_path)
-            
-            # Store document
-            if extracted_text and not extracted_text.startswith("Error"):
-                documents_store[document_id] = {
-                    "id": document_id,
-                    "title": title,
-                    "file_url": file_url,
-                    "processed_at": datetime.now().isoformat(),
-                    "file_size": len(response.content),
-                    "content_type": response.headers.get('content-type', 'unknown'),
-                    "text_length": len(extracted_text),
-                    "client_id": client_id
-                }
-                
-                document_contents[document_id] = extracted_text
-                
-                logger.info(f"Successfully processed document: {title} ({len(extracted_text)} chars)")
-                
-                return jsonify({
-                    "success": True,
-                    "message": f"Document '{title}' successfully processed",
-                    "document_id": document_id,
-                    "text_length": len(extracted_text),
-                    "processed_at": documents_store[document_id]["processed_at"]
-                })
-            else:
-                return jsonify({"error": f"Failed to extract text: {extracted_text}"}), 400
-                
-        except Exception as e:
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            raise e
+        logger.info(f"Successfully processed document: {title} ({len(extracted_text)} chars)")
+        
+        return jsonify({
+            "success": True,
+            "message": f"Document '{title}' successfully processed",
+            "document_id": document_id,
+            "text_length": len(extracted_text),
+            "processed_at": documents_store[document_id]["processed_at"]
+        })
             
     except Exception as e:
         logger.error(f"Error processing document: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+def extract_download(download: StreamedDownload, file_url: str) -> Tuple[Optional[Extraction], str]:
+    """Extraction of a downloaded file, parsed only when no process has before; removes the temporary file"""
+    try:
+        if extraction_cache is None:
+            return parse_download(download)
+        extraction = extraction_cache.get(download.sha256)
+        if extraction is None:
+            with extraction_cache.parsing(download.sha256):
+                extraction = extraction_cache.get(download.sha256)
+                if extraction is None:
+                    extraction, error = parse_download(download)
+                    if extraction is None:
+                        return None, error
+                    extraction_cache.put(download.sha256, extraction)
+        extraction_cache.link(storage_path(file_url), download.etag, download.size, download.sha256)
+        return extraction, ""
+    finally:
+        download.cleanup()
+
+def parse_download(download: StreamedDownload) -> Tuple[Optional[Extraction], str]:
+    details = {"file_format": download.file_format, "file_size": download.size,
+               "content_type": download.content_type}
+    file_extension = download.file_format
+    if download.text is not None:
+        return Extraction(download.text, [0], parser="text", **details), ""
+    if file_extension == 'pdf':
+        try:
+            pages = LightweightDocumentProcessor.extract_pages_from_pdf(download.path)
+        except Exception as e:
+            logger.error(f"Error extracting PDF text: {e}")
+            return None, f"Error reading PDF: {str(e)}"
+        extraction = Extraction.from_pages(pages, parser="PyPDF2", **details)
+    elif file_extension in ['docx', 'doc']:
+        text = LightweightDocumentProcessor.extract_text_from_docx(download.path)
+        extraction = Extraction(text, [0], parser="python-docx", **details)
+    else:
+        text = LightweightDocumentProcessor.extract_text_from_txt(download.path)
+        extraction = Extraction(text, [0], parser="text", **details)
+    if not extraction.text or extraction.text.startswith("Error"):
+        return None, extraction.text
+    return extraction, ""
+
 @app.route('/chat', methods=['POST'])
 def chat():
     """Handle chat requests with document context"""
@@ -216,25 +379,46 @@ def chat():
         document_title = ""
         context = ""
         
-        if document_id and document_id in documents_store:
+        if document_id and document_id not in documents_store and bundle is not None \
+                and document_id in bundle.documents:
+            doc_info = bundle.documents[document_id]
+            document_title = doc_info['title']
+            
+            if client_id and str(doc_info.get('client_id')) != str(client_id):
+                return jsonify({"error": "Document not accessible for this client"}), 403
+            
+            context = bundle_context(question, [document_id])
+            answer = SimpleAnswerer.generate_answer(question, context, document_title)
+            
+        elif document_id and document_id in documents_store:
             doc_info = documents_store[document_id]
             document_title = doc_info['title']
             context = document_contents.get(document_id, "")
             
             # Filter by client if specified
-            if client_id and doc_info.get('client_id') != client_id:
+            if client_id and str(doc_info.get('client_id')) != str(client_id):
                 return jsonify({"error": "Document not accessible for this client"}), 403
             
             # Generate answer using OpenAI
             answer = SimpleAnswerer.generate_answer(question, context, document_title)
             
-        elif len(documents_store) > 0:
+        elif len(all_documents()) > 0:
             # Search across all documents
             all_context = ""
             doc_titles = []
             
+            if bundle is not None:
+                allowed = bundle_client_documents(client_id)
+                # Documents ingested into this instance replace their bundled version
+                shadowed = {doc_id for doc_id in documents_store if doc_id in bundle.documents}
+                if shadowed:
+                    allowed = [doc_id for doc_id in (bundle.documents if allowed is None else allowed)
+                               if doc_id not in shadowed]
+                if allowed is None or allowed:
+                    all_context += bundle_context(question, allowed, titled=True)
+            
             for doc_id, doc_info in documents_store.items():
-                if not client_id or doc_info.get('client_id') == client_id:
+                if not client_id or str(doc_info.get('client_id')) == str(client_id):
                     doc_titles.append(doc_info['title'])
                     all_context += f"\n\nDocument: {doc_info['title']}\n"
                     all_context += document_contents.get(doc_id, "")[:1000]  # Limit per document
@@ -252,7 +436,7 @@ def chat():
             "sources": [document_title] if document_title else [],
             "document_context": {
                 "selected_document": document_title if document_id else None,
-                "total_documents": len(documents_store)
+                "total_documents": len(all_documents())
             },
             "timestamp": datetime.now().isoformat()
         }
@@ -266,11 +450,11 @@ def chat():
 
 @app.route('/documents', methods=['GET'])
 def list_documents():
-    """List all processed documents"""
-    return jsonify({
-        "documents": list(documents_store.values()),
-        "total_count": len(documents_store)
-    })
+    """List processed documents, filtered and paged by the query parameters of DocumentTable.page"""
+    if document_table.source_key != (id(bundle), documents_version):
+        document_table.sync(all_documents(), (id(bundle), documents_version))
+    payload, status = document_table.page(request.args, DOCUMENT_PAGE_LIMIT)
+    return jsonify(payload), status
 
 @app.route('/documents/<document_id>/content', methods=['GET'])
 def get_document_content(document_id):
@@ -281,6 +465,12 @@ def get_document_content(document_id):
             "content": document_contents[document_id],
             "title": documents_store.get(document_id, {}).get('title', 'Unknown')
         })
+    elif bundle is not None and document_id in bundle.documents:
+        return jsonify({
+            "document_id": document_id,
+            "content": bundle.get_content(document_id),
+            "title": bundle.documents[document_id].get('title', 'Unknown')
+        })
     else:
         return jsonify({"error": "Document not found"}), 404
 